@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the shared SSE stream parser.
+
+Feeds a synthetic OpenAI-compatible chat completion stream through
+api.sse.ChatStreamParser and through the string-buffer loop the providers used
+before, and prints the CPU cost per token for each.
+
+Usage:
+    python scripts/bench_sse.py [--tokens 5000] [--read-size 4096] [--repeat 5]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+# Add src to the Python path for imports
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from api.sse import ChatStreamParser
+
+
+def build_stream(tokens):
+    """
+    Build a stream body with one SSE event per token, mixing ASCII and CJK text
+    """
+    words = ["Hello", " world", "，", "你好", "世界", " streaming", " 测试", "\n"]
+    body = bytearray()
+    for i in range(tokens):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "model": "bench",
+            "choices": [{"index": 0, "delta": {"content": words[i % len(words)]}, "finish_reason": None}],
+        }
+        body += b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n"
+    body += b"data: [DONE]\n\n"
+    return bytes(body)
+
+
+def split_reads(body, read_size):
+    """
+    Split the body into reads of read_size bytes, cutting through multi-byte characters
+    """
+    return [body[i:i + read_size] for i in range(0, len(body), read_size)]
+
+
+def run_shared_parser(reads):
+    parser = ChatStreamParser("bench")
+    parts = []
+    for data in reads:
+        for event in parser.feed(data):
+            parts.append(event.text)
+    for event in parser.flush():
+        parts.append(event.text)
+    return "".join(parts)
+
+
+def run_string_buffer(reads):
+    """
+    The per-provider loop this parser replaced: decode each read on its own and
+    re-slice a str buffer for every line
+    """
+    buffer = ""
+    parts = []
+    for data in reads:
+        buffer += data.decode("utf-8", errors="replace")
+        while "\n" in buffer:
+            pos = buffer.find("\n")
+            line = buffer[:pos]
+            buffer = buffer[pos + 1:]
+            if not line.startswith("data: "):
+                continue
+            line = line[6:].strip()
+            if line == "[DONE]":
+                return "".join(parts)
+            try:
+                delta = json.loads(line)["choices"][0]["delta"]
+            except ValueError:
+                continue
+            if delta.get("content"):
+                parts.append(delta["content"])
+    return "".join(parts)
+
+
+def measure(func, reads, repeat):
+    """
+    Run func over the reads and return the best CPU time and its output
+    """
+    best = None
+    output = None
+    for _ in range(repeat):
+        start = time.process_time()
+        output = func(reads)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, output
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SSE stream parsing")
+    parser.add_argument("--tokens", type=int, default=5000, help="Number of stream events")
+    parser.add_argument("--read-size", type=int, default=4096, help="Bytes per socket read")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per implementation, the best is reported")
+    args = parser.parse_args()
+
+    body = build_stream(args.tokens)
+    reads = split_reads(body, args.read_size)
+    print(f"{args.tokens} tokens, {len(body)} bytes in {len(reads)} reads of {args.read_size} bytes")
+
+    expected = run_shared_parser([body])
+    for name, func in (("shared parser", run_shared_parser), ("string buffer", run_string_buffer)):
+        elapsed, output = measure(func, reads, args.repeat)
+        status = "ok" if output == expected else "CORRUPTED OUTPUT"
+        print(f"{name:>14}: {elapsed * 1e6 / args.tokens:8.2f} us/token  ({elapsed * 1000:.1f} ms total, {status})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,357 @@
+import asyncio
+import logging
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .dns_cache import dns_cache
+
+logger = logging.getLogger("async_http")
+
+# Shared TLS context, creating one per connection reloads the CA bundle every time
+_ssl_context = None
+
+
+class SessionCachingContext(ssl.SSLContext):
+    """
+    Client TLS context that resumes the last session of each host
+
+    Neither asyncio nor http.client let callers pass a TLS session, but both
+    create their TLS objects through the context, so this context hands the
+    cached session of the server name to every new connection. A resumed
+    handshake skips the certificate exchange and saves a round trip on TLS 1.2.
+    Sessions only resume with the context that created them, so every
+    connection shares this one.
+    """
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        # The protocol is taken by SSLContext.__new__
+        super().__init__()
+        self.sessions = {}
+        self.stats = {'handshakes': 0, 'resumed': 0}
+        self._sessions_lock = threading.Lock()
+
+    def _session_for(self, server_side, server_hostname, session):
+        if session is None and not server_side and server_hostname:
+            with self._sessions_lock:
+                session = self.sessions.get(server_hostname)
+        return session
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return super().wrap_bio(
+            incoming, outgoing, server_side, server_hostname,
+            self._session_for(server_side, server_hostname, session)
+        )
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True, suppress_ragged_eofs=True,
+                    server_hostname=None, session=None):
+        return super().wrap_socket(
+            sock, server_side, do_handshake_on_connect, suppress_ragged_eofs, server_hostname,
+            self._session_for(server_side, server_hostname, session)
+        )
+
+    def remember(self, ssl_object, server_hostname):
+        """
+        Keep the session of an established connection for the next handshake
+
+        TLS 1.3 servers send session tickets after the handshake, so this is
+        called once a response has been read rather than right after connecting.
+
+        Args:
+            ssl_object (ssl.SSLObject or ssl.SSLSocket): The connection's TLS object
+            server_hostname (str): Host name the session belongs to
+        """
+        if ssl_object is None:
+            return
+        session = ssl_object.session
+        if session is not None:
+            with self._sessions_lock:
+                self.sessions[server_hostname] = session
+
+    def count_handshake(self, ssl_object):
+        """
+        Count a completed handshake and whether it resumed a session
+
+        Args:
+            ssl_object (ssl.SSLObject or ssl.SSLSocket): The connection's TLS object
+        """
+        if ssl_object is None:
+            return
+        with self._sessions_lock:
+            self.stats['handshakes'] += 1
+            if ssl_object.session_reused:
+                self.stats['resumed'] += 1
+
+
+def get_ssl_context():
+    """
+    Get the shared client TLS context
+
+    Returns:
+        SessionCachingContext: Default client context that resumes TLS sessions
+    """
+    global _ssl_context
+    if _ssl_context is None:
+        _ssl_context = SessionCachingContext(ssl.PROTOCOL_TLS_CLIENT)
+        _ssl_context.load_default_certs(ssl.Purpose.SERVER_AUTH)
+    return _ssl_context
+
+
+class AsyncHTTPError(Exception):
+    """
+    Raised when the server sends a malformed HTTP response
+    """
+    pass
+
+
+class AsyncHTTPResponse:
+    """
+    HTTP/1.1 response whose body is read incrementally from the connection
+    """
+    def __init__(self, connection, status, reason, headers):
+        """
+        Initialize the response
+
+        Args:
+            connection (AsyncHTTPConnection): Connection the response is read from
+            status (int): HTTP status code
+            reason (str): HTTP reason phrase
+            headers (dict): Response headers with lower-cased names
+        """
+        self.connection = connection
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.complete = False
+
+    @property
+    def will_close(self):
+        """
+        Whether the server will close the connection after this response
+        """
+        return self.headers.get('connection', '').lower() == 'close'
+
+    async def iter_chunks(self, chunk_size=4096, timeout=None, deadline=None):
+        """
+        Iterate over the response body as it arrives
+
+        Args:
+            chunk_size (int): Maximum read size for non-chunked bodies
+            timeout (float, optional): Idle timeout of each read, the connection's timeout if None
+            deadline (float, optional): time.monotonic() value no read may pass
+
+        Yields:
+            bytes: Pieces of the response body
+        """
+        reader = self.connection.reader
+        idle_timeout = self.connection.timeout if timeout is None else timeout
+
+        def read_timeout():
+            if deadline is None:
+                return idle_timeout
+            return max(0.0, min(idle_timeout, deadline - time.monotonic()))
+
+        if 'chunked' in self.headers.get('transfer-encoding', '').lower():
+            while True:
+                size_line = await asyncio.wait_for(reader.readline(), read_timeout())
+                if not size_line:
+                    raise AsyncHTTPError("Connection closed inside chunked body")
+                try:
+                    size = int(size_line.split(b';', 1)[0].strip(), 16)
+                except ValueError:
+                    raise AsyncHTTPError(f"Invalid chunk size line: {size_line[:40]!r}")
+                if size == 0:
+                    # Discard trailers up to the terminating blank line
+                    while True:
+                        line = await asyncio.wait_for(reader.readline(), read_timeout())
+                        if line in (b'\r\n', b'\n', b''):
+                            break
+                    break
+                data = await asyncio.wait_for(reader.readexactly(size + 2), read_timeout())
+                yield data[:-2]
+        elif 'content-length' in self.headers:
+            remaining = int(self.headers['content-length'])
+            while remaining > 0:
+                data = await asyncio.wait_for(reader.read(min(chunk_size, remaining)), read_timeout())
+                if not data:
+                    raise AsyncHTTPError("Connection closed before end of body")
+                remaining -= len(data)
+                yield data
+        else:
+            # No framing information, the body ends when the server closes the socket
+            while True:
+                data = await asyncio.wait_for(reader.read(chunk_size), read_timeout())
+                if not data:
+                    break
+                yield data
+            self.connection.close()
+
+        self.complete = True
+
+    async def read(self, timeout=None, deadline=None):
+        """
+        Read the whole response body
+
+        Args:
+            timeout (float, optional): Idle timeout of each read, the connection's timeout if None
+            deadline (float, optional): time.monotonic() value no read may pass
+
+        Returns:
+            bytes: The response body
+        """
+        parts = []
+        async for data in self.iter_chunks(timeout=timeout, deadline=deadline):
+            parts.append(data)
+        return b''.join(parts)
+
+
+class AsyncHTTPConnection:
+    """
+    Minimal HTTP/1.1 client connection built on asyncio streams
+    """
+    def __init__(self, host, port=None, use_ssl=True, timeout=30):
+        """
+        Initialize the connection
+
+        Args:
+            host (str): Server host name
+            port (int, optional): Server port, defaults to 443 for TLS and 80 otherwise
+            use_ssl (bool): Whether to wrap the socket in TLS
+            timeout (float): Timeout in seconds for connecting and for each read
+        """
+        self.host = host
+        self.port = port or (443 if use_ssl else 80)
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+
+    @classmethod
+    def from_url(cls, url, timeout=30):
+        """
+        Create a connection for the host of a URL
+
+        Args:
+            url (str): Absolute http(s) URL
+            timeout (float): Timeout in seconds
+
+        Returns:
+            tuple: (AsyncHTTPConnection, request path)
+        """
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        connection = cls(parts.hostname, parts.port, use_ssl=parts.scheme == 'https', timeout=timeout)
+        return connection, path
+
+    @property
+    def is_closed(self):
+        """
+        Whether the underlying socket is closed or was never opened
+        """
+        return self.writer is None or self.writer.is_closing()
+
+    async def connect(self, timeout=None):
+        """
+        Open the socket if it is not already open
+
+        Args:
+            timeout (float, optional): Connect timeout, the connection's timeout if None
+        """
+        if not self.is_closed:
+            return
+        ssl_context = get_ssl_context() if self.use_ssl else None
+        async with asyncio.timeout(self.timeout if timeout is None else timeout):
+            last_error = None
+            for _, address in await dns_cache.resolve(self.host, self.port):
+                try:
+                    # Connecting by address skips the resolver, SNI and certificate checks still use the host name
+                    self.reader, self.writer = await asyncio.open_connection(
+                        address,
+                        self.port,
+                        ssl=ssl_context,
+                        server_hostname=self.host if self.use_ssl else None
+                    )
+                    break
+                except OSError as e:
+                    last_error = e
+            else:
+                dns_cache.invalidate(self.host, self.port)
+                raise last_error or OSError(f"No addresses for {self.host}")
+        if ssl_context is not None:
+            ssl_context.count_handshake(self.writer.get_extra_info('ssl_object'))
+
+    async def request(self, method, path, body=None, headers=None, timeout=None):
+        """
+        Send a request and read the response status line and headers
+
+        Args:
+            method (str): HTTP method
+            path (str): Request path
+            body (bytes or str, optional): Request body
+            headers (dict, optional): Request headers
+            timeout (float, optional): Time allowed from sending the request
+                until the headers are read, the connection's timeout if None
+
+        Returns:
+            AsyncHTTPResponse: Response whose body has not been read yet
+        """
+        await self.connect()
+        if timeout is None:
+            timeout = self.timeout
+        loop = asyncio.get_running_loop()
+        first_byte_deadline = loop.time() + timeout
+
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        body = body or b''
+
+        request_headers = {
+            'Host': self.host,
+            'Connection': 'keep-alive',
+            'Accept-Encoding': 'identity',
+        }
+        if headers:
+            request_headers.update(headers)
+        request_headers['Content-Length'] = str(len(body))
+
+        head = f"{method} {path} HTTP/1.1\r\n"
+        head += ''.join(f"{name}: {value}\r\n" for name, value in request_headers.items())
+        head += "\r\n"
+
+        self.writer.write(head.encode('latin-1') + body)
+        await asyncio.wait_for(self.writer.drain(), timeout)
+
+        status_line = await asyncio.wait_for(self.reader.readline(), first_byte_deadline - loop.time())
+        if not status_line:
+            raise AsyncHTTPError("Connection closed before response status line")
+        try:
+            _, status, *reason = status_line.decode('latin-1').strip().split(' ', 2)
+            status = int(status)
+        except ValueError:
+            raise AsyncHTTPError(f"Invalid status line: {status_line[:80]!r}")
+
+        response_headers = {}
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), first_byte_deadline - loop.time())
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if self.use_ssl:
+            get_ssl_context().remember(self.writer.get_extra_info('ssl_object'), self.host)
+        return AsyncHTTPResponse(self, status, reason[0] if reason else '', response_headers)
+
+    def close(self):
+        """
+        Close the underlying socket
+        """
+        if self.writer is not None:
+            try:
+                self.writer.close()
+            except Exception as e:
+                logger.debug(f"Error closing connection to {self.host}: {e}")
+        self.reader = None
+        self.writer = None
@@ -1,6 +1,22 @@
 from abc import ABC, abstractmethod
+import asyncio
+import json
 import logging
+import threading
 import time
+from urllib.parse import urlsplit
+
+from core.config import config
+from core.executors import executors
+from core.request_context import get_request_context, get_timeouts
+from .async_http import AsyncHTTPError
+from .connection_pool import ConnectionPool, SyncConnectionPool
+from .key_pool import KeyPool
+from .endpoint_pool import EndpointPool
+from .prompt_templates import prompt_templates
+from .sse import ChatStreamParser
+from .stream_events import Error
+from .retry import parse_retry_after
 
 logger = logging.getLogger("llm_provider")
 
@@ -13,9 +29,142 @@ class LLMProvider(ABC):
         Initialize the LLM provider
         
         Args:
-            api_key (str, optional): API key
+            api_key (str or list, optional): API key, or several keys to spread requests over
         """
         self.api_key = api_key
+        # Providers set their default base URL, the client may replace it with several
+        self.base_url = None
+        self._pools = {}
+        # Called with the status and headers of every streamed response, e.g. by a rate limiter
+        self.on_response = None
+    
+    @property
+    def api_key(self):
+        """
+        The API key for the request being sent
+        
+        This is the key the client leased from the provider's key pool for the
+        current attempt, or the least loaded key outside of one.
+        """
+        return self.key_pool.current()
+    
+    @api_key.setter
+    def api_key(self, value):
+        self.key_pool = KeyPool(type(self).__name__, value, cooldown=config.llm_key_cooldown)
+    
+    @property
+    def base_url(self):
+        """
+        The base URL for the request being sent, e.g. "https://api.deepseek.com/v1"
+        
+        This is the endpoint the client chose for the current attempt, or the
+        best endpoint outside of one.
+        """
+        return self.endpoint_pool.current()
+    
+    @base_url.setter
+    def base_url(self, value):
+        self.endpoint_pool = EndpointPool(
+            type(self).__name__,
+            value,
+            max_failures=config.llm_endpoint_max_failures,
+            outlier_factor=config.llm_endpoint_outlier_factor,
+            ejection_seconds=config.llm_endpoint_ejection_seconds
+        )
+    
+    def get_connection_pool(self, url, timeout=60):
+        """
+        Get the provider-owned asyncio keep-alive pool for the host of a URL
+        
+        Args:
+            url (str): Any URL on the target host
+            timeout (float): Timeout in seconds for connecting and for each read
+            
+        Returns:
+            ConnectionPool: The pool, created on first use
+        """
+        parts = urlsplit(url)
+        key = ('async', parts.scheme, parts.hostname, parts.port)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = ConnectionPool(
+                parts.hostname,
+                parts.port,
+                use_ssl=parts.scheme == 'https',
+                max_connections=config.http_pool_max_connections,
+                idle_timeout=config.http_pool_idle_timeout,
+                timeout=timeout
+            )
+            self._pools[key] = pool
+        return pool
+    
+    def get_sync_connection_pool(self, host, timeout=60):
+        """
+        Get the provider-owned http.client keep-alive pool for an HTTPS host
+        
+        Args:
+            host (str): Server host name
+            timeout (float): Socket timeout in seconds
+            
+        Returns:
+            SyncConnectionPool: The pool, created on first use
+        """
+        key = ('sync', 'https', host, None)
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = SyncConnectionPool(
+                host,
+                max_connections=config.http_pool_max_connections,
+                idle_timeout=config.http_pool_idle_timeout,
+                timeout=timeout
+            )
+            self._pools[key] = pool
+        return pool
+    
+    def get_sync_endpoint(self, path):
+        """
+        Get the http.client keep-alive pool and request path for a path below the base URL
+        
+        Args:
+            path (str): Path relative to the base URL, e.g. "/chat/completions"
+            
+        Returns:
+            tuple: (SyncConnectionPool, absolute request path)
+        """
+        parts = urlsplit(self.base_url + path)
+        return self.get_sync_connection_pool(parts.hostname), parts.path
+    
+    def get_prompt_template(self, kwargs, default=None):
+        """
+        Get the compiled prompt template of a request
+        
+        Args:
+            kwargs (dict): Call parameters, the client attaches the template as "template"
+            default (str, optional): System prompt used when the call has none
+            
+        Returns:
+            PromptTemplate: The attached template, else the one compiled for the system prompt
+        """
+        template = kwargs.get('template')
+        if template is None:
+            template = prompt_templates.compile(kwargs.get('system_prompt', default), enhance=False)
+        return template
+    
+    def get_pool_stats(self):
+        """
+        Get hit/miss statistics for every connection pool owned by this provider
+        
+        Returns:
+            dict: Pool statistics keyed by "<kind>:<host>"
+        """
+        return {f"{kind}:{host}": pool.get_stats() for (kind, _, host, _), pool in self._pools.items()}
+    
+    def close_pools(self):
+        """
+        Close all idle pooled connections
+        """
+        for pool in self._pools.values():
+            pool.close()
     
     def log_request(self, provider_name, prompt, **kwargs):
         """
@@ -86,6 +235,125 @@ class LLMProvider(ABC):
             **kwargs: Additional provider-specific parameters
             
         Returns:
-            Generator: Chunks of the generated text response
+            Generator: Stream events (TextDelta, ReasoningDelta, Usage, Finish, Error)
         """
-        pass
\ No newline at end of file
+        pass
+    
+    async def call_stream_async(self, prompt, **kwargs):
+        """
+        Call the LLM API with native asyncio streaming support
+        
+        Providers should override this with an implementation that never blocks
+        the event loop. The default drives the blocking call_stream generator from
+        the LLM executor so providers without a native implementation keep working.
+        If the consumer stops early, the worker closes the generator after its
+        current chunk instead of reading the rest of the response.
+        
+        Args:
+            prompt (str): The prompt to send to the API
+            **kwargs: Additional provider-specific parameters
+            
+        Yields:
+            StreamEvent: TextDelta, ReasoningDelta, Usage, Finish or Error events
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+        stopped = threading.Event()
+        
+        def produce():
+            stream = self.call_stream(prompt, **kwargs)
+            try:
+                for chunk in stream:
+                    if stopped.is_set():
+                        break
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except Exception as e:
+                logger.error(f"Error in threaded stream bridge: {e}")
+                loop.call_soon_threadsafe(queue.put_nowait, Error(f"Error streaming from provider: {str(e)}"))
+            finally:
+                # Closing the generator releases the provider's HTTP response
+                if hasattr(stream, 'close'):
+                    stream.close()
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+        
+        worker = asyncio.ensure_future(executors.run('llm', produce))
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is done:
+                    break
+                yield chunk
+            await worker
+        finally:
+            stopped.set()
+    
+    async def _stream_chat_completions(self, provider_name, url, payload, headers):
+        """
+        POST an OpenAI-compatible chat completion request and stream the content deltas
+        
+        Connect, first byte and idle timeouts come from the configuration and
+        are shortened to the deadline of the request being served, if any.
+        
+        Args:
+            provider_name (str): Name of the provider, used in logs and error messages
+            url (str): Absolute URL of the chat completions endpoint
+            payload (dict or bytes): Request payload, "stream" is forced on for a
+                dictionary, an encoded payload must already set it
+            headers (dict): Request headers including authorization
+            
+        Yields:
+            StreamEvent: Events parsed from each delta, or a single Error event
+        """
+        body = payload if isinstance(payload, bytes) else json.dumps(dict(payload, stream=True))
+        parts = urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        pool = self.get_connection_pool(url)
+        timeouts = get_timeouts()
+        
+        try:
+            async with pool.connection(timeouts.connect) as connection:
+                response = await connection.request(
+                    "POST", path, body, headers, timeout=timeouts.first_byte
+                )
+                if self.on_response is not None:
+                    self.on_response(response.status, response.headers)
+                
+                if response.status != 200:
+                    error_data = (await response.read(timeouts.idle, timeouts.deadline)).decode('utf-8', errors='replace')
+                    connection.reusable = not response.will_close
+                    logger.error(f"{provider_name} API returned error {response.status}: {error_data[:200]}")
+                    yield Error(
+                        f"Error from {provider_name} API: {response.status} - {error_data}",
+                        status=response.status,
+                        retry_after=parse_retry_after(response.headers.get('retry-after'))
+                    )
+                    return
+                
+                parser = ChatStreamParser(provider_name)
+                async for data in response.iter_chunks(timeout=timeouts.idle, deadline=timeouts.deadline):
+                    if parser.done:
+                        # Drain the end of the body so the connection can be reused
+                        continue
+                    for event in parser.feed(data):
+                        yield event
+                
+                for event in parser.flush():
+                    yield event
+                
+                connection.reusable = response.complete and not response.will_close
+        except asyncio.TimeoutError:
+            context = get_request_context()
+            if context is not None and context.expired:
+                # Retrying cannot help once the request's own deadline passed
+                logger.error(f"Request deadline of {context.timeout:.0f}s passed while streaming from {provider_name} API")
+                yield Error(f"Error streaming from {provider_name} API: the request took longer than {context.timeout:.0f}s")
+            else:
+                logger.error(f"Timed out streaming from {provider_name} API")
+                yield Error(f"Error streaming from {provider_name} API: request timed out", transient=True)
+        except (OSError, asyncio.IncompleteReadError, AsyncHTTPError) as e:
+            logger.error(f"Connection error streaming from {provider_name} API: {e}")
+            yield Error(f"Error streaming from {provider_name} API: {str(e)}", transient=True)
+        except Exception as e:
+            logger.error(f"Error streaming from {provider_name} API: {e}")
+            yield Error(f"Error streaming from {provider_name} API: {str(e)}")
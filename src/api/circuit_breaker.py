@@ -0,0 +1,152 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger("circuit_breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Per-provider circuit breaker driven by a rolling error and slow-call rate
+
+    While closed, outcomes of the last `window` seconds are kept. Once at least
+    `min_requests` calls were seen and the share of failed or slow calls
+    reaches `failure_rate`, the circuit opens and user requests are refused so
+    callers can fail over instantly. After `open_seconds` it becomes half-open:
+    user requests are still refused and a background probe decides whether the
+    circuit closes again or reopens.
+    """
+    def __init__(self, name, failure_rate=0.5, min_requests=5, window=60, open_seconds=30, slow_call_seconds=20):
+        """
+        Initialize the breaker
+
+        Args:
+            name (str): Provider name, used in logs
+            failure_rate (float): Share of failed or slow calls that opens the circuit
+            min_requests (int): Calls needed in the window before the rate is trusted
+            window (float): Seconds of history considered
+            open_seconds (float): Seconds the circuit stays open before probing
+            slow_call_seconds (float): Calls slower than this to first token count as failures
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.window = window
+        self.open_seconds = open_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._outcomes = deque()  # (timestamp, failed)
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        while self._outcomes and now - self._outcomes[0][0] > self.window:
+            self._outcomes.popleft()
+
+    def _update_state(self, now):
+        """
+        Move an open circuit to half-open once its open period is over, lock must be held
+        """
+        if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+            self.state = HALF_OPEN
+            logger.info(f"Circuit for {self.name} is half-open, waiting for a probe")
+
+    def allow_request(self):
+        """
+        Check whether a user request may be sent to the provider
+
+        Returns:
+            bool: True only while the circuit is closed
+        """
+        with self._lock:
+            self._update_state(time.monotonic())
+            return self.state == CLOSED
+
+    def needs_probe(self):
+        """
+        Check whether the background prober should test the provider
+
+        Returns:
+            bool: True while the circuit is half-open
+        """
+        with self._lock:
+            self._update_state(time.monotonic())
+            return self.state == HALF_OPEN
+
+    def record_success(self, latency=None):
+        """
+        Record a successful call
+
+        Args:
+            latency (float, optional): Seconds to first token, slow calls count as failures
+        """
+        slow = latency is not None and latency > self.slow_call_seconds
+        self._record(failed=slow)
+
+    def record_failure(self):
+        """
+        Record a failed call
+        """
+        self._record(failed=True)
+
+    def _record(self, failed):
+        now = time.monotonic()
+        with self._lock:
+            if self.state != CLOSED:
+                # Only probes decide when a non-closed circuit recovers
+                return
+            self._outcomes.append((now, failed))
+            self._trim(now)
+            if len(self._outcomes) < self.min_requests:
+                return
+            failures = sum(1 for _, outcome in self._outcomes if outcome)
+            if failures / len(self._outcomes) >= self.failure_rate:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        self._outcomes.clear()
+        logger.warning(f"Circuit for {self.name} opened, failing over for {self.open_seconds} seconds")
+
+    def record_probe(self, success):
+        """
+        Record the result of a background probe
+
+        Args:
+            success (bool): Whether the probe got a valid response
+        """
+        with self._lock:
+            if success:
+                self.state = CLOSED
+                self._outcomes.clear()
+                logger.info(f"Probe succeeded, circuit for {self.name} closed")
+            else:
+                self._open(time.monotonic())
+
+    def get_stats(self):
+        """
+        Get the breaker state
+
+        Returns:
+            dict: State, failure rate in the window and how often it opened
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._update_state(now)
+            self._trim(now)
+            total = len(self._outcomes)
+            failures = sum(1 for _, outcome in self._outcomes if outcome)
+            return {
+                'state': self.state,
+                'requests': total,
+                'failure_rate': failures / total if total else 0.0,
+                'times_opened': self.times_opened,
+            }
@@ -0,0 +1,402 @@
+import asyncio
+import http.client
+import logging
+import select
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from .async_http import AsyncHTTPConnection, get_ssl_context
+from .dns_cache import dns_cache
+
+logger = logging.getLogger("connection_pool")
+
+
+class PoolStats:
+    """
+    Counters describing how well a connection pool is reused
+    """
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.in_use = 0
+        self.warmed = 0
+
+    def to_dict(self, idle=0):
+        """
+        Get the counters as a dictionary
+
+        Args:
+            idle (int): Number of idle connections currently held by the pool
+
+        Returns:
+            dict: Pool statistics including the hit ratio
+        """
+        checkouts = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'stale': self.stale,
+            'in_use': self.in_use,
+            'idle': idle,
+            'warmed': self.warmed,
+            'hit_ratio': self.hits / checkouts if checkouts else 0.0,
+        }
+
+
+def _socket_is_stale(sock):
+    """
+    Check whether an idle socket was closed or written to by the server
+
+    An idle keep-alive socket should have nothing to read. If select reports it
+    readable, the server either closed it or sent unsolicited data, and in both
+    cases it cannot carry another request.
+
+    Args:
+        sock (socket.socket): The socket to check
+
+    Returns:
+        bool: True if the socket should be discarded
+    """
+    if sock is None:
+        return True
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable)
+    except (OSError, ValueError):
+        return True
+
+
+class ConnectionPool:
+    """
+    Keep-alive pool of asyncio HTTP connections to a single host
+    """
+    def __init__(self, host, port=None, use_ssl=True, max_connections=10, idle_timeout=60, timeout=30):
+        """
+        Initialize the pool
+
+        Args:
+            host (str): Server host name
+            port (int, optional): Server port
+            use_ssl (bool): Whether connections use TLS
+            max_connections (int): Maximum concurrent connections to the host
+            idle_timeout (float): Seconds an idle connection is kept before being closed
+            timeout (float): Timeout in seconds for connecting and for each read
+        """
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._idle = []  # (connection, released_at), most recently used last
+        self._slots = asyncio.Semaphore(max_connections)
+
+    def _is_healthy(self, connection, released_at):
+        """
+        Health check run on every checkout of an idle connection
+        """
+        if time.monotonic() - released_at > self.idle_timeout:
+            return False
+        if connection.is_closed or connection.reader.at_eof():
+            return False
+        return not _socket_is_stale(connection.writer.get_extra_info('socket'))
+
+    async def acquire(self, connect_timeout=None):
+        """
+        Check out a connection, reusing a healthy idle one when possible
+
+        Waits while max_connections connections are already in use. The wait
+        for a free slot and opening a new connection share one timeout.
+
+        Args:
+            connect_timeout (float, optional): Timeout for getting a slot and
+                opening a new connection, the pool's timeout if None
+
+        Returns:
+            AsyncHTTPConnection: A connected connection
+
+        Raises:
+            asyncio.TimeoutError: If no connection was ready in time
+        """
+        timeout = self.timeout if connect_timeout is None else connect_timeout
+        deadline = asyncio.get_running_loop().time() + timeout
+        async with asyncio.timeout_at(deadline):
+            await self._slots.acquire()
+        try:
+            while self._idle:
+                connection, released_at = self._idle.pop()
+                if self._is_healthy(connection, released_at):
+                    self.stats.hits += 1
+                    self.stats.in_use += 1
+                    return connection
+                self.stats.stale += 1
+                connection.close()
+
+            self.stats.misses += 1
+            connection = AsyncHTTPConnection(self.host, self.port, use_ssl=self.use_ssl, timeout=self.timeout)
+            async with asyncio.timeout_at(deadline):
+                await connection.connect()
+            self.stats.in_use += 1
+            return connection
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, connection, reusable=True):
+        """
+        Return a connection to the pool
+
+        Args:
+            connection (AsyncHTTPConnection): Connection obtained from acquire
+            reusable (bool): False if the last response was not fully read or
+                the server asked to close the connection
+        """
+        self.stats.in_use -= 1
+        self._slots.release()
+        if reusable and not connection.is_closed:
+            self._idle.append((connection, time.monotonic()))
+        else:
+            connection.close()
+
+    @asynccontextmanager
+    async def connection(self, connect_timeout=None):
+        """
+        Context manager that checks a connection out and always returns it
+
+        The connection is only kept for reuse if the caller sets
+        connection.reusable to True before leaving the block.
+
+        Args:
+            connect_timeout (float, optional): Timeout for getting a slot and
+                opening a new connection, the pool's timeout if None
+
+        Yields:
+            AsyncHTTPConnection: A connected connection
+        """
+        connection = await self.acquire(connect_timeout)
+        connection.reusable = False
+        try:
+            yield connection
+        finally:
+            self.release(connection, reusable=connection.reusable)
+
+    def prune(self):
+        """
+        Close idle connections that expired or were closed by the server
+
+        Returns:
+            int: Number of healthy idle connections left
+        """
+        healthy = []
+        for connection, released_at in self._idle:
+            if self._is_healthy(connection, released_at):
+                healthy.append((connection, released_at))
+            else:
+                self.stats.stale += 1
+                connection.close()
+        self._idle = healthy
+        return len(healthy)
+
+    async def warm(self, count=1, connect_timeout=None):
+        """
+        Open connections until count healthy ones are idle
+
+        Nothing is opened while every slot is in use, busy pools stay warm on
+        their own. Connection errors are left to the caller.
+
+        Args:
+            count (int): Idle connections to keep open
+            connect_timeout (float, optional): Timeout for opening a connection,
+                the pool's timeout if None
+
+        Returns:
+            int: Number of connections opened
+        """
+        opened = 0
+        while self.prune() < min(count, self.max_connections) and not self._slots.locked():
+            connection = AsyncHTTPConnection(self.host, self.port, use_ssl=self.use_ssl, timeout=self.timeout)
+            await connection.connect(connect_timeout)
+            self.stats.warmed += 1
+            self._idle.append((connection, time.monotonic()))
+            opened += 1
+        return opened
+
+    async def keep_alive(self, path='/'):
+        """
+        Send a small request on every idle connection so the server keeps it open
+
+        Servers close keep-alive connections after their own idle timeout,
+        which may be shorter than the pool's. Connections that answer in full
+        go back to the pool as freshly used, the others are closed.
+
+        Args:
+            path (str): Request path, any cheap unauthenticated GET works
+        """
+        idle, self._idle = self._idle, []
+        for connection, released_at in idle:
+            if not self._is_healthy(connection, released_at):
+                self.stats.stale += 1
+                connection.close()
+                continue
+            try:
+                response = await connection.request("GET", path, timeout=self.timeout)
+                await response.read()
+                reusable = response.complete and not response.will_close
+            except (OSError, asyncio.TimeoutError) as e:
+                logger.debug(f"Keep-alive probe to {self.host} failed: {e}")
+                reusable = False
+            if reusable:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                connection.close()
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        while self._idle:
+            connection, _ = self._idle.pop()
+            connection.close()
+
+    def get_stats(self):
+        """
+        Get the pool statistics
+
+        Returns:
+            dict: Pool statistics
+        """
+        return self.stats.to_dict(idle=len(self._idle))
+
+
+class SyncConnectionPool:
+    """
+    Thread-safe keep-alive pool of http.client connections to a single host
+    """
+    def __init__(self, host, port=None, use_ssl=True, max_connections=10, idle_timeout=60, timeout=30):
+        """
+        Initialize the pool
+
+        Args:
+            host (str): Server host name
+            port (int, optional): Server port
+            use_ssl (bool): Whether connections use TLS
+            max_connections (int): Maximum concurrent connections to the host
+            idle_timeout (float): Seconds an idle connection is kept before being closed
+            timeout (float): Socket timeout in seconds
+        """
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._idle = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+
+    def _new_connection(self):
+        """
+        Create a new (lazily connected) http.client connection
+        """
+        if self.use_ssl:
+            connection = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout, context=get_ssl_context())
+        else:
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        # Resolve through the shared cache instead of the blocking resolver on every connect
+        connection._create_connection = dns_cache.create_connection
+        return connection
+
+    def acquire(self, timeout=None):
+        """
+        Check out a connection, reusing a healthy idle one when possible
+
+        Blocks while max_connections connections are already in use.
+
+        Args:
+            timeout (float, optional): Longest wait for a free slot, the pool's
+                timeout if None
+
+        Returns:
+            http.client.HTTPConnection: A connection ready for a request
+
+        Raises:
+            TimeoutError: If no slot became free in time
+        """
+        timeout = self.timeout if timeout is None else timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No free connection to {self.host} within {timeout:g}s")
+        with self._lock:
+            while self._idle:
+                connection, released_at = self._idle.pop()
+                if time.monotonic() - released_at <= self.idle_timeout and not _socket_is_stale(connection.sock):
+                    self.stats.hits += 1
+                    self.stats.in_use += 1
+                    return connection
+                self.stats.stale += 1
+                connection.close()
+            self.stats.misses += 1
+            self.stats.in_use += 1
+        return self._new_connection()
+
+    def release(self, connection, reusable=True):
+        """
+        Return a connection to the pool
+
+        Args:
+            connection (http.client.HTTPConnection): Connection obtained from acquire
+            reusable (bool): False if the last response was not fully read
+        """
+        if self.use_ssl and connection.sock is not None:
+            get_ssl_context().remember(connection.sock, self.host)
+        with self._lock:
+            self.stats.in_use -= 1
+            if reusable and connection.sock is not None:
+                self._idle.append((connection, time.monotonic()))
+            else:
+                connection.close()
+        self._slots.release()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Context manager that checks a connection out and always returns it
+
+        The connection is only kept for reuse if the caller sets
+        connection.reusable to True before leaving the block.
+
+        Args:
+            timeout (float, optional): Longest wait for a free slot, the pool's
+                timeout if None
+
+        Yields:
+            http.client.HTTPConnection: A connection ready for a request
+        """
+        connection = self.acquire(timeout)
+        connection.reusable = False
+        try:
+            yield connection
+        finally:
+            self.release(connection, reusable=connection.reusable)
+
+    def close(self):
+        """
+        Close all idle connections
+        """
+        with self._lock:
+            while self._idle:
+                connection, _ = self._idle.pop()
+                connection.close()
+
+    def get_stats(self):
+        """
+        Get the pool statistics
+
+        Returns:
+            dict: Pool statistics
+        """
+        with self._lock:
+            return self.stats.to_dict(idle=len(self._idle))
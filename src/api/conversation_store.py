@@ -0,0 +1,440 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import aclosing
+
+from core.executors import executors
+
+from .stream_events import StreamAccumulator
+from .token_budget import token_estimator, trim_middle
+
+logger = logging.getLogger("conversation_store")
+
+# Bytes of bookkeeping counted per stored message and per indexed message ID
+TURN_OVERHEAD = 96
+MESSAGE_ID_OVERHEAD = 40
+
+
+class Conversation:
+    """
+    Recent turns of one reply thread, oldest first
+    """
+    __slots__ = ('command', 'turns', 'tokens', 'size', 'message_ids', 'updated_at')
+
+    def __init__(self, command=None):
+        self.command = command
+        self.turns = deque()  # (role, content, tokens)
+        self.tokens = 0
+        self.size = 0
+        self.message_ids = []
+        self.updated_at = time.time()
+
+    def add(self, role, content):
+        tokens = token_estimator.estimate(content)
+        self.turns.append((role, content, tokens))
+        self.tokens += tokens
+        self.size += len(content.encode('utf-8')) + TURN_OVERHEAD
+
+    def drop_oldest(self):
+        _, content, tokens = self.turns.popleft()
+        self.tokens -= tokens
+        self.size -= len(content.encode('utf-8')) + TURN_OVERHEAD
+
+    def messages(self):
+        """
+        Get the turns as chat messages
+
+        Returns:
+            list: {"role", "content"} dictionaries, oldest first
+        """
+        return [{"role": role, "content": content} for role, content, _ in self.turns]
+
+
+class ConversationDisk:
+    """
+    SQLite tier holding conversations evicted from memory
+    """
+    def __init__(self, path, ttl):
+        """
+        Open (or create) the conversation database
+
+        Args:
+            path (str): Database file path
+            ttl (float): Seconds an idle conversation is kept
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversations (chat_id INTEGER NOT NULL, thread_id INTEGER NOT NULL, "
+                "command TEXT, turns TEXT NOT NULL, updated_at REAL NOT NULL, PRIMARY KEY (chat_id, thread_id))"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_messages (chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, "
+                "thread_id INTEGER NOT NULL, PRIMARY KEY (chat_id, message_id))"
+            )
+            self._purge()
+
+    def _purge(self):
+        """
+        Delete conversations idle for longer than the TTL, lock must be held
+        """
+        self._db.execute("DELETE FROM conversations WHERE updated_at < ?", (time.time() - self.ttl,))
+        self._db.execute(
+            "DELETE FROM conversation_messages WHERE NOT EXISTS (SELECT 1 FROM conversations c "
+            "WHERE c.chat_id = conversation_messages.chat_id AND c.thread_id = conversation_messages.thread_id)"
+        )
+
+    def find_thread(self, chat_id, message_id):
+        """
+        Look up the thread a message belongs to
+
+        Args:
+            chat_id (int): Chat ID
+            message_id (int): Message ID
+
+        Returns:
+            int: The thread ID, or None if the message is not part of a stored conversation
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT thread_id FROM conversation_messages WHERE chat_id = ? AND message_id = ?", (chat_id, message_id)
+            ).fetchone()
+        return row[0] if row else None
+
+    def take(self, chat_id, thread_id):
+        """
+        Remove a conversation so it can move back into memory
+
+        Args:
+            chat_id (int): Chat ID
+            thread_id (int): Thread ID
+
+        Returns:
+            tuple: (command, turns, message IDs, updated_at), or None if missing or expired
+        """
+        with self._lock, self._db:
+            row = self._db.execute(
+                "SELECT command, turns, updated_at FROM conversations WHERE chat_id = ? AND thread_id = ? AND updated_at >= ?",
+                (chat_id, thread_id, time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            message_ids = [
+                message_id for (message_id,) in self._db.execute(
+                    "SELECT message_id FROM conversation_messages WHERE chat_id = ? AND thread_id = ?", (chat_id, thread_id)
+                )
+            ]
+            self._db.execute("DELETE FROM conversations WHERE chat_id = ? AND thread_id = ?", (chat_id, thread_id))
+            self._db.execute("DELETE FROM conversation_messages WHERE chat_id = ? AND thread_id = ?", (chat_id, thread_id))
+        return row[0], json.loads(row[1]), message_ids, row[2]
+
+    def put(self, chat_id, thread_id, conversation):
+        """
+        Store a conversation evicted from memory
+
+        Args:
+            chat_id (int): Chat ID
+            thread_id (int): Thread ID
+            conversation (Conversation): The conversation
+        """
+        turns = json.dumps([[role, content] for role, content, _ in conversation.turns], ensure_ascii=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO conversations (chat_id, thread_id, command, turns, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, thread_id, conversation.command, turns, conversation.updated_at)
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO conversation_messages (chat_id, message_id, thread_id) VALUES (?, ?, ?)",
+                [(chat_id, message_id, thread_id) for message_id in conversation.message_ids]
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._purge()
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self._lock:
+            self._db.close()
+
+
+class ConversationStore:
+    """
+    Recent turns of every reply thread, so follow-up questions carry their context
+
+    A thread is keyed by (chat ID, ID of the message that started it), and
+    every prompt and answer message of the thread is indexed, so replying to
+    any of them continues the thread without fetching chat history. Each
+    thread keeps a ring buffer of turns bounded by a token budget, oldest
+    turns dropping out first. All threads share a memory cap enforced by
+    least recently used eviction, and evicted threads optionally spill to a
+    SQLite tier they are promoted back from on their next reply. Queries of
+    that tier run on the file_io executor, never on the event loop.
+    """
+    def __init__(self, max_tokens=3000, max_turns=20, max_bytes=16 * 1024 * 1024, ttl=86400, disk_path=None):
+        """
+        Initialize the store
+
+        Args:
+            max_tokens (int): Token budget of the history sent with a follow-up
+            max_turns (int): Question and answer pairs kept per thread
+            max_bytes (int): Memory cap for all threads
+            ttl (float): Seconds an idle thread is kept
+            disk_path (str, optional): SQLite file for evicted threads, disabled if empty
+        """
+        self.max_tokens = max_tokens
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = {'continued': 0, 'started': 0, 'evicted': 0, 'spilled': 0, 'promoted': 0, 'expired': 0}
+        self._threads = OrderedDict()  # (chat_id, thread_id) -> Conversation, least recently used first
+        self._index = {}  # (chat_id, message_id) -> thread_id of threads in memory
+        self._size = 0
+        self._lock = threading.Lock()
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = ConversationDisk(disk_path, ttl)
+            except sqlite3.Error as e:
+                logger.error(f"Could not open conversation database at {disk_path}, using memory only: {e}")
+
+    async def thread_for(self, chat_id, message_id, reply_to=None):
+        """
+        Get the thread a new prompt belongs to
+
+        Args:
+            chat_id (int): Chat ID
+            message_id (int): ID of the prompt message
+            reply_to (int, optional): ID of the message the prompt replies to
+
+        Returns:
+            tuple: (chat ID, thread ID), the replied-to message's thread if it
+                has one, else a new thread started by the prompt
+        """
+        if reply_to is not None:
+            thread_id = await self._find_thread(chat_id, reply_to)
+            if thread_id is not None:
+                self.stats['continued'] += 1
+                return (chat_id, thread_id)
+        self.stats['started'] += 1
+        return (chat_id, message_id)
+
+    async def _find_thread(self, chat_id, message_id):
+        with self._lock:
+            thread_id = self._index.get((chat_id, message_id))
+        if thread_id is None and self.disk is not None:
+            try:
+                thread_id = await executors.run('file_io', self.disk.find_thread, chat_id, message_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Conversation lookup failed: {e}")
+        return thread_id
+
+    async def _get(self, key):
+        """
+        Get a thread from memory, promoting it from disk if needed
+
+        Args:
+            key (tuple): (chat ID, thread ID)
+
+        Returns:
+            Conversation: The thread, or None if unknown or expired
+        """
+        with self._lock:
+            conversation = self._threads.get(key)
+            if conversation is not None:
+                if conversation.updated_at >= time.time() - self.ttl:
+                    self._threads.move_to_end(key)
+                    return conversation
+                self._remove(key)
+                self.stats['expired'] += 1
+                return None
+        if self.disk is None:
+            return None
+        try:
+            stored = await executors.run('file_io', self.disk.take, *key)
+        except sqlite3.Error as e:
+            logger.warning(f"Conversation load failed: {e}")
+            return None
+        if stored is None:
+            # A concurrent lookup may have promoted it while this one waited
+            with self._lock:
+                return self._threads.get(key)
+        command, turns, message_ids, updated_at = stored
+        conversation = Conversation(command)
+        for role, content in turns:
+            conversation.add(role, content)
+        conversation.message_ids = message_ids
+        conversation.updated_at = updated_at
+        with self._lock:
+            self.stats['promoted'] += 1
+            spilled = self._insert(key, conversation)
+        await self._spill(spilled)
+        return conversation
+
+    async def history(self, key):
+        """
+        Get the earlier turns of a thread
+
+        Args:
+            key (tuple): Thread key from thread_for()
+
+        Returns:
+            list: {"role", "content"} messages, oldest first, empty for a new thread
+        """
+        conversation = await self._get(key)
+        return conversation.messages() if conversation is not None else []
+
+    async def command(self, chat_id, message_id):
+        """
+        Get the command whose thread a message belongs to
+
+        Args:
+            chat_id (int): Chat ID
+            message_id (int): Message ID
+
+        Returns:
+            str: The command that started the thread, or None if the message is in no thread
+        """
+        thread_id = await self._find_thread(chat_id, message_id)
+        if thread_id is None:
+            return None
+        conversation = await self._get((chat_id, thread_id))
+        return conversation.command if conversation is not None else None
+
+    async def append(self, key, prompt, answer, message_ids=(), command=None):
+        """
+        Add a question and its answer to a thread
+
+        Args:
+            key (tuple): Thread key from thread_for()
+            prompt (str): The user's prompt
+            answer (str): The complete answer
+            message_ids (iterable): IDs of the prompt and answer messages, replies to which continue the thread
+            command (str, optional): Command that produced the answer
+        """
+        conversation = await self._get(key) or Conversation(command)
+        with self._lock:
+            old_size = conversation.size + len(conversation.message_ids) * MESSAGE_ID_OVERHEAD
+            conversation.add('user', prompt)
+            conversation.add('assistant', answer)
+            conversation.command = conversation.command or command
+            conversation.updated_at = time.time()
+            # Drop whole question and answer pairs, the latest one always stays
+            while len(conversation.turns) > 2 and (
+                len(conversation.turns) > 2 * self.max_turns or conversation.tokens > self.max_tokens
+            ):
+                conversation.drop_oldest()
+                conversation.drop_oldest()
+            if conversation.tokens > self.max_tokens:
+                self._shrink_latest(conversation)
+            for message_id in message_ids:
+                if message_id is not None and message_id not in conversation.message_ids:
+                    conversation.message_ids.append(message_id)
+                    self._index[(key[0], message_id)] = key[1]
+            if key in self._threads:
+                self._size += conversation.size + len(conversation.message_ids) * MESSAGE_ID_OVERHEAD - old_size
+                self._threads.move_to_end(key)
+                spilled = self._evict(keep=key)
+            else:
+                spilled = self._insert(key, conversation)
+        await self._spill(spilled)
+
+    def _shrink_latest(self, conversation):
+        """
+        Cut the middle of the latest answer so the thread fits its token budget
+        """
+        _, answer, tokens = conversation.turns[-1]
+        conversation.turns.pop()
+        conversation.tokens -= tokens
+        conversation.size -= len(answer.encode('utf-8')) + TURN_OVERHEAD
+        room = max(0, self.max_tokens - conversation.tokens)
+        conversation.add('assistant', trim_middle(answer, int(len(answer) * room / max(1, tokens))))
+
+    def _insert(self, key, conversation):
+        """
+        Add a thread to memory and evict down to max_bytes, lock must be held
+
+        Returns:
+            list: Evicted (key, conversation) pairs to spill to disk
+        """
+        self._threads[key] = conversation
+        self._size += conversation.size + len(conversation.message_ids) * MESSAGE_ID_OVERHEAD
+        for message_id in conversation.message_ids:
+            self._index[(key[0], message_id)] = key[1]
+        return self._evict(keep=key)
+
+    def _evict(self, keep):
+        """
+        Evict least recently used threads until memory fits, lock must be held
+        """
+        evicted = []
+        while self._size > self.max_bytes and len(self._threads) > 1:
+            key = next(iter(self._threads))
+            if key == keep:
+                self._threads.move_to_end(key)
+                continue
+            evicted.append((key, self._remove(key)))
+            self.stats['evicted'] += 1
+        return evicted
+
+    def _remove(self, key):
+        """
+        Remove a thread and its message index entries, lock must be held
+        """
+        conversation = self._threads.pop(key)
+        self._size -= conversation.size + len(conversation.message_ids) * MESSAGE_ID_OVERHEAD
+        for message_id in conversation.message_ids:
+            if self._index.get((key[0], message_id)) == key[1]:
+                del self._index[(key[0], message_id)]
+        return conversation
+
+    async def _spill(self, evicted):
+        if self.disk is None:
+            return
+        for (chat_id, thread_id), conversation in evicted:
+            try:
+                await executors.run('file_io', self.disk.put, chat_id, thread_id, conversation)
+                self.stats['spilled'] += 1
+            except sqlite3.Error as e:
+                logger.warning(f"Conversation spill failed: {e}")
+
+    async def record_stream(self, key, prompt, stream, message_ids=(), command=None):
+        """
+        Pass a stream through and add its answer to the thread once it completes
+
+        Streams that fail or are abandoned leave the thread unchanged.
+
+        Args:
+            key (tuple): Thread key from thread_for()
+            prompt (str): The user's prompt
+            stream: Async iterator of stream events
+            message_ids (iterable): IDs of the prompt and answer messages
+            command (str, optional): Command producing the answer
+
+        Yields:
+            StreamEvent: The stream's events
+        """
+        answer = StreamAccumulator()
+        async with aclosing(stream):
+            async for event in stream:
+                yield answer.add(event)
+        if answer.text and not answer.error:
+            await self.append(key, prompt, answer.text, message_ids, command)
+
+    def get_stats(self):
+        """
+        Get store statistics
+
+        Returns:
+            dict: Thread counters, threads and bytes held in memory
+        """
+        with self._lock:
+            return dict(self.stats, threads=len(self._threads), bytes=self._size)
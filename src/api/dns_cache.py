@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import socket
+import threading
+import time
+
+from core.config import config
+
+logger = logging.getLogger("dns_cache")
+
+
+class DNSCache:
+    """
+    Resolved addresses of provider hosts, kept for a fixed time
+
+    getaddrinfo() does not expose record TTLs, so answers are kept for a
+    configured time instead. A connection that fails on every cached address
+    drops the entry, so a moved host is picked up on the next attempt.
+    """
+    def __init__(self, ttl=300):
+        """
+        Initialize the cache
+
+        Args:
+            ttl (float): Seconds an answer is reused, 0 disables caching
+        """
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'invalidated': 0}
+        self._entries = {}  # (host, port) -> (addresses, expires_at)
+        self._lock = threading.Lock()
+
+    def _get(self, host, port):
+        with self._lock:
+            entry = self._entries.get((host, port))
+            if entry is not None and entry[1] > time.monotonic():
+                self.stats['hits'] += 1
+                return entry[0]
+            self.stats['misses'] += 1
+            return None
+
+    def _put(self, host, port, infos):
+        # Keep the resolver's order, it already sorts by RFC 6724 preference
+        addresses = list(dict.fromkeys((family, address[0]) for family, _, _, _, address in infos))
+        if self.ttl > 0:
+            with self._lock:
+                self._entries[(host, port)] = (addresses, time.monotonic() + self.ttl)
+        return addresses
+
+    async def resolve(self, host, port):
+        """
+        Resolve a host without blocking the event loop
+
+        Args:
+            host (str): Host name
+            port (int): Port
+
+        Returns:
+            list: (address family, IP address) tuples in order of preference
+        """
+        addresses = self._get(host, port)
+        if addresses is None:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            addresses = self._put(host, port, infos)
+        return addresses
+
+    def resolve_sync(self, host, port):
+        """
+        Resolve a host from a worker thread
+
+        Args:
+            host (str): Host name
+            port (int): Port
+
+        Returns:
+            list: (address family, IP address) tuples in order of preference
+        """
+        addresses = self._get(host, port)
+        if addresses is None:
+            addresses = self._put(host, port, socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+        return addresses
+
+    def invalidate(self, host, port):
+        """
+        Forget the answer for a host, e.g. after none of its addresses answered
+
+        Args:
+            host (str): Host name
+            port (int): Port
+        """
+        with self._lock:
+            if self._entries.pop((host, port), None) is not None:
+                self.stats['invalidated'] += 1
+
+    def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT, source_address=None):
+        """
+        Drop-in replacement for socket.create_connection() using cached answers
+
+        Args:
+            address (tuple): (host, port)
+            timeout (float, optional): Socket timeout
+            source_address (tuple, optional): Local address to bind to
+
+        Returns:
+            socket.socket: The connected socket
+        """
+        host, port = address
+        last_error = None
+        for _, ip in self.resolve_sync(host, port):
+            try:
+                return socket.create_connection((ip, port), timeout, source_address)
+            except OSError as e:
+                last_error = e
+        self.invalidate(host, port)
+        raise last_error or OSError(f"No addresses for {host}")
+
+    def get_stats(self):
+        """
+        Get cache statistics
+
+        Returns:
+            dict: Hits, misses, invalidations and cached hosts
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+        return stats
+
+
+# Global DNS cache instance
+dns_cache = DNSCache(ttl=config.llm_dns_ttl)
@@ -0,0 +1,232 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from .async_http import AsyncHTTPConnection
+
+logger = logging.getLogger("endpoint_pool")
+
+# Endpoint bound to the request being sent, as a (pool, url) tuple
+_bound = contextvars.ContextVar('endpoint', default=None)
+
+
+class EndpointState:
+    """
+    Health of one base URL
+    """
+    __slots__ = ('url', 'latency', 'error_rate', 'requests', 'failures', 'consecutive_failures',
+                 'ejections', 'ejected_until', 'slow')
+
+    def __init__(self, url):
+        self.url = url
+        # EWMA of probe latency in seconds, None until the first probe answered
+        self.latency = None
+        # EWMA of the failure indicator of probes and requests
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        # Whether the current ejection is for latency, which probes can lift early
+        self.slow = False
+
+
+class EndpointPool:
+    """
+    Base URLs of one provider, routed by probed latency with outlier ejection
+
+    Background probes keep an EWMA of each endpoint's latency. New requests go
+    to the endpoint with the lowest latency, and endpoints that fail
+    repeatedly or are much slower than the best one are ejected for a while.
+    A slow endpoint returns as soon as its probed latency is back in line.
+    The endpoint is chosen once per attempt and bound to the context while
+    the request is sent, so a stream never moves between endpoints, failover
+    only happens between requests.
+    """
+    def __init__(self, name, urls, alpha=0.3, max_failures=3, outlier_factor=3.0, ejection_seconds=30):
+        """
+        Initialize the pool
+
+        Args:
+            name (str): Provider name, used in logs
+            urls (str or list): One base URL or a list in order of preference
+            alpha (float): Weight of the newest sample in the moving averages
+            max_failures (int): Consecutive failures that eject an endpoint
+            outlier_factor (float): Latency relative to the best endpoint that ejects an endpoint
+            ejection_seconds (float): Duration of the first ejection, doubled on
+                each further one up to eight times as long
+        """
+        if isinstance(urls, str):
+            urls = [urls]
+        self.name = name
+        self.alpha = alpha
+        self.max_failures = max_failures
+        self.outlier_factor = outlier_factor
+        self.ejection_seconds = ejection_seconds
+        self._states = [EndpointState(url.rstrip('/')) for url in dict.fromkeys(urls or ()) if url]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    @property
+    def urls(self):
+        """
+        All base URLs in order of preference
+        """
+        return [state.url for state in self._states]
+
+    def best(self):
+        """
+        Get the endpoint new requests should use
+
+        Returns:
+            str: The base URL with the lowest latency, inflated by its recent
+                error rate, among endpoints that are not ejected, None if the
+                pool is empty
+        """
+        if not self._states:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            available = [state for state in self._states if state.ejected_until <= now] or self._states
+            # Unprobed endpoints rank after probed ones, ties keep the configured order
+            return min(
+                available,
+                key=lambda state: (
+                    state.latency is None,
+                    (state.latency or 0.0) / max(0.1, 1.0 - state.error_rate),
+                    self._states.index(state)
+                )
+            ).url
+
+    def current(self):
+        """
+        Get the endpoint for the request being sent
+
+        Returns:
+            str: The base URL bound to the current context, else the best one
+        """
+        bound = _bound.get()
+        if bound is not None and bound[0] is self:
+            return bound[1]
+        return self.best()
+
+    @contextmanager
+    def bind(self, url):
+        """
+        Make an endpoint the provider's base_url within the block
+
+        Args:
+            url (str): Base URL returned by best()
+        """
+        token = _bound.set((self, url))
+        try:
+            yield url
+        finally:
+            _bound.reset(token)
+
+    def record(self, url, failed, latency=None):
+        """
+        Record the outcome of a request or probe
+
+        Args:
+            url (str): The base URL
+            failed (bool): Whether the endpoint failed, e.g. a timeout or a 5xx
+            latency (float, optional): Probe latency in seconds
+        """
+        state = self._find(url)
+        if state is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            state.requests += 1
+            state.error_rate += self.alpha * ((1.0 if failed else 0.0) - state.error_rate)
+            if failed:
+                state.failures += 1
+                state.consecutive_failures += 1
+                if state.consecutive_failures >= self.max_failures:
+                    self._eject(state, now, f"{state.consecutive_failures} consecutive failures", slow=False)
+                return
+            state.consecutive_failures = 0
+            if latency is None:
+                return
+            state.latency = latency if state.latency is None else state.latency + self.alpha * (latency - state.latency)
+            others = [
+                other.latency for other in self._states
+                if other is not state and other.latency is not None and other.ejected_until <= now
+            ]
+            if others and state.latency > self.outlier_factor * min(others):
+                self._eject(state, now, f"latency {state.latency:.2f}s against {min(others):.2f}s", slow=True)
+            elif state.slow and state.ejected_until > now:
+                state.ejected_until = 0.0
+                logger.info(f"Restoring {self.name} endpoint {state.url}, latency {state.latency:.2f}s")
+
+    def _eject(self, state, now, reason, slow):
+        if state.ejected_until > now:
+            return
+        if not any(other.ejected_until <= now for other in self._states if other is not state):
+            # Ejecting the last healthy endpoint would leave nothing to route to
+            return
+        state.ejections += 1
+        state.slow = slow
+        duration = self.ejection_seconds * min(2 ** (state.ejections - 1), 8)
+        state.ejected_until = now + duration
+        logger.warning(f"Ejecting {self.name} endpoint {state.url} for {duration:.0f}s: {reason}")
+
+    def _find(self, url):
+        for state in self._states:
+            if state.url == url:
+                return state
+        return None
+
+    async def probe(self, timeout=5):
+        """
+        Measure every endpoint once
+
+        Each probe opens a fresh connection and sends an unauthenticated GET
+        to the base URL. Any response below 500 shows the endpoint is up, its
+        latency covers the connection, TLS handshake and response headers.
+
+        Args:
+            timeout (float): Seconds before a probe counts as failed
+        """
+        await asyncio.gather(*(self._probe(url, timeout) for url in self.urls))
+
+    async def _probe(self, url, timeout):
+        connection, path = AsyncHTTPConnection.from_url(url, timeout=timeout)
+        start = time.monotonic()
+        try:
+            response = await connection.request("GET", path, timeout=timeout)
+            failed = response.status >= 500
+        except Exception as e:
+            logger.info(f"Probe of {self.name} endpoint {url} failed: {e}")
+            failed = True
+        finally:
+            connection.close()
+        self.record(url, failed, None if failed else time.monotonic() - start)
+
+    def get_stats(self):
+        """
+        Get per-endpoint health
+
+        Returns:
+            dict: Base URL to its latency, error rate, counters and remaining ejection
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                state.url: {
+                    'latency': round(state.latency, 3) if state.latency is not None else None,
+                    'error_rate': round(state.error_rate, 3),
+                    'requests': state.requests,
+                    'failures': state.failures,
+                    'ejections': state.ejections,
+                    'ejected_for': max(0.0, round(state.ejected_until - now, 1)),
+                }
+                for state in self._states
+            }
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+
+from .stream_events import Error, TextDelta, ReasoningDelta
+
+logger = logging.getLogger("hedging")
+
+# Marks the end of one of the hedged streams in the shared queue
+_END = object()
+
+
+class LatencyTracker:
+    """
+    Rolling window of samples per provider, e.g. time-to-first-token
+    """
+    def __init__(self, window=200):
+        """
+        Initialize the tracker
+
+        Args:
+            window (int): Number of recent samples kept per provider
+        """
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider, value):
+        """
+        Record a sample
+
+        Args:
+            provider (str): Provider name
+            value (float): The sample, e.g. seconds from request start to the first content
+        """
+        with self._lock:
+            samples = self._samples.get(provider)
+            if samples is None:
+                samples = self._samples[provider] = deque(maxlen=self.window)
+            samples.append(value)
+
+    def percentile(self, provider, fraction, min_samples=20):
+        """
+        Get a percentile of the recent samples
+
+        Args:
+            provider (str): Provider name
+            fraction (float): Percentile as a fraction, e.g. 0.9 for p90
+            min_samples (int): Fewer samples than this return None
+
+        Returns:
+            float: The percentile, or None if there is not enough data
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(provider, ()))
+        if len(samples) < max(1, min_samples):
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+
+class HedgeBudget:
+    """
+    Token bucket limiting hedges to a fraction of upstream requests
+
+    Every request deposits `ratio` tokens and every hedge spends one, so over
+    time hedges never exceed ratio * requests. The bucket is capped so a quiet
+    period cannot bank an unlimited burst.
+    """
+    def __init__(self, ratio=0.1, max_tokens=10):
+        """
+        Initialize the budget
+
+        Args:
+            ratio (float): Allowed hedges per request, e.g. 0.1 for 10% extra traffic
+            max_tokens (float): Maximum tokens the bucket can hold
+        """
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = 0.0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        """
+        Deposit the share earned by one request
+        """
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        """
+        Spend one token for a hedge
+
+        Returns:
+            bool: True if the hedge is within budget
+        """
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+def _is_content(event):
+    return isinstance(event, (TextDelta, ReasoningDelta))
+
+
+async def hedged_stream(primary, start_secondary, delay, on_win=None):
+    """
+    Race a secondary stream against a primary that is slow to start
+
+    The secondary is started when the primary produced no content within
+    `delay` seconds, or as soon as the primary ends without content. The first
+    stream to produce content wins and the other one is cancelled.
+
+    Args:
+        primary: Async iterator of stream events
+        start_secondary (callable): Returns the secondary async iterator, or
+            None if hedging is not allowed right now
+        delay (float): Seconds to wait for the primary's first content
+        on_win (callable, optional): Called with "primary" or "secondary" once
+            a hedged race is decided
+
+    Yields:
+        StreamEvent: Events of the winning stream
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    async def pump(name, stream):
+        try:
+            async for event in stream:
+                queue.put_nowait((name, event))
+        except Exception as e:
+            queue.put_nowait((name, Error(f"Error streaming from provider: {str(e)}")))
+        finally:
+            queue.put_nowait((name, _END))
+
+    tasks = {'primary': asyncio.create_task(pump('primary', primary))}
+    buffered = {'primary': []}
+    ended = set()
+    hedge_at = loop.time() + delay
+    hedge_tried = False
+    winner = None
+
+    def start_hedge():
+        nonlocal hedge_tried
+        hedge_tried = True
+        secondary = start_secondary()
+        if secondary is not None:
+            tasks['secondary'] = asyncio.create_task(pump('secondary', secondary))
+            buffered['secondary'] = []
+
+    try:
+        # Race until one stream produces content or every stream has ended
+        while winner is None:
+            timeout = None if hedge_tried else max(0, hedge_at - loop.time())
+            try:
+                name, event = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                start_hedge()
+                continue
+
+            if event is _END:
+                ended.add(name)
+                if name == 'primary' and not hedge_tried:
+                    start_hedge()
+                if ended == set(tasks):
+                    # Nobody produced content, report what the primary sent
+                    for buffered_event in buffered['primary']:
+                        yield buffered_event
+                    return
+            elif _is_content(event):
+                winner = name
+                buffered[name].append(event)
+            else:
+                buffered[name].append(event)
+
+        for name, task in tasks.items():
+            if name != winner:
+                task.cancel()
+        if len(tasks) > 1:
+            logger.info(f"Hedged stream won by {winner}")
+            if on_win is not None:
+                on_win(winner)
+
+        for event in buffered[winner]:
+            yield event
+        while winner not in ended:
+            name, event = await queue.get()
+            if name != winner:
+                continue
+            if event is _END:
+                break
+            yield event
+    finally:
+        for task in tasks.values():
+            task.cancel()
@@ -0,0 +1,245 @@
+import contextvars
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from .rate_limiter import parse_reset
+
+logger = logging.getLogger("key_pool")
+
+# Key bound to the request being sent, as a (pool, key) tuple
+_bound = contextvars.ContextVar('api_key', default=None)
+
+# Statuses meaning a key ran out of requests or quota, not that the provider is down
+QUOTA_STATUSES = (402, 429)
+
+
+class KeyState:
+    """
+    Usage and cooldown of one API key
+    """
+    __slots__ = ('key', 'in_flight', 'requests', 'failures', 'rate_limited', 'tokens', 'cooldown_until')
+
+    def __init__(self, key):
+        self.key = key
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.tokens = 0
+        self.cooldown_until = 0.0
+
+
+class KeyPool:
+    """
+    API keys of one provider with least-loaded selection
+
+    Quotas such as GitHub Models' are per key, so spreading requests over
+    several keys multiplies the throughput a provider allows. A key that is
+    rate limited or out of quota cools down and is skipped until its
+    cooldown ends, unless every key is cooling down.
+
+    Providers do not handle keys themselves: the client leases a key for each
+    attempt and binds it to the context while the request is sent, and the
+    provider's api_key attribute resolves to the bound key.
+    """
+    def __init__(self, name, keys=None, cooldown=60):
+        """
+        Initialize the pool
+
+        Args:
+            name (str): Provider name, used in logs
+            keys (str or list, optional): One key or a list of keys
+            cooldown (float): Seconds a rate limited key is skipped when the
+                provider gives no Retry-After
+        """
+        if isinstance(keys, str):
+            keys = [keys]
+        self.name = name
+        self.cooldown = cooldown
+        # Duplicates would share a quota while being counted as two keys
+        self._states = [KeyState(key) for key in dict.fromkeys(key for key in keys or () if key)]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    def _pick(self, now):
+        available = [state for state in self._states if state.cooldown_until <= now]
+        if not available:
+            # Every key is cooling down, the one that recovers first is the best bet
+            return min(self._states, key=lambda state: state.cooldown_until)
+        return min(available, key=lambda state: (state.in_flight, state.requests))
+
+    def peek(self):
+        """
+        Get the key the next request would use, without leasing it
+
+        Returns:
+            str: The least loaded key, or None if the pool is empty
+        """
+        if not self._states:
+            return None
+        with self._lock:
+            return self._pick(time.monotonic()).key
+
+    def current(self):
+        """
+        Get the key for the request being sent
+
+        Returns:
+            str: The key bound to the current context, else the least loaded key,
+                None if the pool is empty
+        """
+        bound = _bound.get()
+        if bound is not None and bound[0] is self:
+            return bound[1]
+        return self.peek()
+
+    def acquire(self):
+        """
+        Lease the least loaded key for one request
+
+        Returns:
+            str: The key, or None if the pool is empty
+        """
+        if not self._states:
+            return None
+        with self._lock:
+            state = self._pick(time.monotonic())
+            state.in_flight += 1
+            state.requests += 1
+            return state.key
+
+    @contextmanager
+    def bind(self, key):
+        """
+        Make a leased key the provider's api_key within the block
+
+        Only bind around code running in one task or thread, such as building
+        and sending a request, not across the yields of a generator.
+
+        Args:
+            key (str): Key returned by acquire()
+        """
+        token = _bound.set((self, key))
+        try:
+            yield key
+        finally:
+            _bound.reset(token)
+
+    def release(self, key, failed=False, used_tokens=None):
+        """
+        Return a leased key
+
+        Args:
+            key (str): Key returned by acquire()
+            failed (bool): Whether the request failed
+            used_tokens (int, optional): Tokens the request used
+        """
+        state = self._find(key)
+        if state is None:
+            return
+        with self._lock:
+            state.in_flight -= 1
+            if failed:
+                state.failures += 1
+            if used_tokens:
+                state.tokens += used_tokens
+
+    def cool_down(self, key, status, retry_after=None):
+        """
+        Skip a key that was rate limited or ran out of quota
+
+        Args:
+            key (str): The key
+            status (int): HTTP status of the failed request
+            retry_after (float, optional): Delay the provider asked for
+
+        Returns:
+            bool: True if another key is available right away
+        """
+        state = self._find(key)
+        if state is None:
+            return False
+        now = time.monotonic()
+        seconds = retry_after if retry_after is not None else self.cooldown
+        with self._lock:
+            state.rate_limited += 1
+            state.cooldown_until = max(state.cooldown_until, now + seconds)
+            available = sum(1 for other in self._states if other.cooldown_until <= now)
+        logger.warning(
+            f"{self.name} key {mask_key(key)} is rate limited (HTTP {status}), cooling down for {seconds:.0f}s, "
+            f"{available} of {len(self._states)} keys available"
+        )
+        return available > 0
+
+    def observe_response(self, key, status, headers):
+        """
+        Cool a key down once its rate limit headers report it exhausted
+
+        Rate limited responses are left to the caller, which cools the key
+        down with the Retry-After of the error.
+
+        Args:
+            key (str): Key the request was sent with
+            status (int): HTTP status
+            headers (dict): Response headers with lower-cased names
+        """
+        if key is None or status in QUOTA_STATUSES:
+            return
+        reset = None
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        if remaining_requests is not None and remaining_requests.strip() == '0':
+            reset = parse_reset(headers.get('x-ratelimit-reset-requests'))
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        try:
+            tokens_exhausted = remaining_tokens is not None and float(remaining_tokens) <= 0
+        except ValueError:
+            tokens_exhausted = False
+        if tokens_exhausted:
+            reset = max(reset or 0, parse_reset(headers.get('x-ratelimit-reset-tokens')) or 0) or None
+        if reset:
+            self.cool_down(key, status, reset)
+
+    def _find(self, key):
+        for state in self._states:
+            if state.key == key:
+                return state
+        return None
+
+    def get_stats(self):
+        """
+        Get per-key usage
+
+        Returns:
+            dict: Masked key to its requests, failures, rate limits, tokens,
+                requests in flight and remaining cooldown
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                mask_key(state.key): {
+                    'in_flight': state.in_flight,
+                    'requests': state.requests,
+                    'failures': state.failures,
+                    'rate_limited': state.rate_limited,
+                    'tokens': state.tokens,
+                    'cooldown': max(0.0, round(state.cooldown_until - now, 1)),
+                }
+                for state in self._states
+            }
+
+
+def mask_key(key):
+    """
+    Shorten a key for logs and statistics
+
+    Args:
+        key (str): The key
+
+    Returns:
+        str: The last four characters of the key
+    """
+    return f"...{key[-4:]}"
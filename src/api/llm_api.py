@@ -11,6 +11,11 @@ from openai import OpenAI
 parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 
+from api.prompt_templates import enhance_system_prompt
+from api.sse import ChatStreamParser
+from api.stream_events import TextDelta
+from core.request_context import get_timeouts
+
 # Load environment variables from config/.env file
 load_dotenv(os.path.join(os.path.dirname(parent_dir), 'config', '.env'))
 
@@ -190,40 +195,25 @@ class LLMClient:
                 return
             
             collected_content = ""
-            final_content = ""
-            
-            for line in response.iter_lines():
-                if line:
-                    # Skip the "data: " prefix
-                    line = line.decode('utf-8')
-                    if line.startswith("data: "):
-                        line = line[6:]  # Skip "data: "
-                    
-                    # Check for [DONE] message
-                    if line == "[DONE]":
-                        # Make sure to yield the final complete response one last time
-                        if final_content:
-                            yield final_content
-                        break
-                    
-                    try:
-                        json_response = json.loads(line)
-                        # Extract the content - may differ based on the actual Deepseek API response format
-                        if "choices" in json_response and json_response["choices"]:
-                            delta = json_response["choices"][0].get("delta", {})
-                            if "content" in delta and delta["content"]:
-                                collected_content += delta["content"]
-                                # Track the complete response for final yield
-                                final_content = collected_content
-                                yield collected_content
-                    except json.JSONDecodeError:
-                        # Skip lines that can't be decoded as JSON
-                        pass
+            parser = ChatStreamParser("DeepSeek")
+            
+            # chunk_size=None hands over data as soon as it arrives
+            for chunk in response.iter_content(chunk_size=None):
+                for event in parser.feed(chunk):
+                    if isinstance(event, TextDelta):
+                        collected_content += event.text
+                        yield collected_content
+                if parser.done:
+                    break
+            else:
+                for event in parser.flush():
+                    if isinstance(event, TextDelta):
+                        collected_content += event.text
                         
             # Ensure final response is yielded one last time after stream is complete
             # This helps prevent bugs with incomplete responses
-            if final_content:
-                yield final_content
+            if collected_content:
+                yield collected_content
                 
         except Exception as e:
             yield f"Error streaming from Deepseek API: {str(e)}"
@@ -293,11 +283,7 @@ class LLMClient:
             return "Grok API key not found. Please set GROK_API_KEY in the .env file or credentials file."
         
         # Remove HTML formatting requirements, use Telegram-friendly formatting
-        enhanced_system_prompt = system_prompt
-        if system_prompt and not "Format your response" in system_prompt:
-            enhanced_system_prompt = system_prompt + " Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
-        elif not system_prompt:
-            enhanced_system_prompt = "You are a helpful AI assistant. Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
+        enhanced_system_prompt = enhance_system_prompt(system_prompt)
         
         # Based on common OpenAI-compatible API patterns
         headers = {
@@ -324,12 +310,13 @@ class LLMClient:
         # Using the correct endpoint from API documentation
         api_url = "https://chatapi.littlewheat.com/v1/chat/completions"
         
+        timeouts = get_timeouts()
         try:
             response = requests.post(
                 api_url,
                 headers=headers,
                 json=payload,
-                timeout=60
+                timeout=(timeouts.connect, timeouts.total)
             )
             response.raise_for_status()
             return response.json()["choices"][0]["message"]["content"].strip()
@@ -355,11 +342,7 @@ class LLMClient:
             return "Grok API key not found. Please set GROK_API_KEY in the .env file or credentials file."
         
         # Remove HTML formatting requirements, use Telegram-friendly formatting
-        enhanced_system_prompt = system_prompt
-        if system_prompt and not "Format your response" in system_prompt:
-            enhanced_system_prompt = system_prompt + " Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
-        elif not system_prompt:
-            enhanced_system_prompt = "You are a helpful AI assistant. Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
+        enhanced_system_prompt = enhance_system_prompt(system_prompt)
         
         client = OpenAI(
             base_url="https://chatapi.littlewheat.com/v1",
@@ -410,11 +393,7 @@ class LLMClient:
                 return "Grok API key not found. Please set GROK_API_KEY in the .env file or credentials file."
             
             # Remove HTML formatting requirements, use Telegram-friendly formatting
-            enhanced_system_prompt = system_prompt
-            if system_prompt and not "Format your response" in system_prompt:
-                enhanced_system_prompt = system_prompt + " Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
-            elif not system_prompt:
-                enhanced_system_prompt = "You are a helpful AI assistant. Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
+            enhanced_system_prompt = enhance_system_prompt(system_prompt)
             
             # Setup messages with enhanced system prompt
             messages = []
@@ -479,7 +458,6 @@ class LLMClient:
         """
         import http.client
         import json
-        import time
         import socket
         
         # Get API key from environment variables
@@ -490,11 +468,7 @@ class LLMClient:
             return
         
         # Remove HTML formatting requirements, use plain text formatting
-        enhanced_system_prompt = system_prompt
-        if system_prompt and not "Format your response" in system_prompt:
-            enhanced_system_prompt = system_prompt + " Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
-        elif not system_prompt:
-            enhanced_system_prompt = "You are a helpful AI assistant. Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
+        enhanced_system_prompt = enhance_system_prompt(system_prompt)
         
         # Setup messages with enhanced system prompt
         messages = []
@@ -510,188 +484,86 @@ class LLMClient:
             "content": user_prompt
         })
         
-        # Maximum number of retries
-        max_retries = 5  # Increased maximum retry count
-        retry_count = 0
-        retry_delay = 2  # seconds
-        
-        while retry_count < max_retries:
-            try:
-                # Print request details for debugging
-                print(f"Making request to chatapi.littlewheat.com with model: {model_name} (attempt {retry_count + 1}/{max_retries})")
-                print(f"Messages: {messages}")
+        # A single attempt: sleeping between retries inside the generator would
+        # block whoever iterates it, retries belong to the caller
+        try:
+            # Print request details for debugging
+            print(f"Making request to chatapi.littlewheat.com with model: {model_name}")
+            print(f"Messages: {messages}")
 
-                # Use longer timeout
-                socket.setdefaulttimeout(120)  # Set global socket timeout to 120 seconds
-                # Setup connection to the specific API endpoint with longer timeout
-                conn = http.client.HTTPSConnection("chatapi.littlewheat.com", timeout=120)
-                
-                # Prepare payload for streaming
-                payload = json.dumps({
-                    "model": model_name,  # Use grok-3-reasoner directly
-                    "messages": messages,
-                    "stream": True,
-                    "temperature": 0.7,
-                    "max_tokens": 1000
-                })
-                
-                # Set headers with the API key
-                headers = {
-                    'Authorization': f'Bearer {grok_api_key}',
-                    'Content-Type': 'application/json'
-                }
+            # Per-connection timeouts bounded by the request deadline, a global
+            # socket default would also apply to every other socket in the process
+            timeouts = get_timeouts()
+            conn = http.client.HTTPSConnection("chatapi.littlewheat.com", timeout=timeouts.connect)
+            conn.connect()
+            # Kept because the connection drops its socket when the server asks to close
+            sock = conn.sock
+            sock.settimeout(timeouts.first_byte)
+            
+            # Prepare payload for streaming
+            payload = json.dumps({
+                "model": model_name,  # Use grok-3-reasoner directly
+                "messages": messages,
+                "stream": True,
+                "temperature": 0.7,
+                "max_tokens": 1000
+            })
+            
+            # Set headers with the API key
+            headers = {
+                'Authorization': f'Bearer {grok_api_key}',
+                'Content-Type': 'application/json'
+            }
+            
+            # Make the streaming API request
+            conn.request("POST", "/v1/chat/completions", payload, headers)
+            response = conn.getresponse()
+            
+            # Check for errors
+            if response.status != 200:
+                error_data = response.read().decode('utf-8', errors='replace')
+                yield f"Grok API returned error {response.status}: {error_data}"
+                return
+            
+            # Process the streaming response
+            collected_content = ""
+            parser = ChatStreamParser("Grok")
+            
+            while not parser.done:
+                # A read idle for longer than the idle timeout raises socket.timeout
+                sock.settimeout(timeouts.read_timeout())
                 
-                # Make the streaming API request
-                conn.request("POST", "/v1/chat/completions", payload, headers)
-                response = conn.getresponse()
+                # read1 returns as soon as data arrives instead of waiting for a full block
+                chunk = response.read1(4096)
+                if not chunk:
+                    break
                 
-                # Check for errors
-                if response.status != 200:
-                    error_data = response.read().decode('utf-8', errors='replace')
-                    error_msg = f"Grok API returned error {response.status}: {error_data}"
-                    
-                    # If it's a server error (5xx), retry
-                    if 500 <= response.status < 600:
-                        retry_count += 1
-                        if retry_count < max_retries:
-                            print(f"Server error {response.status}, retrying in {retry_delay} seconds... (attempt {retry_count+1}/{max_retries})")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                            continue
-                    
-                    # If we've exhausted retries or it's a client error, yield the error message
-                    yield error_msg
-                    return
+                for event in parser.feed(chunk):
+                    if isinstance(event, TextDelta):
+                        collected_content += event.text
+                        yield collected_content
+            
+            # Process any remaining data in the buffer
+            for event in parser.flush():
+                if isinstance(event, TextDelta):
+                    collected_content += event.text
+                            
+            # Make sure we yield the final content
+            if collected_content:
+                yield collected_content
                 
-                # Process the streaming response
-                collected_content = ""
-                buffer = ""
-                last_activity_time = time.time()
-                activity_timeout = 60  # 60 seconds inactivity timeout
+        except socket.timeout:
+            print("Socket timeout error while streaming from Grok API")
+            yield "Error: Connection to Grok API timed out. Please try again later."
                 
-                # Read larger chunks instead of byte-by-byte to avoid UTF-8 decoding issues
-                while True:
-                    # Check inactivity timeout
-                    if time.time() - last_activity_time > activity_timeout:
-                        print(f"No activity from Grok API for {activity_timeout} seconds, closing connection")
-                        break
-                    
-                    try:
-                        chunk = response.read(4096)  # Read 4KB at a time
-                        if not chunk:
-                            break
-                        
-                        # Update last activity time
-                        last_activity_time = time.time()
-                        
-                        # Decode with error handling
-                        try:
-                            text = chunk.decode('utf-8', errors='replace')
-                            buffer += text
-                        except Exception as e:
-                            print(f"Warning: Error decoding chunk: {e}")
-                            continue
-                        
-                        # Process complete lines
-                        while '\n' in buffer:
-                            pos = buffer.find('\n')
-                            line = buffer[:pos]
-                            buffer = buffer[pos + 1:]
-                            
-                            if not line.strip():
-                                continue
-                            
-                            if line.startswith('data: '):
-                                line = line[6:].strip()  # Skip "data: " prefix
-                                
-                                if line == '[DONE]':
-                                    # Final yield of complete response
-                                    if collected_content:
-                                        yield collected_content
-                                    return
-                                
-                                try:
-                                    json_response = json.loads(line)
-                                    if "choices" in json_response and json_response["choices"]:
-                                        delta = json_response["choices"][0].get("delta", {})
-                                        if "content" in delta and delta["content"]:
-                                            new_content = delta["content"]
-                                            collected_content += new_content
-                                            yield collected_content
-                                except json.JSONDecodeError as je:
-                                    print(f"Warning: JSON decode error: {je}. Input: {line[:100]}...")
-                                    continue
-                    except socket.timeout:
-                        # Handle timeout
-                        print(f"Socket timeout while reading response, retrying... (attempt {retry_count+1}/{max_retries})")
-                        retry_count += 1
-                        if retry_count < max_retries:
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                            break  # Break inner loop to reconnect
-                        else:
-                            yield "Error: Read operation timed out after multiple attempts. Please try again later."
-                            return
+        except http.client.HTTPException as e:
+            yield f"Error connecting to Grok API: {str(e)}"
                 
-                # Process any remaining data in the buffer
-                if buffer.strip():
-                    for line in buffer.strip().split('\n'):
-                        if line.startswith('data: '):
-                            line = line[6:].strip()
-                            
-                            if line == '[DONE]':
-                                break
-                            
-                            try:
-                                json_response = json.loads(line)
-                                if "choices" in json_response and json_response["choices"]:
-                                    delta = json_response["choices"][0].get("delta", {})
-                                    if "content" in delta and delta["content"]:
-                                        new_content = delta["content"]
-                                        collected_content += new_content
-                            except json.JSONDecodeError:
-                                continue
-                                
-                # Make sure we yield the final content
-                if collected_content:
-                    yield collected_content
-                    return
-                    
-            except socket.timeout:
-                print(f"Socket timeout error, retrying... (attempt {retry_count+1}/{max_retries})")
-                retry_count += 1
-                if retry_count < max_retries:
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                    continue
-                else:
-                    yield f"Error: Connection to Grok API timed out after {max_retries} attempts. Please try again later."
-                    return
-                    
-            except http.client.HTTPException as e:
-                retry_count += 1
-                if retry_count < max_retries:
-                    print(f"HTTP error: {e}, retrying in {retry_delay} seconds... (attempt {retry_count+1}/{max_retries})")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                    continue
-                else:
-                    yield f"Error connecting to Grok API after {max_retries} attempts: {str(e)}"
-                    return
-                    
-            except Exception as e:
-                import traceback
-                print(f"Error streaming from Grok API: {str(e)}")
-                print(traceback.format_exc())
-                retry_count += 1
-                if retry_count < max_retries:
-                    print(f"Unexpected error, retrying in {retry_delay} seconds... (attempt {retry_count+1}/{max_retries})")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                    continue
-                else:
-                    yield f"Error streaming from Grok API after {max_retries} attempts: {str(e)}"
-                    return
+        except Exception as e:
+            import traceback
+            print(f"Error streaming from Grok API: {str(e)}")
+            print(traceback.format_exc())
+            yield f"Error streaming from Grok API: {str(e)}"
     
     def call_test(self, prompt=None, delay=4):
         """
@@ -1,9 +1,27 @@
-import os
+import asyncio
+import re
 import time
 import logging
+from contextlib import aclosing, closing
+from urllib.parse import urlsplit
 
 from core.config import config
+from core.request_context import get_request_context
 from .base_provider import LLMProvider
+from .stream_events import TextDelta, ReasoningDelta, Usage, Error, StreamAccumulator
+from .response_cache import ResponseCache, make_cache_key, replay_stream, replay_stream_async
+from .single_flight import SingleFlight
+from .hedging import LatencyTracker, HedgeBudget, hedged_stream
+from .circuit_breaker import CircuitBreaker
+from .retry import RetryBudget, RetryPolicy, is_retryable
+from .rate_limiter import AdaptiveLimiter, estimate_request_tokens, estimate_tokens
+from .key_pool import QUOTA_STATUSES
+from .stall_detection import guard_stalls, build_continuation_prompt, ContinuationJoiner
+from .async_http import get_ssl_context
+from .dns_cache import dns_cache
+from .prompt_templates import prompt_templates, PrefixCacheStats
+from .token_budget import ContextBudget, PromptTooLong, model_family, token_estimator
+from .usage_ledger import UsageLedger
 
 # Fixed imports: Import from the correct location
 try:
@@ -26,10 +44,16 @@ except ImportError as e:
             def call(self, prompt, **kwargs):
                 return f"Provider not available. Error importing providers."
             def call_stream(self, prompt, **kwargs):
-                yield f"Provider not available. Error importing providers."
+                yield Error(f"Provider not available. Error importing providers.")
         
         GrokProvider = DeepSeekProvider = OpenAIProvider = StubProvider
 
+# Shared by every client so retries stay bounded across the whole process
+retry_budget = RetryBudget(ratio=config.retry_budget_percent / 100.0)
+
+# Error responses of non-streaming calls that point at the provider rather than the request
+TRANSIENT_RESPONSE = re.compile(r"\b(?:408|425|429|5\d\d)\b|timed out|timeout|connection", re.IGNORECASE)
+
 class LLMClient:
     """
     Unified LLM client for interacting with various LLM providers
@@ -41,11 +65,67 @@ class LLMClient:
         self.environment = config.environment
         self.providers = {}
         
-        # Store API keys for direct access if needed
-        self.grok_api_key = os.getenv('GROK_API_KEY')
-        self.deepseek_api_key = os.getenv('DEEPSEEK_API_KEY')
-        self.openai_api_key = os.getenv('OPENAI_API_KEY')
-        self.github_api_key = os.getenv('GITHUB_API_KEY')
+        # Store API keys for direct access if needed, each provider may have several
+        self.grok_api_key = config.get_api_keys('grok')
+        self.deepseek_api_key = config.get_api_keys('deepseek')
+        self.openai_api_key = config.get_api_keys('openai')
+        self.github_api_key = config.get_api_keys('github')
+        
+        # Cache for repeated identical prompts
+        self.cache = None
+        if config.llm_cache_enabled:
+            self.cache = ResponseCache(
+                ttl=config.llm_cache_ttl,
+                max_bytes=config.llm_cache_max_bytes,
+                disk_path=config.llm_cache_disk_path
+            )
+        
+        # Identical concurrent streaming requests share one upstream call
+        self.single_flight = SingleFlight() if config.llm_single_flight_enabled else None
+        
+        # Time-to-first-token history drives the adaptive hedge delay
+        self.ttft = LatencyTracker()
+        self.hedge_budget = HedgeBudget(ratio=config.llm_hedge_budget_percent / 100.0)
+        self.hedge_stats = {'hedged': 0, 'secondary_wins': 0, 'budget_denied': 0}
+        
+        # Tokens per second of completed streams set the mid-answer stall threshold
+        self.throughput = LatencyTracker()
+        self.stall_stats = {'stalls': 0, 'continuations': 0}
+        
+        # Provider-side prompt cache hits per template, i.e. per command family
+        self.prefix_cache = PrefixCacheStats()
+        
+        # Token usage and cost per user, chat, command, provider and model
+        self.usage = UsageLedger(config.usage_ledger_path, config.usage_flush_interval, config.usage_prices)
+        
+        # Completion limits sized to each model's context window and the answer's destination
+        self.budget = ContextBudget(
+            token_estimator,
+            inline_max_tokens=config.llm_inline_max_tokens,
+            file_max_tokens=config.llm_file_max_tokens,
+            reasoning_tokens=config.llm_reasoning_tokens,
+            min_completion_tokens=config.llm_min_completion_tokens,
+            trim=config.llm_trim_oversized_prompts
+        )
+        
+        # One circuit breaker per provider, half-open circuits are probed in the background
+        self.breakers = {}
+        self._probe_task = None
+        self._endpoint_probe_task = None
+        self._keep_warm_task = None
+        
+        # Adaptive concurrency and token rate limit per provider
+        self.limiters = {}
+        
+        # Failed attempts are retried without blocking, within a process-wide budget
+        self.retry_policy = RetryPolicy(
+            max_retries=config.max_retries,
+            base_delay=config.retry_delay,
+            max_delay=config.retry_max_delay,
+            max_retry_after=config.retry_max_retry_after,
+            budget=retry_budget,
+            min_attempt_seconds=config.llm_min_attempt_seconds
+        )
         
         # Register all providers
         self._register_providers()
@@ -81,7 +161,450 @@ class LLMClient:
             provider_instance (LLMProvider): The provider instance
         """
         self.providers[provider_name] = provider_instance
-        logger.info(f"Registered LLM provider: {provider_name}")
+        self.breakers[provider_name] = CircuitBreaker(
+            provider_name,
+            failure_rate=config.llm_breaker_failure_rate,
+            min_requests=config.llm_breaker_min_requests,
+            window=config.llm_breaker_window,
+            open_seconds=config.llm_breaker_open_seconds,
+            slow_call_seconds=config.llm_breaker_slow_call_seconds
+        )
+        limiter = AdaptiveLimiter(
+            provider_name,
+            max_concurrency=config.llm_limiter_max_concurrency,
+            tokens_per_minute=config.llm_limiter_tokens_per_minute.get(provider_name),
+            max_wait=config.llm_limiter_max_wait
+        )
+        self.limiters[provider_name] = limiter
+        key_pool = getattr(provider_instance, 'key_pool', None)
+        provider_instance.on_response = lambda status, headers: self._observe_response(provider_name, status, headers)
+        if key_pool is not None:
+            key_pool.name = provider_name
+        if provider_name in config.llm_base_urls and hasattr(provider_instance, 'endpoint_pool'):
+            provider_instance.base_url = config.llm_base_urls[provider_name]
+        endpoint_pool = getattr(provider_instance, 'endpoint_pool', None)
+        if endpoint_pool is not None:
+            endpoint_pool.name = provider_name
+        logger.info(f"Registered LLM provider: {provider_name} ({len(key_pool) if key_pool is not None else 0} API keys)")
+    
+    def _observe_response(self, provider, status, headers):
+        """
+        Feed a provider response's rate limit headers to its key pool and limiter
+        
+        Called while the attempt's key is bound, so with several keys the
+        headers are attributed to the key that answered.
+        
+        Args:
+            provider (str): The provider
+            status (int): HTTP status
+            headers (dict): Response headers with lower-cased names
+        """
+        key_pool = getattr(self.providers[provider], 'key_pool', None)
+        keys = len(key_pool) if key_pool is not None else 0
+        if keys > 1:
+            key_pool.observe_response(key_pool.current(), status, headers)
+        self.limiters[provider].observe_response(status, headers, keys=keys)
+    
+    def get_limiter_stats(self):
+        """
+        Get rate limiter state for every registered provider
+        
+        Returns:
+            dict: Limiter state keyed by provider name
+        """
+        return {name: limiter.get_stats() for name, limiter in self.limiters.items()}
+    
+    def get_key_stats(self):
+        """
+        Get per-key usage for every registered provider
+        
+        Returns:
+            dict: Key statistics keyed by provider name, then masked key
+        """
+        return {
+            name: provider.key_pool.get_stats()
+            for name, provider in self.providers.items()
+            if hasattr(provider, 'key_pool')
+        }
+    
+    def get_endpoint_stats(self):
+        """
+        Get per-endpoint health for every registered provider
+        
+        Returns:
+            dict: Endpoint statistics keyed by provider name, then base URL
+        """
+        return {
+            name: provider.endpoint_pool.get_stats()
+            for name, provider in self.providers.items()
+            if hasattr(provider, 'endpoint_pool')
+        }
+    
+    def get_dns_stats(self):
+        """
+        Get DNS cache and TLS session resumption statistics
+        
+        Returns:
+            dict: DNS cache counters and TLS handshakes, with how many resumed a session
+        """
+        return {'dns': dns_cache.get_stats(), 'tls': dict(get_ssl_context().stats)}
+    
+    def _warm_targets(self):
+        """
+        List the connection pools to keep warm
+        
+        Returns:
+            list: (ConnectionPool, base URL) for every endpoint of every provider
+        """
+        targets = []
+        for provider in self.providers.values():
+            endpoint_pool = getattr(provider, 'endpoint_pool', None)
+            if endpoint_pool is None or not hasattr(provider, 'get_connection_pool'):
+                continue
+            for url in endpoint_pool.urls:
+                targets.append((provider.get_connection_pool(url), url))
+        return targets
+    
+    async def warm_up(self, probe=False):
+        """
+        Resolve and connect to every provider endpoint ahead of the first request
+        
+        Args:
+            probe (bool): Also send a keep-alive request on idle connections
+        """
+        async def warm(pool, url):
+            try:
+                # Refreshes the DNS answer before it expires, even while connections are idle
+                await dns_cache.resolve(pool.host, pool.port or (443 if pool.use_ssl else 80))
+                if probe:
+                    await pool.keep_alive(urlsplit(url).path or '/')
+                await pool.warm(config.llm_keep_warm_connections, config.llm_connect_timeout)
+            except Exception as e:
+                logger.info(f"Could not pre-connect to {url}: {e}")
+        
+        await asyncio.gather(*(warm(pool, url) for pool, url in self._warm_targets()))
+    
+    def start_keep_warm(self):
+        """
+        Pre-connect to every provider and keep the connections warm while idle
+        
+        Must be called from the running event loop, does nothing when
+        pre-warming is disabled.
+        """
+        if not config.llm_prewarm_enabled:
+            return
+        if self._keep_warm_task is None or self._keep_warm_task.done():
+            self._keep_warm_task = asyncio.create_task(self._keep_warm_loop())
+    
+    async def stop_keep_warm(self):
+        """
+        Stop the keep-warm loop
+        """
+        if self._keep_warm_task is not None:
+            self._keep_warm_task.cancel()
+            try:
+                await self._keep_warm_task
+            except asyncio.CancelledError:
+                pass
+            self._keep_warm_task = None
+    
+    async def _keep_warm_loop(self):
+        """
+        Warm all provider connections now and then every keep-warm interval
+        """
+        await self.warm_up()
+        logger.info(f"Pre-warmed provider connections: {self.get_connection_stats()}")
+        while True:
+            await asyncio.sleep(config.llm_keep_warm_interval)
+            await self.warm_up(probe=config.llm_keep_warm_probe)
+    
+    def get_prefix_cache_stats(self):
+        """
+        Get provider-side prompt cache hits per command
+        
+        Returns:
+            dict: Hit and miss tokens and the hit ratio keyed by template name, then provider
+        """
+        return self.prefix_cache.get_stats()
+    
+    def get_usage_stats(self):
+        """
+        Get token usage and cost totals since start
+        
+        Returns:
+            dict: Request, token and cost totals and the ledger's flush counters
+        """
+        return self.usage.get_stats()
+    
+    def get_budget_stats(self):
+        """
+        Get context budget decisions and the token estimator's calibration
+        
+        Returns:
+            dict: Planned, shrunk, trimmed and rejected request counts, and the
+                correction factor of each tokenizer family
+        """
+        return self.budget.get_stats()
+    
+    def get_breaker_stats(self):
+        """
+        Get circuit breaker state for every registered provider
+        
+        Returns:
+            dict: Breaker state keyed by provider name
+        """
+        return {name: breaker.get_stats() for name, breaker in self.breakers.items()}
+    
+    def _ensure_prober(self):
+        """
+        Start the background probe loops on the running event loop
+        """
+        if self._probe_task is None or self._probe_task.done():
+            self._probe_task = asyncio.create_task(self._probe_loop())
+        if self._endpoint_probe_task is None or self._endpoint_probe_task.done():
+            pools = [
+                provider.endpoint_pool for provider in self.providers.values()
+                if len(getattr(provider, 'endpoint_pool', ())) > 1
+            ]
+            if pools:
+                self._endpoint_probe_task = asyncio.create_task(self._endpoint_probe_loop(pools))
+    
+    async def _endpoint_probe_loop(self, pools):
+        """
+        Periodically measure the latency of providers with several endpoints
+        
+        Args:
+            pools (list): EndpointPool of every provider with more than one base URL
+        """
+        while True:
+            await asyncio.gather(*(pool.probe() for pool in pools))
+            await asyncio.sleep(config.llm_endpoint_probe_interval)
+    
+    async def _probe_loop(self):
+        """
+        Periodically probe providers whose circuit is half-open
+        """
+        while True:
+            await asyncio.sleep(config.llm_breaker_probe_interval)
+            for name, breaker in list(self.breakers.items()):
+                if breaker.needs_probe():
+                    breaker.record_probe(await self._probe(name))
+    
+    async def _probe(self, provider):
+        """
+        Send a minimal request to check whether a provider recovered
+        
+        Args:
+            provider (str): The provider to probe
+            
+        Returns:
+            bool: True if the provider produced content without an error
+        """
+        logger.info(f"Probing {provider} to decide whether its circuit can close")
+        try:
+            async with asyncio.timeout(config.llm_breaker_slow_call_seconds):
+                async for event in self.providers[provider].call_stream_async("ping", max_tokens=1):
+                    if isinstance(event, Error):
+                        return False
+                    if isinstance(event, (TextDelta, ReasoningDelta)):
+                        return True
+        except Exception as e:
+            logger.warning(f"Probe of {provider} failed: {e}")
+        return False
+    
+    def get_connection_stats(self):
+        """
+        Get keep-alive connection pool statistics for every registered provider
+        
+        Returns:
+            dict: Pool hit/miss statistics keyed by provider name, then pool
+        """
+        return {
+            name: provider.get_pool_stats()
+            for name, provider in self.providers.items()
+            if hasattr(provider, 'get_pool_stats')
+        }
+    
+    def get_cache_stats(self):
+        """
+        Get response cache statistics
+        
+        Returns:
+            dict: Hit/miss/eviction counters, or None if the cache is disabled
+        """
+        return self.cache.get_stats() if self.cache else None
+    
+    def get_coalescing_stats(self):
+        """
+        Get single-flight coalescing statistics
+        
+        Returns:
+            dict: Upstream and coalesced stream counts, or None if disabled
+        """
+        return self.single_flight.get_stats() if self.single_flight else None
+    
+    def get_hedging_stats(self):
+        """
+        Get hedged request statistics
+        
+        Returns:
+            dict: Hedge counts, secondary wins, budget denials and the current
+                hedge delay per hedged provider
+        """
+        stats = dict(self.hedge_stats)
+        stats['delays'] = {
+            provider: self._get_hedge_delay(provider) for provider in config.llm_hedge_providers
+        }
+        return stats
+    
+    def get_stall_stats(self):
+        """
+        Get mid-stream stall statistics
+        
+        Returns:
+            dict: Streams that stalled mid-answer and answers continued on another provider
+        """
+        return dict(self.stall_stats)
+    
+    def get_retry_stats(self):
+        """
+        Get statistics of the shared retry policy
+        
+        Returns:
+            dict: Retries sent, retries denied and remaining budget
+        """
+        return self.retry_policy.get_stats()
+    
+    def _get_hedge_delay(self, provider):
+        """
+        Get how long to wait for a provider's first token before hedging
+        
+        Args:
+            provider (str): The primary provider
+            
+        Returns:
+            float: The recent p90 time-to-first-token, or the configured default
+                while there are too few samples
+        """
+        delay = self.ttft.percentile(provider, 0.9)
+        if delay is None:
+            return config.llm_hedge_delay
+        return max(config.llm_hedge_min_delay, delay)
+    
+    def _get_stall_timeout(self, provider):
+        """
+        Get how long a provider may go silent mid-answer before it counts as stalled
+        
+        Args:
+            provider (str): The provider
+            
+        Returns:
+            float: The time the provider's slow streams need for LLM_STALL_TOKENS
+                tokens, or the configured default while there are too few samples
+        """
+        # A slow percentile keeps ordinarily slow streams from being cut off
+        tokens_per_second = self.throughput.percentile(provider, 0.1, min_samples=10)
+        if not tokens_per_second:
+            return config.llm_stall_timeout
+        return max(config.llm_stall_min_seconds, config.llm_stall_tokens / tokens_per_second)
+    
+    def _get_hedge_stream(self, provider, prompt, kwargs):
+        """
+        Start the secondary stream for a hedged request if the budget allows
+        
+        Args:
+            provider (str): The primary provider
+            prompt (str): The prompt
+            kwargs (dict): The primary's call parameters
+            
+        Returns:
+            Async iterator of stream events, or None if no hedge is sent
+        """
+        secondary = config.llm_hedge_providers.get(provider)
+        if secondary not in self.providers or not self.breakers[secondary].allow_request():
+            return None
+        if not self.hedge_budget.try_spend():
+            self.hedge_stats['budget_denied'] += 1
+            logger.info(f"Hedge budget exhausted, not hedging {provider}")
+            return None
+        
+        self.hedge_stats['hedged'] += 1
+        logger.info(f"No first token from {provider} yet, hedging with {secondary}")
+        # Model names are provider specific, only portable parameters are passed on
+        secondary_kwargs = {
+            key: kwargs[key] for key in ('system_prompt', 'template', 'temperature', 'max_tokens') if key in kwargs
+        }
+        return self._stream_upstream_async(secondary, prompt, secondary_kwargs, None)
+    
+    def _count_stall(self, provider):
+        # The abandoned stream never reports to the breaker itself
+        self.stall_stats['stalls'] += 1
+        self.breakers[provider].record_failure()
+    
+    def _count_hedge_win(self, winner):
+        if winner == 'secondary':
+            self.hedge_stats['secondary_wins'] += 1
+    
+    def _get_cache_key(self, provider, prompt, kwargs):
+        """
+        Get the cache key for a request, consuming the per-call use_cache flag
+        
+        Args:
+            provider (str): The provider name
+            prompt (str): The prompt
+            kwargs (dict): Call parameters after system prompt enhancement
+            
+        Returns:
+            str: The cache key, or None if this request must not be cached
+        """
+        use_cache = kwargs.pop('use_cache', True)
+        if not self.cache or not use_cache or provider in config.llm_cache_disabled_providers:
+            return None
+        return self._get_request_key(provider, prompt, kwargs)
+    
+    def _get_request_key(self, provider, prompt, kwargs):
+        """
+        Get the key identifying identical requests
+        
+        Args:
+            provider (str): The provider name
+            prompt (str): The prompt
+            kwargs (dict): Call parameters after system prompt enhancement
+            
+        Returns:
+            str: The request key
+        """
+        return make_cache_key(
+            provider,
+            prompt,
+            model=kwargs.get('model') or kwargs.get('model_name'),
+            system_prompt=kwargs.get('system_prompt'),
+            temperature=kwargs.get('temperature'),
+            mode=kwargs.get('mode'),
+            history=kwargs['template'].history if kwargs.get('template') else (),
+            max_tokens=kwargs.get('max_tokens')
+        )
+    
+    def _is_error_response(self, response):
+        """
+        Check whether a non-streaming provider response is an error message
+        
+        Provider call() methods report failures as plain strings, so they have
+        to be recognised before a response is cached.
+        """
+        if not response:
+            return True
+        return response.startswith(("Error", "Exception", "Unknown provider")) or "API key not found" in response
+    
+    def _is_transient_response(self, response):
+        """
+        Check whether a non-streaming error response reports a provider fault
+        
+        Only timeouts, connection errors, rate limits and server errors count
+        against the circuit breaker. Errors caused by the request itself, such
+        as a bad request or a rejected key, say nothing about the provider's health.
+        """
+        return bool(response) and TRANSIENT_RESPONSE.search(response) is not None
     
     def call_llm(self, provider, prompt, **kwargs):
         """
@@ -109,22 +632,46 @@ class LLMClient:
             else:
                 return f"Unknown provider: {provider}"
         
-        # Handle system_prompt if provided
-        system_prompt = kwargs.get('system_prompt', '')
+        # Enhance the system prompt and attach its compiled template
+        self._apply_template(kwargs)
+        try:
+            prompt = self._apply_budget(provider, prompt, kwargs)
+        except PromptTooLong as e:
+            return f"Error: {e}"
         
-        # Format the system prompt for better display if needed
-        enhanced_system_prompt = system_prompt
-        if system_prompt and not "Format your response" in system_prompt:
-            enhanced_system_prompt = system_prompt + " Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
-        elif not system_prompt:
-            enhanced_system_prompt = "You are a helpful AI assistant. Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
+        cache_key = self._get_cache_key(provider, prompt, kwargs)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Serving {provider} response from cache")
+                return cached
         
-        # Update kwargs with enhanced system prompt
-        kwargs['system_prompt'] = enhanced_system_prompt
+        breaker = self.breakers[provider]
+        if not breaker.allow_request():
+            return f"Error: {provider} is temporarily unavailable, please try again later."
         
         logger.info(f"Calling {provider} with prompt: {prompt}")
-        response = self.providers[provider].call(prompt, **kwargs)
-        self.logger.info(f"Response from {provider}: {response[:100]}...")  # Log first 100 chars
+        start_time = time.monotonic()
+        key_pool = self.providers[provider].key_pool
+        endpoint_pool = self.providers[provider].endpoint_pool
+        key = key_pool.acquire()
+        failed = True
+        try:
+            with key_pool.bind(key), endpoint_pool.bind(endpoint_pool.best()):
+                response = self.providers[provider].call(prompt, **kwargs)
+            failed = self._is_error_response(response)
+        finally:
+            key_pool.release(key, failed=failed)
+        logger.info(f"Response from {provider}: {response[:100]}...")  # Log first 100 chars
+        if failed:
+            if key is not None and '429' in response:
+                key_pool.cool_down(key, 429)
+            if self._is_transient_response(response):
+                breaker.record_failure()
+        else:
+            breaker.record_success(time.monotonic() - start_time)
+            if cache_key:
+                self.cache.set(cache_key, response)
         return response
     
     def call_llm_stream(self, provider, prompt, **kwargs):
@@ -137,36 +684,412 @@ class LLMClient:
             **kwargs: Additional parameters
             
         Returns:
-            Generator: A generator yielding text response chunks
+            Generator: A generator yielding stream events (see api.stream_events)
         """
         # Use test response in test environment
         if config.is_test_environment():
             logger.info(f"Environment is set to test, routing {provider} streaming call to test API")
-            yield from self._call_test_stream(prompt, **kwargs)
+            yield from self._call_test_stream(prompt)
             return
         
         # Check if the provider is registered
         if provider not in self.providers:
             # Special handling for 'github' provider - redirect to 'openai' provider
-            yield f"Unknown provider: {provider}"
+            yield Error(f"Unknown provider: {provider}")
             return
         
-        # Handle system_prompt if provided
-        system_prompt = kwargs.get('system_prompt', '')
-        
-        # Format the system prompt for better display if needed
-        enhanced_system_prompt = system_prompt
-        if system_prompt and not "Format your response" in system_prompt:
-            enhanced_system_prompt = system_prompt + " Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
-        elif not system_prompt:
-            enhanced_system_prompt = "You are a helpful AI assistant. Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
+        # Enhance the system prompt and attach its compiled template
+        self._apply_template(kwargs)
+        try:
+            prompt = self._apply_budget(provider, prompt, kwargs)
+        except PromptTooLong as e:
+            yield Error(str(e), status=413)
+            return
         
-        # Update kwargs with enhanced system prompt
-        kwargs['system_prompt'] = enhanced_system_prompt
+        cache_key = self._get_cache_key(provider, prompt, kwargs)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Replaying cached {provider} response")
+                yield from replay_stream(cached, config.llm_cache_replay_chunk_chars, config.llm_cache_replay_interval)
+                return
         
         # Call the provider's streaming implementation
         logger.info(f"Starting streaming call to {provider} with prompt: {prompt}")
-        yield from self.providers[provider].call_stream(prompt, **kwargs)
+        accumulator = StreamAccumulator()
+        # Closed explicitly so a consumer that stops early also closes the HTTP response
+        with closing(self.providers[provider].call_stream(prompt, **kwargs)) as stream:
+            for event in stream:
+                yield accumulator.add(event)
+        
+        # Only streams that ran to completion without an error are cached
+        if cache_key and accumulator.length and not accumulator.error:
+            self.cache.set(cache_key, accumulator.text)
+    
+    async def call_llm_stream_async(self, provider, prompt, **kwargs):
+        """
+        Call LLM with native asyncio streaming support
+        
+        Unlike call_llm_stream, this never blocks the event loop, so many
+        concurrent streams can share one loop without a thread each.
+        
+        Args:
+            provider (str): The provider to use
+            prompt (str): The prompt
+            **kwargs: Additional parameters
+            
+        Yields:
+            StreamEvent: TextDelta, ReasoningDelta, Usage, Finish or Error events
+        """
+        # Use test response in test environment
+        if config.is_test_environment():
+            logger.info(f"Environment is set to test, routing {provider} streaming call to test API")
+            async for event in self._call_test_stream_async(prompt):
+                yield event
+            return
+        
+        # Check if the provider is registered
+        if provider not in self.providers:
+            yield Error(f"Unknown provider: {provider}")
+            return
+        
+        # Enhance the system prompt and attach its compiled template
+        self._apply_template(kwargs)
+        try:
+            prompt = self._apply_budget(provider, prompt, kwargs)
+        except PromptTooLong as e:
+            yield Error(str(e), status=413)
+            return
+        
+        cache_key = self._get_cache_key(provider, prompt, kwargs)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Replaying cached {provider} response")
+                async for event in replay_stream_async(cached, config.llm_cache_replay_chunk_chars, config.llm_cache_replay_interval):
+                    yield event
+                return
+        
+        self._ensure_prober()
+        if not self.breakers[provider].allow_request():
+            # Fail fast so callers with a fallback chain move on immediately
+            yield Error(f"{provider} is temporarily unavailable (circuit open)", status=503)
+            return
+        
+        hedge = kwargs.pop('hedge', config.llm_hedge_enabled) and provider in config.llm_hedge_providers
+        
+        def start_stream():
+            stream = self._stream_upstream_async(provider, prompt, kwargs, cache_key)
+            if not hedge:
+                return stream
+            self.hedge_budget.record_request()
+            return hedged_stream(
+                stream,
+                lambda: self._get_hedge_stream(provider, prompt, kwargs),
+                self._get_hedge_delay(provider),
+                on_win=self._count_hedge_win
+            )
+        
+        if self.single_flight is None:
+            stream = start_stream()
+        else:
+            # Late joiners get the events produced so far, then the live ones
+            stream = self.single_flight.subscribe(self._get_request_key(provider, prompt, kwargs), start_stream)
+        async with aclosing(stream):
+            async for event in stream:
+                yield event
+    
+    async def _stream_upstream_async(self, provider, prompt, kwargs, cache_key):
+        """
+        Stream a request from the provider and cache the completed response
+        
+        Args:
+            provider (str): The provider to use
+            prompt (str): The prompt
+            kwargs (dict): Call parameters after system prompt enhancement
+            cache_key (str): Key to store the response under, None to skip caching
+            
+        Yields:
+            StreamEvent: Events from the provider
+        """
+        limiter = self.limiters[provider]
+        context = get_request_context()
+        try:
+            reserved = await limiter.acquire(
+                estimate_request_tokens(prompt, kwargs.get('system_prompt'), kwargs.get('max_tokens')),
+                max_wait=None if context is None else min(limiter.max_wait, context.remaining())
+            )
+        except asyncio.TimeoutError:
+            # Local saturation says nothing about the provider's health, the breaker is not told
+            yield Error(f"{provider} is at its rate limit, please try again in a moment", status=429)
+            return
+        
+        logger.info(f"Starting async streaming call to {provider} with prompt: {prompt}")
+        accumulator = StreamAccumulator()
+        breaker = self.breakers[provider]
+        start_time = time.monotonic()
+        ttft = None
+        last_content = None
+        stream = self.retry_policy.stream(
+            provider,
+            lambda: self._stream_attempt(provider, prompt, kwargs),
+            can_retry=breaker.allow_request
+        )
+        try:
+            # Closing the stream closes the provider's connection, so a cancelled
+            # request stops reading the response instead of draining it
+            async with aclosing(stream):
+                async for event in stream:
+                    if isinstance(event, (TextDelta, ReasoningDelta)):
+                        last_content = time.monotonic()
+                        if ttft is None:
+                            ttft = last_content - start_time
+                            self.ttft.record(provider, ttft)
+                    yield accumulator.add(event)
+        finally:
+            limiter.release(
+                reserved,
+                used_tokens=accumulator.usage.total_tokens if accumulator.usage else None,
+                latency=ttft,
+                failed=accumulator.error is not None
+            )
+        
+        if accumulator.usage is not None and kwargs.get('template') is not None:
+            self.prefix_cache.record(kwargs['template'].name, provider, accumulator.usage)
+        if accumulator.usage is not None:
+            self.usage.record(
+                provider,
+                kwargs.get('model') or kwargs.get('model_name'),
+                accumulator.usage,
+                user_id=context.user_id if context is not None else None,
+                chat_id=context.chat_id if context is not None else None,
+                command=context.command if context is not None else None
+            )
+        if accumulator.usage is not None and accumulator.usage.prompt_tokens:
+            # Reported prompt sizes correct later estimates of the same tokenizer family
+            self.budget.estimator.calibrate(
+                model_family(kwargs.get('model') or kwargs.get('model_name'), provider),
+                (kwargs.get('system_prompt'), *self._history_contents(kwargs), prompt),
+                accumulator.usage.prompt_tokens
+            )
+        
+        # Streams abandoned by the consumer never get here and are not counted
+        if accumulator.error:
+            # Errors caused by the request itself, e.g. 400 or 413, are neutral
+            if is_retryable(accumulator.error):
+                breaker.record_failure()
+        else:
+            breaker.record_success(ttft)
+            self._record_throughput(provider, accumulator, start_time + ttft if ttft is not None else None, last_content)
+        
+        # Only streams that ran to completion without an error are cached
+        if cache_key and accumulator.length and not accumulator.error:
+            self.cache.set(cache_key, accumulator.text)
+    
+    async def _stream_attempt(self, provider, prompt, kwargs):
+        """
+        Make one streaming attempt on the provider's least loaded API key and best endpoint
+        
+        A key that is rate limited or out of quota cools down. If another key
+        is available, the error's Retry-After is dropped so the retry goes out
+        on that key right away instead of waiting for this one. Transport
+        errors and server errors count against the endpoint, whose choice holds
+        for the whole attempt.
+        
+        Args:
+            provider (str): The provider to use
+            prompt (str): The prompt
+            kwargs (dict): Call parameters after system prompt enhancement
+            
+        Yields:
+            StreamEvent: Events from the provider
+        """
+        instance = self.providers[provider]
+        key_pool = instance.key_pool
+        endpoint_pool = instance.endpoint_pool
+        key = key_pool.acquire()
+        endpoint = endpoint_pool.best()
+        failed = False
+        endpoint_failed = False
+        used_tokens = None
+        try:
+            async with aclosing(instance.call_stream_async(prompt, **kwargs)) as stream:
+                # Providers read their api_key and base_url while sending the request, before the first event
+                with key_pool.bind(key), endpoint_pool.bind(endpoint):
+                    event = await anext(stream, None)
+                while event is not None:
+                    if isinstance(event, Error):
+                        failed = True
+                        endpoint_failed = event.transient or (event.status or 0) >= 500
+                        if key is not None and event.status in QUOTA_STATUSES:
+                            if key_pool.cool_down(key, event.status, event.retry_after):
+                                event = Error(event.message, status=event.status, transient=event.transient)
+                    elif isinstance(event, Usage):
+                        used_tokens = event.total_tokens
+                    yield event
+                    event = await anext(stream, None)
+        finally:
+            key_pool.release(key, failed=failed, used_tokens=used_tokens)
+            if endpoint is not None:
+                endpoint_pool.record(endpoint, failed=endpoint_failed)
+    
+    def _record_throughput(self, provider, accumulator, first_content, last_content):
+        """
+        Record the generation speed of a completed stream
+        
+        Args:
+            provider (str): The provider
+            accumulator (StreamAccumulator): The completed stream
+            first_content (float): time.monotonic() of the first content, None if there was none
+            last_content (float): time.monotonic() of the last content
+        """
+        if first_content is None or last_content <= first_content:
+            return
+        if accumulator.usage and accumulator.usage.completion_tokens:
+            tokens = accumulator.usage.completion_tokens
+        else:
+            tokens = estimate_tokens(accumulator.text) + estimate_tokens(accumulator.reasoning)
+        # Short answers say little about the provider's speed
+        if tokens >= 20:
+            self.throughput.record(provider, tokens / (last_content - first_content))
+    
+    async def call_llm_stream_with_fallback(self, command, provider, prompt, **kwargs):
+        """
+        Stream a command's request through its fallback chain
+        
+        Providers are tried in the order configured for the command. A provider
+        whose circuit is open is skipped instantly, and a provider that fails
+        before producing any content hands over to the next one. A provider
+        that stalls or fails mid-answer also hands over: the next one is asked
+        to continue the answer streamed so far, so the consumer sees a single
+        answer that keeps growing.
+        
+        Args:
+            command (str): Command name, e.g. 'gpt', 'r1', 'grok' or 'grok_think'
+            provider (str): Provider to use if the command has no configured chain
+            prompt (str): The prompt
+            **kwargs: Additional parameters, a model given here is only used
+                with `provider` and takes precedence over the chain's model
+            
+        Yields:
+            StreamEvent: TextDelta, ReasoningDelta, Usage, Finish or Error events
+        """
+        chain = config.llm_fallback_chains.get(command) or [(provider, None)]
+        context = get_request_context()
+        last_error = None
+        # Answer text the consumer has seen so far, across providers
+        answer = StreamAccumulator()
+        
+        for index, (candidate, model) in enumerate(chain):
+            if candidate not in self.providers and not config.is_test_environment():
+                continue
+            if last_error is not None and context is not None and not context.can_afford(config.llm_min_attempt_seconds):
+                logger.warning(f"/{command}: not falling back to {candidate}, the request deadline is too close")
+                break
+            
+            candidate_kwargs = dict(kwargs)
+            caller_model = candidate == provider and (kwargs.get('model') or kwargs.get('model_name'))
+            if not caller_model:
+                # Model names are provider specific, the chain decides for fallbacks
+                for key in ('model', 'model_name', 'mode'):
+                    candidate_kwargs.pop(key, None)
+                if model:
+                    candidate_kwargs['model'] = candidate_kwargs['model_name'] = model
+            
+            candidate_prompt = prompt
+            joiner = None
+            if answer.length:
+                self.stall_stats['continuations'] += 1
+                candidate_prompt = build_continuation_prompt(prompt, answer.text)
+                candidate_kwargs['use_cache'] = False
+                joiner = ContinuationJoiner(answer.text)
+            
+            has_next = index < len(chain) - 1
+            started = False
+            stream = guard_stalls(
+                self.call_llm_stream_async(candidate, candidate_prompt, **candidate_kwargs),
+                self._get_stall_timeout(candidate),
+                on_stall=lambda candidate=candidate: self._count_stall(candidate)
+            )
+            async with aclosing(stream):
+                async for event in stream:
+                    if joiner is not None and not isinstance(event, (TextDelta, ReasoningDelta)):
+                        held_back = joiner.flush()
+                        if held_back:
+                            yield answer.add(TextDelta(held_back))
+                    if isinstance(event, Error) and has_next:
+                        if started:
+                            logger.warning(f"/{command}: {candidate} stopped mid-answer, continuing on the next provider: {event}")
+                        else:
+                            logger.warning(f"/{command}: {candidate} failed before responding, falling back: {event}")
+                        last_error = event
+                        break
+                    if isinstance(event, (TextDelta, ReasoningDelta)):
+                        started = True
+                    if isinstance(event, TextDelta):
+                        if joiner is not None:
+                            text = joiner.feed(event.text)
+                            if not text:
+                                continue
+                            event = TextDelta(text)
+                        answer.add(event)
+                    yield event
+                else:
+                    if joiner is not None:
+                        held_back = joiner.flush()
+                        if held_back:
+                            yield answer.add(TextDelta(held_back))
+                    return
+        
+        yield last_error or Error(f"No provider is available for /{command}")
+    
+    def _apply_template(self, kwargs):
+        """
+        Resolve the system prompt of a request to its compiled prompt template
+        
+        The formatting instructions are appended to the system prompt, and the
+        template is passed on as "template" so providers only encode the user turn.
+        Earlier turns passed as "history" become part of the template's prefix.
+        
+        Args:
+            kwargs (dict): Call parameters, updated in place
+        """
+        template = prompt_templates.compile(kwargs.get('system_prompt', ''))
+        kwargs['system_prompt'] = template.system_prompt
+        kwargs['template'] = template.with_history(kwargs.pop('history', None))
+    
+    def _history_contents(self, kwargs):
+        template = kwargs.get('template')
+        return [message['content'] for message in template.history] if template is not None else []
+    
+    def _apply_budget(self, provider, prompt, kwargs):
+        """
+        Size the completion limit of a request to its model's context window
+        
+        Callers may pass "channel" as "file" for answers delivered as a
+        document, which get a larger limit than answers shown in the chat.
+        
+        Args:
+            provider (str): The provider to use
+            prompt (str): The prompt
+            kwargs (dict): Call parameters after _apply_template(), updated in place
+            
+        Returns:
+            str: The prompt, trimmed if it did not fit
+            
+        Raises:
+            PromptTooLong: If the prompt cannot fit the model's context window
+        """
+        prompt, kwargs['max_tokens'] = self.budget.plan(
+            provider,
+            kwargs.get('model') or kwargs.get('model_name'),
+            prompt,
+            system_prompt=kwargs.get('system_prompt'),
+            max_tokens=kwargs.get('max_tokens'),
+            channel=kwargs.pop('channel', 'inline'),
+            history=self._history_contents(kwargs)
+        )
+        return prompt
     
     def _call_test(self, prompt=None, delay=2):
         """
@@ -198,7 +1121,7 @@ class LLMClient:
             chunks (int): Number of chunks to return (default: 5)
             
         Yields:
-            str: Response chunks
+            TextDelta: Response chunks
         """
         # Log that a test streaming call is being made
         logger.info(f"Test streaming API called with prompt: {prompt}")
@@ -210,13 +1133,38 @@ class LLMClient:
         base_response = "Hello World\nService is currently unavailable. This is a test response."
         
         # Generate chunks
+        sent = 0
         for i in range(chunks):
-            # For each chunk, return an increasing portion
-            progress = (i + 1) / chunks
-            response_part = base_response[:int(len(base_response) * progress)]
+            # For each chunk, return the next portion
+            end = int(len(base_response) * (i + 1) / chunks)
             
             # Sleep to simulate streaming
             time.sleep(chunk_delay)
             
-            # Yield partial response
-            yield response_part
\ No newline at end of file
+            # Yield only the new part of the response
+            yield TextDelta(base_response[sent:end])
+            sent = end
+    
+    async def _call_test_stream_async(self, prompt=None, delay=2, chunks=5):
+        """
+        Async test interface that simulates a streaming API call without blocking the loop
+        
+        Args:
+            prompt (str): The prompt (unused in this test interface, included for API consistency)
+            delay (int): Total response time in seconds (default: 2)
+            chunks (int): Number of chunks to return (default: 5)
+            
+        Yields:
+            TextDelta: Response chunks
+        """
+        logger.info(f"Async test streaming API called with prompt: {prompt}")
+        
+        chunk_delay = delay / chunks
+        base_response = "Hello World\nService is currently unavailable. This is a test response."
+        
+        sent = 0
+        for i in range(chunks):
+            end = int(len(base_response) * (i + 1) / chunks)
+            await asyncio.sleep(chunk_delay)
+            yield TextDelta(base_response[sent:end])
+            sent = end
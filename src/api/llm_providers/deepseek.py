@@ -1,10 +1,20 @@
 import requests
+import requests.adapters
 import json
 import logging
+from contextlib import aclosing
+from core.config import config
+from core.request_context import get_timeouts
 from ..llm_client import LLMProvider
+from ..sse import ChatStreamParser
+from ..stream_events import Error
+from ..prompt_templates import prompt_templates
 
 logger = logging.getLogger("deepseek_provider")
 
+# System prompt of the reasoner mode when the caller gives none
+REASONER_SYSTEM_PROMPT = "You are a helpful AI assistant with reasoning capabilities. Think through problems step by step."
+
 class DeepseekProvider(LLMProvider):
     """
     Implementation of DeepSeek API provider
@@ -17,6 +27,11 @@ class DeepseekProvider(LLMProvider):
             api_key (str, optional): DeepSeek API key
         """
         super().__init__(api_key)
+        self.base_url = "https://api.deepseek.com/v1"
+        # Keep-alive session reused across requests instead of a new TLS handshake per call
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=config.http_pool_max_connections)
+        self.session.mount("https://", adapter)
         if not self.api_key:
             logger.warning("DeepSeek API key is not provided")
     
@@ -48,29 +63,19 @@ class DeepseekProvider(LLMProvider):
             "Authorization": f"Bearer {self.api_key}"
         }
         
-        # Create messages array with proper format
-        messages = []
-        
-        # Add system prompt if provided
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        
-        # Add user message
-        messages.append({"role": "user", "content": prompt})
-        
-        payload = {
-            "model": model,
-            "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "stream": False
-        }
+        # The system prompt prefix is encoded once per template, only the user turn per request
+        template = kwargs.get('template') or prompt_templates.compile(system_prompt, enhance=False)
+        payload = template.encode_payload(
+            prompt, model=model, max_tokens=max_tokens, temperature=temperature, stream=False
+        )
         
         try:
-            response = requests.post(
-                "https://api.deepseek.com/v1/chat/completions",
+            timeouts = get_timeouts()
+            response = self.session.post(
+                f"{self.base_url}/chat/completions",
                 headers=headers,
-                json=payload
+                data=payload,
+                timeout=(timeouts.connect, timeouts.total)
             )
             response.raise_for_status()
             return response.json()["choices"][0]["message"]["content"].strip()
@@ -92,7 +97,7 @@ class DeepseekProvider(LLMProvider):
                 system_prompt (str): System prompt defining AI's role and behavior
                 
         Returns:
-            Generator: Yields chunks of generated text response, with complete response at the end
+            Generator: Stream events, one TextDelta per new piece of content
         """
         model = kwargs.get('model', '')
         max_tokens = kwargs.get('max_tokens', 1000)
@@ -101,7 +106,7 @@ class DeepseekProvider(LLMProvider):
         system_prompt = kwargs.get('system_prompt')
         
         if not self.api_key:
-            yield "DeepSeek API key not found. Please set it in the .env file."
+            yield Error("DeepSeek API key not found. Please set it in the .env file.")
             return
         
         # Adjust model name based on mode
@@ -117,40 +122,31 @@ class DeepseekProvider(LLMProvider):
             "Authorization": f"Bearer {self.api_key}"
         }
         
-        # Create messages array with proper format
-        messages = []
-        
-        # Add system prompt if provided (prioritize explicit system_prompt over mode)
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
-        elif mode == "reasoner":
-            messages.append({
-                "role": "system", 
-                "content": "You are a helpful AI assistant with reasoning capabilities. Think through problems step by step."
-            })
+        # An explicit system prompt takes priority over the mode's
+        if not system_prompt and mode == "reasoner":
+            system_prompt = REASONER_SYSTEM_PROMPT
             model = "deepseek-reasoner"
-        
-        # Add user message
-        messages.append({"role": "user", "content": prompt})
-        
-        payload = {
-            "model": model,
-            "messages": messages,
-            "max_tokens": max_tokens,
-            "temperature": temperature,
-            "stream": True
-        }
-        
+        template = kwargs.get('template') or prompt_templates.compile(system_prompt, enhance=False)
+        payload = template.encode_payload(
+            prompt, model=model, max_tokens=max_tokens, temperature=temperature, stream=True,
+            # The final chunk then reports usage, including prompt cache hits
+            stream_options={"include_usage": True}
+        )
+        
+        response = None
         try:
             # Print request details for debugging
             logger.info(f"Making request to DeepSeek API with model: {model}")
             
-            # Stream the response
-            response = requests.post(
-                "https://api.deepseek.com/v1/chat/completions",
+            # Stream the response, requests applies one read timeout to the
+            # headers and every chunk
+            timeouts = get_timeouts()
+            response = self.session.post(
+                f"{self.base_url}/chat/completions",
                 headers=headers,
-                json=payload,
-                stream=True
+                data=payload,
+                stream=True,
+                timeout=(timeouts.connect, timeouts.first_byte)
             )
             
             # Check for errors
@@ -163,45 +159,69 @@ class DeepseekProvider(LLMProvider):
                 except:
                     error_msg += f": {response.text}"
                 
-                yield error_msg
+                yield Error(error_msg, status=response.status_code)
                 return
             
-            collected_content = ""
-            final_content = ""
-            
-            for line in response.iter_lines():
-                if line:
-                    # Skip "data: " prefix
-                    line = line.decode('utf-8')
-                    if line.startswith("data: "):
-                        line = line[6:]  # Skip "data: "
-                    
-                    # Check for [DONE] message
-                    if line == "[DONE]":
-                        # Ensure final complete response is yielded
-                        if final_content:
-                            yield final_content
-                        break
-                    
-                    try:
-                        json_response = json.loads(line)
-                        # Extract content - may vary based on actual DeepSeek API response format
-                        if "choices" in json_response and json_response["choices"]:
-                            delta = json_response["choices"][0].get("delta", {})
-                            if "content" in delta and delta["content"]:
-                                collected_content += delta["content"]
-                                # Track complete response for final yield
-                                final_content = collected_content
-                                yield collected_content
-                    except json.JSONDecodeError:
-                        # Skip lines that can't be decoded as JSON
-                        pass
-                        
-            # Ensure final response is yielded again after stream completes
-            # This helps prevent incomplete response errors
-            if final_content:
-                yield final_content
+            # chunk_size=None hands over data as soon as it arrives
+            parser = ChatStreamParser("DeepSeek")
+            for chunk in response.iter_content(chunk_size=None):
+                # Reasoning, answer text, finish reason and usage each become an event.
+                # The body is read to the end even after [DONE] so the pooled
+                # connection is released for reuse.
+                yield from parser.feed(chunk)
+            yield from parser.flush()
                 
         except Exception as e:
             logger.error(f"Error streaming from DeepSeek API: {e}")
-            yield f"Error streaming from DeepSeek API: {str(e)}"
\ No newline at end of file
+            yield Error(f"Error streaming from DeepSeek API: {str(e)}")
+        finally:
+            # A consumer that stopped early leaves the body unread, drop the connection
+            if response is not None:
+                response.close()
+    
+    async def call_stream_async(self, prompt, **kwargs):
+        """
+        Call DeepSeek API with native asyncio streaming support
+        
+        Args:
+            prompt (str): Prompt to send to API
+            **kwargs: Same parameters as call_stream
+                
+        Yields:
+            StreamEvent: TextDelta, ReasoningDelta, Usage, Finish or Error events
+        """
+        model = kwargs.get('model', '')
+        mode = kwargs.get('mode', 'chat')
+        system_prompt = kwargs.get('system_prompt')
+        
+        if not self.api_key:
+            yield Error("DeepSeek API key not found. Please set it in the .env file.")
+            return
+        
+        if mode == "reasoner" or model == "deepseek-reasoner":
+            model = "deepseek-reasoner"
+        elif not model:
+            model = "deepseek-chat"
+        
+        if not system_prompt and mode == "reasoner":
+            system_prompt = REASONER_SYSTEM_PROMPT
+        template = kwargs.get('template') or prompt_templates.compile(system_prompt, enhance=False)
+        payload = template.encode_payload(
+            prompt,
+            model=model,
+            max_tokens=kwargs.get('max_tokens', 1000),
+            temperature=kwargs.get('temperature', 0.7),
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        
+        logger.info(f"Making async request to DeepSeek API with model: {model}")
+        async with aclosing(self._stream_chat_completions(
+            "DeepSeek", f"{self.base_url}/chat/completions", payload, headers
+        )) as events:
+            async for event in events:
+                yield event
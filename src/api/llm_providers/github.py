@@ -1,6 +1,8 @@
 import logging
+from contextlib import aclosing
 from openai import OpenAI
 from ..llm_client import LLMProvider
+from ..stream_events import Error, events_from_sdk_chunk
 
 logger = logging.getLogger("github_provider")
 
@@ -16,10 +18,26 @@ class GitHubProvider(LLMProvider):
             api_key (str, optional): GitHub API key
         """
         super().__init__(api_key)
-        self.endpoint = "https://models.inference.ai.azure.com"
+        self.base_url = "https://models.inference.ai.azure.com"
+        # Created lazily once per endpoint and API key and reused, so their HTTP connection pools survive across calls
+        self._clients = {}
         if not self.api_key:
             logger.warning("GitHub API key is not provided")
     
+    @property
+    def client(self):
+        """
+        Shared OpenAI client for the current GitHub endpoint and API key
+        """
+        base_url, api_key = self.base_url, self.api_key
+        client = self._clients.get((base_url, api_key))
+        if client is None:
+            client = self._clients[(base_url, api_key)] = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+            )
+        return client
+    
     def call(self, prompt, **kwargs):
         """
         Call GitHub API to generate a response
@@ -40,10 +58,7 @@ class GitHubProvider(LLMProvider):
             return "GitHub API key not found. Please set it in the .env file or credentials file."
         
         try:
-            client = OpenAI(
-                base_url=self.endpoint,
-                api_key=self.api_key,
-            )
+            client = self.client
 
             response = client.chat.completions.create(
                 messages=[
@@ -58,7 +73,7 @@ class GitHubProvider(LLMProvider):
                 ],
                 temperature=1.0,
                 top_p=1.0,
-                max_tokens=1000,
+                max_tokens=kwargs.get('max_tokens', 1000),
                 model=model_name
             )
             return response.choices[0].message.content
@@ -77,20 +92,18 @@ class GitHubProvider(LLMProvider):
                 model_name (str): Model to use (default: gpt-4o-mini)
                 
         Returns:
-            Generator: Generator of partial responses
+            Generator: Stream events, one TextDelta per new piece of content
         """
         system_prompt = kwargs.get('system_prompt', 'You are a helpful AI assistant.')
         model_name = kwargs.get('model_name', 'gpt-4o-mini')
         
         if not self.api_key:
-            yield "GitHub API key not found. Please set it in the .env file or credentials file."
+            yield Error("GitHub API key not found. Please set it in the .env file or credentials file.")
             return
         
+        stream = None
         try:
-            client = OpenAI(
-                base_url=self.endpoint,
-                api_key=self.api_key,
-            )
+            client = self.client
 
             stream = client.chat.completions.create(
                 messages=[
@@ -105,18 +118,55 @@ class GitHubProvider(LLMProvider):
                 ],
                 temperature=1.0,
                 top_p=1.0,
-                max_tokens=1000,
+                max_tokens=kwargs.get('max_tokens', 1000),
                 model=model_name,
-                stream=True
+                stream=True,
+                # The final chunk then reports usage
+                stream_options={"include_usage": True}
             )
             
-            full_response = ""
             for chunk in stream:
-                if chunk.choices and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    full_response += content
-                    yield full_response
+                yield from events_from_sdk_chunk(chunk)
                     
         except Exception as e:
             logger.error(f"Error streaming from GitHub API: {e}")
-            yield f"Error streaming from GitHub API: {str(e)}"
\ No newline at end of file
+            yield Error(f"Error streaming from GitHub API: {str(e)}")
+        finally:
+            # A consumer that stopped early leaves the body unread, drop the connection
+            if stream is not None:
+                stream.close()
+    
+    async def call_stream_async(self, prompt, **kwargs):
+        """
+        Call GitHub API with native asyncio streaming support
+        
+        Args:
+            prompt (str): User prompt
+            **kwargs: Additional parameters, including:
+                system_prompt (str): System prompt to set the context
+                model_name (str): Model to use (default: gpt-4o-mini)
+                
+        Yields:
+            StreamEvent: TextDelta, Usage, Finish or Error events
+        """
+        system_prompt = kwargs.get('system_prompt', 'You are a helpful AI assistant.')
+        model_name = kwargs.get('model_name', 'gpt-4o-mini')
+        
+        if not self.api_key:
+            yield Error("GitHub API key not found. Please set it in the .env file or credentials file.")
+            return
+        
+        payload = self.get_prompt_template(kwargs, system_prompt).encode_payload(
+            prompt, temperature=1.0, top_p=1.0, max_tokens=kwargs.get('max_tokens', 1000), model=model_name, stream=True,
+            stream_options={"include_usage": True}
+        )
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        async with aclosing(self._stream_chat_completions(
+            "GitHub", f"{self.base_url}/chat/completions", payload, headers
+        )) as events:
+            async for event in events:
+                yield event
@@ -1,8 +1,14 @@
 import http.client
 import json
-import time
 import logging
+import time
+from contextlib import aclosing
+from core.request_context import get_timeouts
 from ..llm_client import LLMProvider
+from ..sse import ChatStreamParser
+from ..stream_events import Error
+from ..retry import parse_retry_after
+from ..prompt_templates import prompt_templates
 
 logger = logging.getLogger("grok_provider")
 
@@ -18,6 +24,7 @@ class GrokProvider(LLMProvider):
             api_key (str, optional): Grok API key
         """
         super().__init__(api_key)
+        self.base_url = "https://chatapi.littlewheat.com/v1"
         if not self.api_key:
             logger.warning("Grok API key is not provided")
     
@@ -40,39 +47,17 @@ class GrokProvider(LLMProvider):
         if not self.api_key:
             return "Grok API key not found. Please set GROK_API_KEY in the .env file or credentials file."
         
-        # Enhance system prompt for Telegram-friendly formatting
-        enhanced_system_prompt = system_prompt
-        if system_prompt and "Format your response" not in system_prompt:
-            enhanced_system_prompt = system_prompt + " Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
-        elif not system_prompt:
-            enhanced_system_prompt = "You are a helpful AI assistant. Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
+        # Telegram-friendly system prompt, compiled once into the request prefix
+        template = kwargs.get('template') or prompt_templates.compile(system_prompt)
         
+        pool, path = self.get_sync_endpoint("/chat/completions")
+        conn = pool.acquire()
+        reusable = False
         try:
-            # Set up HTTP connection to API endpoint
-            conn = http.client.HTTPSConnection("chatapi.littlewheat.com")
-            
-            # Set up messages
-            messages = []
-            if enhanced_system_prompt:
-                messages.append({
-                    "role": "system",
-                    "content": enhanced_system_prompt
-                })
-            
-            # Add user message
-            messages.append({
-                "role": "user", 
-                "content": prompt
-            })
-            
-            # Prepare request payload
-            payload = json.dumps({
-                "model": model_name,
-                "messages": messages,
-                "stream": False,
-                "temperature": 0.7,
-                "max_tokens": 1000
-            })
+            # Only the user turn is encoded per request
+            payload = template.encode_payload(
+                prompt, model=model_name, stream=False, temperature=0.7, max_tokens=kwargs.get('max_tokens', 1000)
+            )
             
             # Set headers with authorization
             headers = {
@@ -81,11 +66,12 @@ class GrokProvider(LLMProvider):
             }
             
             # Send request
-            conn.request("POST", "/v1/chat/completions", payload, headers)
+            conn.request("POST", path, payload, headers)
             
             # Get response
             res = conn.getresponse()
             data = res.read()
+            reusable = not res.will_close
             
             # Parse response
             if res.status != 200:
@@ -97,6 +83,8 @@ class GrokProvider(LLMProvider):
         except Exception as e:
             logger.error(f"Error calling Grok API: {e}")
             return f"Error calling Grok API: {str(e)}"
+        finally:
+            pool.release(conn, reusable=reusable)
     
     def call_stream(self, prompt, **kwargs):
         """
@@ -109,214 +97,131 @@ class GrokProvider(LLMProvider):
                 model_name (str): Model to use (default: grok-3-reasoner)
                 
         Returns:
-            Generator: Generator yielding partial responses
+            Generator: Stream events, one TextDelta per new piece of content
         """
         # Get keyword arguments
         system_prompt = kwargs.get('system_prompt', '')
         model_name = kwargs.get('model_name', 'grok-3-reasoner')
         
         if not self.api_key:
-            yield "Grok API key not found. Please set GROK_API_KEY in the .env file or credentials file."
+            yield Error("Grok API key not found. Please set GROK_API_KEY in the .env file or credentials file.")
             return
         
-        # Enhance system prompt
-        enhanced_system_prompt = system_prompt
-        if system_prompt and "Format your response" not in system_prompt:
-            enhanced_system_prompt = system_prompt + " Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
-        elif not system_prompt:
-            enhanced_system_prompt = "You are a helpful AI assistant. Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
-        
-        # Set up messages
-        messages = []
-        if enhanced_system_prompt:
-            messages.append({
-                "role": "system",
-                "content": enhanced_system_prompt
-            })
+        # Telegram-friendly system prompt, compiled once into the request prefix
+        template = kwargs.get('template') or prompt_templates.compile(system_prompt)
         
-        # Add user message
-        messages.append({
-            "role": "user", 
-            "content": prompt
-        })
-        
-        # Maximum retry count
-        max_retries = 3
-        retry_count = 0
-        retry_delay = 2  # seconds
-        
-        while retry_count < max_retries:
-            try:
-                # Print request details for debugging
-                logger.info(f"Making request to chatapi.littlewheat.com with model: {model_name} (attempt {retry_count + 1}/{max_retries})")
-                
-                # Set up connection to specific API endpoint
-                conn = http.client.HTTPSConnection("chatapi.littlewheat.com", timeout=30)
-                
-                # Prepare streaming payload
-                payload = json.dumps({
-                    "model": model_name,
-                    "messages": messages,
-                    "stream": True,
-                    "temperature": 0.7,
-                    "max_tokens": 1000
-                })
-                
-                # Set headers with API key
-                headers = {
-                    'Authorization': f'Bearer {self.api_key}',
-                    'Content-Type': 'application/json'
-                }
-                
-                # Make streaming API request
-                conn.request("POST", "/v1/chat/completions", payload, headers)
-                response = conn.getresponse()
-                
-                # Check for errors
-                if response.status != 200:
-                    error_data = response.read().decode('utf-8', errors='replace')
-                    error_msg = f"Grok API returned error {response.status}: {error_data}"
-                    
-                    # If server error (5xx), retry
-                    if 500 <= response.status < 600:
-                        retry_count += 1
-                        if retry_count < max_retries:
-                            logger.warning(f"Server error {response.status}, retrying in {retry_delay} seconds...")
-                            time.sleep(retry_delay)
-                            retry_delay *= 2  # Exponential backoff
-                            continue
-                    
-                    # If we've exhausted retries or it's a client error, yield error message
-                    yield error_msg
+        # Retries are owned by the client's async retry policy, this makes one attempt
+        pool, path = self.get_sync_endpoint("/chat/completions")
+        timeouts = get_timeouts()
+        conn = None
+        response = None
+        try:
+            logger.info(f"Making request to {pool.host} with model: {model_name}")
+            
+            # Check out a keep-alive connection to the API endpoint
+            conn = pool.acquire()
+            if conn.sock is None:
+                conn.timeout = timeouts.connect
+                conn.connect()
+            # Kept because the connection drops its socket when the server asks to close
+            sock = conn.sock
+            sock.settimeout(timeouts.first_byte)
+            
+            # Prepare streaming payload
+            payload = template.encode_payload(
+                prompt, model=model_name, stream=True, temperature=0.7, max_tokens=kwargs.get('max_tokens', 1000),
+                # The final chunk then reports usage
+                stream_options={"include_usage": True}
+            )
+            
+            # Set headers with API key
+            headers = {
+                'Authorization': f'Bearer {self.api_key}',
+                'Content-Type': 'application/json'
+            }
+            
+            # Make streaming API request
+            conn.request("POST", path, payload, headers)
+            response = conn.getresponse()
+            
+            # Check for errors
+            if response.status != 200:
+                error_data = response.read().decode('utf-8', errors='replace')
+                yield Error(
+                    f"Grok API returned error {response.status}: {error_data}",
+                    status=response.status,
+                    retry_after=parse_retry_after(response.getheader('Retry-After'))
+                )
+                return
+            
+            # Process streaming response
+            parser = ChatStreamParser("Grok")
+            while not parser.done:
+                if timeouts.deadline is not None and time.monotonic() >= timeouts.deadline:
+                    yield Error("Error streaming from Grok API: the request deadline passed")
                     return
+                sock.settimeout(timeouts.read_timeout())
+                # read1 returns as soon as data arrives instead of waiting for a full block
+                chunk = response.read1(4096)
+                if not chunk:
+                    break
+                yield from parser.feed(chunk)
+            
+            if parser.done:
+                # Drain the rest of the body so the connection can be reused
+                response.read()
+            else:
+                yield from parser.flush()
                 
-                # Process streaming response
-                collected_content = ""
-                buffer = ""
-                incomplete_json = ""
+        except (http.client.HTTPException, OSError) as e:
+            logger.error(f"HTTP error streaming from Grok API: {e}")
+            yield Error(f"Error connecting to Grok API: {str(e)}", transient=True)
                 
-                # Read larger chunks at once instead of byte by byte to avoid UTF-8 decoding issues
-                while True:
-                    chunk = response.read(4096)  # Read 4KB at a time
-                    if not chunk:
-                        break
-                    
-                    # Decode with error handling
-                    try:
-                        text = chunk.decode('utf-8', errors='replace')
-                        buffer += text
-                    except Exception as e:
-                        logger.warning(f"Warning: Error decoding chunk: {e}")
-                        continue
-                    
-                    # Process complete lines
-                    lines = buffer.split('\n')
-                    buffer = lines.pop()  # Keep the last possibly incomplete line in the buffer
-                    
-                    for line in lines:
-                        if not line.strip():
-                            continue
-                        
-                        if line.startswith('data: '):
-                            line = line[6:].strip()  # Skip "data: " prefix
-                            
-                            if line == '[DONE]':
-                                # Final yield of complete response
-                                if collected_content:
-                                    yield collected_content
-                                return
-                            
-                            # Improved JSON processing logic
-                            try:
-                                # Try direct parsing
-                                json_obj = None
-                                try:
-                                    json_obj = json.loads(line)
-                                except json.JSONDecodeError:
-                                    # If there's incomplete JSON from previous chunk, try combining
-                                    if incomplete_json:
-                                        try:
-                                            combined = incomplete_json + line
-                                            json_obj = json.loads(combined)
-                                            incomplete_json = ""  # Reset after successful parse
-                                        except json.JSONDecodeError:
-                                            # Still incomplete, store for next iteration
-                                            incomplete_json += line
-                                            continue
-                                    else:
-                                        # This might be the start of incomplete JSON
-                                        incomplete_json = line
-                                        continue
-                                
-                                # If we have successfully parsed the JSON object
-                                if json_obj and "choices" in json_obj and json_obj["choices"]:
-                                    delta = json_obj["choices"][0].get("delta", {})
-                                    if "content" in delta and delta["content"] is not None:
-                                        new_content = delta["content"]
-                                        collected_content += new_content
-                                        yield collected_content
-                            except Exception as je:
-                                logger.warning(f"Warning: JSON processing error: {je}. Input: {line[:100]}...")
-                                # Do not store this as incomplete_json, as it might be invalid
-                                incomplete_json = ""  # Reset invalid JSON
-                                continue
+        except Exception as e:
+            import traceback
+            logger.error(f"Error streaming from Grok API: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield Error(f"Error streaming from Grok API: {str(e)}")
+        finally:
+            if conn is not None:
+                # Only a fully read response leaves the connection reusable
+                reusable = response is not None and response.isclosed() and not response.will_close
+                pool.release(conn, reusable=reusable)
+    
+    async def call_stream_async(self, prompt, **kwargs):
+        """
+        Call Grok API with native asyncio streaming support
+        
+        Args:
+            prompt (str): User prompt
+            **kwargs: Additional parameters including:
+                system_prompt (str): System prompt to set context
+                model_name (str): Model to use (default: grok-3-reasoner)
                 
-                # Process any remaining buffer content
-                if buffer.strip():
-                    if buffer.startswith('data: '):
-                        buffer = buffer[6:].strip()
-                        
-                    if buffer != '[DONE]':
-                        # Try to process any remaining JSON
-                        try:
-                            combined = incomplete_json + buffer if incomplete_json else buffer
-                            json_obj = None
-                            
-                            try:
-                                json_obj = json.loads(combined)
-                            except json.JSONDecodeError:
-                                # If we still can't parse it, try to clean it up
-                                # Sometimes we get broken JSON at the end of the stream
-                                try:
-                                    # Try to find the last complete JSON object
-                                    if combined.rstrip().endswith("}"):
-                                        # Find the last opening brace that might start a valid object
-                                        last_open = combined.rfind("{")
-                                        if last_open >= 0:
-                                            # Extract what might be a valid JSON object
-                                            potential_json = combined[last_open:]
-                                            json_obj = json.loads(potential_json)
-                                except:
-                                    logger.warning(f"Warning: Could not parse final buffer content: {buffer[:100]}...")
-                            
-                            if json_obj and "choices" in json_obj and json_obj["choices"]:
-                                delta = json_obj["choices"][0].get("delta", {})
-                                if "content" in delta and delta["content"] is not None:
-                                    new_content = delta["content"]
-                                    collected_content += new_content
-                        except Exception as e:
-                            logger.warning(f"Warning: Error processing final buffer: {str(e)}")
-                            
-                # Ensure we generate final content
-                if collected_content:
-                    yield collected_content
-                return
-                    
-            except http.client.HTTPException as e:
-                retry_count += 1
-                if retry_count < max_retries:
-                    logger.warning(f"HTTP error: {e}, retrying in {retry_delay} seconds...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                    continue
-                else:
-                    logger.error(f"HTTP error after {max_retries} attempts: {e}")
-                    yield f"Error connecting to Grok API after {max_retries} attempts: {str(e)}"
-                    return
-                    
-            except Exception as e:
-                import traceback
-                logger.error(f"Error streaming from Grok API: {str(e)}")
-                logger.error(traceback.format_exc())
-                yield f"Error streaming from Grok API: {str(e)}"
-                return
\ No newline at end of file
+        Yields:
+            StreamEvent: TextDelta, Usage, Finish or Error events
+        """
+        system_prompt = kwargs.get('system_prompt', '')
+        model_name = kwargs.get('model_name', 'grok-3-reasoner')
+        
+        if not self.api_key:
+            yield Error("Grok API key not found. Please set GROK_API_KEY in the .env file or credentials file.")
+            return
+        
+        template = kwargs.get('template') or prompt_templates.compile(system_prompt)
+        
+        payload = template.encode_payload(
+            prompt, model=model_name, stream=True, temperature=0.7, max_tokens=kwargs.get('max_tokens', 1000),
+            # The final chunk then reports usage
+            stream_options={"include_usage": True}
+        )
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        
+        async with aclosing(self._stream_chat_completions(
+            "Grok", f"{self.base_url}/chat/completions", payload, headers
+        )) as events:
+            async for event in events:
+                yield event
@@ -0,0 +1,301 @@
+import json
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from core.config import config
+
+# Appended to every system prompt so answers render well in Telegram
+FORMAT_INSTRUCTIONS = "Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
+
+# System prompts that already ask for a format are left as they are
+FORMAT_MARKER = "Format your response"
+
+# Built-in system prompt of each command, overridable in the prompts file
+DEFAULT_PROMPTS = {
+    'default': "You are a helpful AI assistant.",
+    'grok': "You are a helpful AI assistant called Grok. Always provide clear, detailed and accurate responses.",
+    'grok_think': "You are a helpful AI assistant with reasoning capabilities. Think through problems step by step and explore different aspects of the question.",
+    'deepseek': "You are a helpful AI assistant called DeepSeek. Always provide clear, detailed and accurate responses.",
+    'r1': "You are a helpful AI assistant with strong reasoning capabilities. Think through problems step by step and provide detailed, logical explanations with clear reasoning chains.",
+    'gpt': "You are GPT, a helpful AI assistant. Always provide clear, detailed and accurate responses.",
+}
+
+
+def canonical_prompt(system_prompt):
+    """
+    Normalize a system prompt so equivalent prompts share one cached prefix
+
+    Provider context caches match byte-identical prefixes, so stray
+    surrounding whitespace must not turn the same prompt into a new one.
+
+    Args:
+        system_prompt (str): The system prompt, may be None
+
+    Returns:
+        str: The prompt without surrounding whitespace
+    """
+    return (system_prompt or '').strip()
+
+
+@lru_cache(maxsize=64)
+def _encode_tail(fields):
+    """
+    Encode the request fields that follow the message list
+
+    Args:
+        fields (tuple): (name, value) pairs such as model and temperature
+
+    Returns:
+        bytes: JSON closing the message list and the payload object
+    """
+    if not fields:
+        return b']}'
+    return b'], ' + json.dumps(dict(fields))[1:].encode('utf-8')
+
+
+class PromptTemplate:
+    """
+    A system prompt compiled into the fixed part of a chat completion request
+
+    The message list prefix and its JSON encoding are built once, so a request
+    only encodes the user turn. The prefix is byte-for-byte identical on every
+    request using the template.
+    """
+    def __init__(self, name, system_prompt, history=()):
+        """
+        Compile a template
+
+        Args:
+            name (str): Template name, e.g. the command using it
+            system_prompt (str): Final system prompt, may be empty
+            history (tuple): Earlier conversation messages following the system prompt
+        """
+        self.name = name
+        self.system_prompt = system_prompt
+        self.history = tuple(history)
+        self.prefix = (({"role": "system", "content": system_prompt},) if system_prompt else ()) + self.history
+        # Everything up to the user turn: {"messages": [{"role": "system", ...},
+        self._head = ('{"messages": [' + ''.join(json.dumps(message) + ', ' for message in self.prefix)).encode('utf-8')
+
+    def with_history(self, history):
+        """
+        Get the template continuing a conversation
+
+        The history follows the system prompt, so a thread's prefix only
+        grows and stays cacheable by the provider from one turn to the next.
+
+        Args:
+            history (list): Earlier {"role", "content"} messages, oldest first, may be empty
+
+        Returns:
+            PromptTemplate: This template if there is no history, else a new one
+        """
+        if not history:
+            return self
+        return PromptTemplate(self.name, self.system_prompt, history)
+
+    def build_messages(self, prompt):
+        """
+        Build the message list for a prompt
+
+        Args:
+            prompt (str): User prompt
+
+        Returns:
+            list: The shared prefix messages followed by the user turn, the
+                prefix dictionaries must not be modified
+        """
+        return [*self.prefix, {"role": "user", "content": prompt}]
+
+    def encode_payload(self, prompt, **fields):
+        """
+        Encode a chat completion payload for a prompt
+
+        Args:
+            prompt (str): User prompt
+            **fields: Other payload fields such as model, temperature and stream
+
+        Returns:
+            bytes: The JSON request body
+        """
+        user = json.dumps({"role": "user", "content": prompt}).encode('utf-8')
+        fields = tuple(fields.items())
+        try:
+            tail = _encode_tail(fields)
+        except TypeError:
+            # Nested values such as stream_options cannot key the cache
+            tail = _encode_tail.__wrapped__(fields)
+        return self._head + user + tail
+
+    def encode(self, payload):
+        """
+        Encode a payload whose message list came from build_messages()
+
+        Args:
+            payload (dict): Chat completion payload
+
+        Returns:
+            bytes: The JSON request body
+        """
+        fields = {key: value for key, value in payload.items() if key != 'messages'}
+        return self.encode_payload(payload['messages'][-1]['content'], **fields)
+
+
+class PromptRegistry:
+    """
+    System prompts of every command, compiled once and shared by all requests
+
+    Named templates are compiled when the registry is created. Ad-hoc system
+    prompts are compiled on first use and kept in a bounded LRU, so callers
+    passing the same string keep getting the same compiled template.
+    """
+    def __init__(self, prompts=None, format_instructions=None, max_compiled=256):
+        """
+        Initialize the registry
+
+        Args:
+            prompts (dict, optional): Template name to system prompt, overriding the defaults
+            format_instructions (str, optional): Replaces the default formatting instructions
+            max_compiled (int): Ad-hoc system prompts kept compiled
+        """
+        self.format_instructions = format_instructions or FORMAT_INSTRUCTIONS
+        self.prompts = dict(DEFAULT_PROMPTS, **(prompts or {}))
+        self.max_compiled = max_compiled
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+        self._named = {name: PromptTemplate(name, self.enhance(prompt)) for name, prompt in self.prompts.items()}
+        self._by_prompt = {template.system_prompt: template for template in self._named.values()}
+
+    def enhance(self, system_prompt):
+        """
+        Append the Telegram-friendly formatting instructions to a system prompt
+
+        Args:
+            system_prompt (str): The caller's system prompt, may be empty
+
+        Returns:
+            str: The enhanced system prompt
+        """
+        system_prompt = canonical_prompt(system_prompt)
+        if not system_prompt:
+            return self.prompts['default'] + " " + self.format_instructions
+        if FORMAT_MARKER in system_prompt or self.format_instructions in system_prompt:
+            return system_prompt
+        return system_prompt + " " + self.format_instructions
+
+    def system_prompt(self, name):
+        """
+        Get the configured system prompt of a command
+
+        Args:
+            name (str): Template name
+
+        Returns:
+            str: The system prompt before enhancement, the default one for unknown names
+        """
+        return self.prompts.get(name, self.prompts['default'])
+
+    def get(self, name):
+        """
+        Get the compiled template of a command
+
+        Args:
+            name (str): Template name
+
+        Returns:
+            PromptTemplate: The template, the default one for unknown names
+        """
+        return self._named.get(name) or self._named['default']
+
+    def compile(self, system_prompt, enhance=True):
+        """
+        Get the compiled template for a system prompt
+
+        Args:
+            system_prompt (str): The system prompt, may be empty
+            enhance (bool): Whether to append the formatting instructions first
+
+        Returns:
+            PromptTemplate: The cached template
+        """
+        text = self.enhance(system_prompt) if enhance else canonical_prompt(system_prompt)
+        template = self._by_prompt.get(text)
+        if template is not None:
+            return template
+        with self._lock:
+            template = self._compiled.get(text)
+            if template is not None:
+                self._compiled.move_to_end(text)
+                return template
+            template = PromptTemplate('custom', text)
+            self._compiled[text] = template
+            if len(self._compiled) > self.max_compiled:
+                self._compiled.popitem(last=False)
+            return template
+
+
+class PrefixCacheStats:
+    """
+    Provider-side context cache use per prompt template
+
+    Providers such as DeepSeek report how many prompt tokens were served from
+    their prefix cache. Counting them per template, which is per command
+    family, shows which prompts keep a stable prefix.
+    """
+    def __init__(self):
+        self._counts = {}  # (template name, provider) -> [requests, hit tokens, miss tokens]
+        self._lock = threading.Lock()
+
+    def record(self, template, provider, usage):
+        """
+        Record the usage of a completed request
+
+        Args:
+            template (str): Template name
+            provider (str): Provider name
+            usage (Usage): Usage reported by the provider, ignored if it has no cache counts
+        """
+        hit = usage.cache_hit_tokens
+        if hit is None:
+            return
+        with self._lock:
+            counts = self._counts.setdefault((template, provider), [0, 0, 0])
+            counts[0] += 1
+            counts[1] += hit
+            counts[2] += usage.cache_miss_tokens
+
+    def get_stats(self):
+        """
+        Get cache use per template
+
+        Returns:
+            dict: Template name to provider to requests, hit and miss tokens and the hit ratio
+        """
+        stats = {}
+        with self._lock:
+            for (template, provider), (requests, hit, miss) in self._counts.items():
+                stats.setdefault(template, {})[provider] = {
+                    'requests': requests,
+                    'hit_tokens': hit,
+                    'miss_tokens': miss,
+                    'hit_ratio': hit / (hit + miss) if hit + miss else 0.0,
+                }
+        return stats
+
+
+# Global prompt template registry
+prompt_templates = PromptRegistry(config.llm_prompts, config.llm_format_instructions)
+
+
+def enhance_system_prompt(system_prompt):
+    """
+    Append the Telegram-friendly formatting instructions to a system prompt
+
+    Args:
+        system_prompt (str): The caller's system prompt, may be empty
+
+    Returns:
+        str: The enhanced system prompt
+    """
+    return prompt_templates.enhance(system_prompt)
@@ -3,7 +3,9 @@ import json
 import requests
 import logging
 import time
+from contextlib import aclosing
 from ..base_provider import LLMProvider
+from ..stream_events import Error, StreamAccumulator, events_from_sdk_chunk
 from openai import OpenAI
 
 logger = logging.getLogger("llm_client")
@@ -22,12 +24,8 @@ class DeepSeekProvider(LLMProvider):
         super().__init__(api_key)
         self.api_key = api_key or os.getenv('DEEPSEEK_API_KEY')
         self.base_url = "https://api.deepseek.com/v1"
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        # Create OpenAI client for Deepseek API
-        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)
+        # OpenAI clients for the Deepseek API, one per endpoint and API key
+        self._clients = {}
         
         # Available DeepSeek models as per documentation
         # https://platform.deepseek.com/usage
@@ -41,6 +39,54 @@ class DeepSeekProvider(LLMProvider):
             "deepseek-reasoner"  # Added deepseek-reasoner model
         ]
     
+    @property
+    def headers(self):
+        """
+        Request headers for the current API key
+        """
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+    
+    @property
+    def client(self):
+        """
+        OpenAI client for the current Deepseek endpoint and API key
+        """
+        base_url, api_key = self.base_url, self.api_key
+        client = self._clients.get((base_url, api_key))
+        if client is None:
+            client = self._clients[(base_url, api_key)] = OpenAI(api_key=api_key, base_url=base_url)
+        return client
+    
+    def _build_payload(self, prompt, **kwargs):
+        """
+        Build the chat completion payload shared by all call paths
+        
+        Args:
+            prompt (str): The prompt to send to the API
+            **kwargs: Additional parameters including system_prompt, model,
+                temperature and max_tokens
+            
+        Returns:
+            dict: Request payload without the stream flag
+        """
+        # Get model name from kwargs or use default
+        model = kwargs.get("model", "deepseek-chat")
+        
+        # Validate model
+        if model not in self.available_models:
+            logger.warning(f"Model '{model}' not in DeepSeek API available models list. Falling back to deepseek-chat.")
+            model = "deepseek-chat"
+        
+        return {
+            "model": model,
+            "messages": self.get_prompt_template(kwargs, "You are a helpful assistant.").build_messages(prompt),
+            "temperature": kwargs.get("temperature", 0.7),
+            "max_tokens": kwargs.get("max_tokens", 2000)
+        }
+    
     def call(self, prompt, **kwargs):
         """
         Call DeepSeek API to generate a response
@@ -60,39 +106,13 @@ class DeepSeekProvider(LLMProvider):
             if not self.api_key:
                 return "DeepSeek API key not found. Please set it in the .env file."
                 
-            # Create messages array with proper format
-            messages = []
-            
-            # Add system prompt if provided
-            system_prompt = kwargs.get("system_prompt", "You are a helpful assistant.")
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            
-            # Add user message
-            messages.append({"role": "user", "content": prompt})
-            
-            # Get model name from kwargs or use default
-            model = kwargs.get("model", "deepseek-chat")
-            
-            # Validate model
-            if model not in self.available_models:
-                logger.warning(f"Model '{model}' not in DeepSeek API available models list. Falling back to deepseek-chat.")
-                model = "deepseek-chat"
-                
-            temperature = kwargs.get("temperature", 0.7)
-            max_tokens = kwargs.get("max_tokens", 2000)
+            payload = self._build_payload(prompt, **kwargs)
             
             # Log the request using the base class method
-            self.log_request("DeepSeek", prompt, model=model, system_prompt=system_prompt)
+            self.log_request("DeepSeek", prompt, model=payload["model"], system_prompt=kwargs.get("system_prompt", "You are a helpful assistant."))
             
             # Using the OpenAI client with Deepseek API
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=False
-            )
+            response = self.client.chat.completions.create(stream=False, **payload)
             
             response_text = response.choices[0].message.content
             
@@ -121,60 +141,33 @@ class DeepSeekProvider(LLMProvider):
                 model (str): The model to use (default: deepseek-chat)
             
         Yields:
-            str: Response chunks (only new content)
+            StreamEvent: TextDelta, ReasoningDelta, Usage, Finish or Error events
         """
         start_time = time.time()
-        full_response = ""
+        full_response = StreamAccumulator()
         
         try:
             if not self.api_key:
-                yield "DeepSeek API key not found. Please set it in the .env file."
+                yield Error("DeepSeek API key not found. Please set it in the .env file.")
                 return
                 
-            # Create messages array with proper format
-            messages = []
-            
-            # Add system prompt if provided
-            system_prompt = kwargs.get("system_prompt", "You are a helpful assistant.")
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            
-            # Add user message
-            messages.append({"role": "user", "content": prompt})
-            
-            # Get model name and parameters from kwargs or use defaults
-            model = kwargs.get("model", "deepseek-chat")
-            
-            # Validate model
-            if model not in self.available_models:
-                logger.warning(f"Model '{model}' not in DeepSeek API available models list. Falling back to deepseek-chat.")
-                model = "deepseek-chat"
-                
-            temperature = kwargs.get("temperature", 0.7)
-            max_tokens = kwargs.get("max_tokens", 2000)
+            payload = self._build_payload(prompt, **kwargs)
             
             # Log the request using the base class method
-            self.log_request("DeepSeek", prompt, model=model, system_prompt=system_prompt)
+            self.log_request("DeepSeek", prompt, model=payload["model"], system_prompt=kwargs.get("system_prompt", "You are a helpful assistant."))
             
             # Using the OpenAI client with streaming
-            stream = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=temperature,
-                max_tokens=max_tokens,
-                stream=True
-            )
+            # The final chunk then reports usage, including prompt cache hits
+            stream = self.client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **payload)
             
             # Process the streaming response, yielding only new content each time
             for chunk in stream:
-                if hasattr(chunk.choices[0].delta, "content") and chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    full_response += content
-                    yield content
+                for event in events_from_sdk_chunk(chunk):
+                    yield full_response.add(event)
             
             # Log the complete response at the end of streaming
             elapsed_time = time.time() - start_time
-            self.log_response("DeepSeek", full_response, elapsed_time)
+            self.log_response("DeepSeek", full_response.text, elapsed_time)
                     
         except Exception as e:
             error_msg = f"Error in DeepSeek streaming: {e}"
@@ -182,4 +175,36 @@ class DeepSeekProvider(LLMProvider):
             # Log the error response
             self.log_response("DeepSeek", f"ERROR: {error_msg}", time.time() - start_time)
             # Include the DeepSeek platform URL for reference
-            yield f"{error_msg}\nPlease verify your API key and model at https://platform.deepseek.com/usage"
\ No newline at end of file
+            yield Error(f"{error_msg}\nPlease verify your API key and model at https://platform.deepseek.com/usage")
+    
+    async def call_stream_async(self, prompt, **kwargs):
+        """
+        Call DeepSeek API with native asyncio streaming support
+        
+        Args:
+            prompt (str): The prompt to send to the API
+            **kwargs: Additional parameters including:
+                system_prompt (str): Optional system prompt to set context
+                model (str): The model to use (default: deepseek-chat)
+            
+        Yields:
+            StreamEvent: TextDelta, ReasoningDelta, Usage, Finish or Error events
+        """
+        if not self.api_key:
+            yield Error("DeepSeek API key not found. Please set it in the .env file.")
+            return
+        
+        start_time = time.time()
+        payload = self._build_payload(prompt, **kwargs)
+        self.log_request("DeepSeek", prompt, model=payload["model"], system_prompt=kwargs.get("system_prompt", "You are a helpful assistant."))
+        
+        # Only the user turn is serialized, the system prompt prefix is pre-encoded
+        body = self.get_prompt_template(kwargs, "You are a helpful assistant.").encode(dict(payload, stream=True, stream_options={"include_usage": True}))
+        full_response = StreamAccumulator()
+        async with aclosing(self._stream_chat_completions(
+            "DeepSeek", f"{self.base_url}/chat/completions", body, self.headers
+        )) as events:
+            async for event in events:
+                yield full_response.add(event)
+        
+        self.log_response("DeepSeek", full_response.text, time.time() - start_time)
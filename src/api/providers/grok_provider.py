@@ -2,9 +2,11 @@ import os
 import json
 import requests
 import logging
-import http.client
 import time
+from contextlib import aclosing
 from ..base_provider import LLMProvider
+from ..sse import ChatStreamParser
+from ..stream_events import Error, StreamAccumulator
 
 logger = logging.getLogger("llm_client")
 
@@ -21,14 +23,41 @@ class GrokProvider(LLMProvider):
         """
         super().__init__(api_key)
         self.api_key = api_key or os.getenv('GROK_API_KEY')
-        # Use chatapi.littlewheat.com as the endpoint
-        self.base_domain = "chatapi.littlewheat.com"
-        self.endpoint = "/v1/chat/completions"
-        self.headers = {
+        # Use chatapi.littlewheat.com as the default endpoint
+        self.base_url = "https://chatapi.littlewheat.com/v1"
+    
+    @property
+    def headers(self):
+        """
+        Request headers for the current API key
+        """
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
     
+    def _build_payload(self, prompt, stream, **kwargs):
+        """
+        Build the chat completion payload shared by all call paths
+        
+        Args:
+            prompt (str): The prompt to send to the API
+            stream (bool): Whether to request a streaming response
+            **kwargs: Additional parameters including system_prompt and model
+            
+        Returns:
+            dict: Request payload
+        """
+        payload = {
+            "model": kwargs.get("model", "grok-3"),
+            "messages": self.get_prompt_template(kwargs).build_messages(prompt),
+            "stream": stream
+        }
+        if stream:
+            # The final chunk then reports usage
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+    
     def log_request(self, prompt, model, system_prompt):
         """
         Log the details of the API request
@@ -72,36 +101,19 @@ class GrokProvider(LLMProvider):
             if not self.api_key:
                 return "Grok API key not found. Please set it in the .env file."
             
-            # Create messages array with proper format
-            messages = []
-            
-            # Add system prompt if provided
-            system_prompt = kwargs.get("system_prompt")
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            
-            # Add user message
-            messages.append({"role": "user", "content": prompt})
-            
-            # Get model name from kwargs or use default
-            model = kwargs.get("model", "grok-3")
-            
             # Prepare data for API call
-            data = {
-                "model": model,
-                "messages": messages,
-                "stream": False
-            }
+            data = self._build_payload(prompt, stream=False, **kwargs)
             
             # Log the request details
-            self.log_request(prompt, model, system_prompt)
+            self.log_request(prompt, data["model"], kwargs.get("system_prompt"))
             
             # Make the API call
-            conn = http.client.HTTPSConnection(self.base_domain)
-            conn.request("POST", self.endpoint, json.dumps(data), self.headers)
-            response = conn.getresponse()
-            response_data = json.loads(response.read().decode())
-            conn.close()
+            pool, path = self.get_sync_endpoint("/chat/completions")
+            with pool.connection() as conn:
+                conn.request("POST", path, self.get_prompt_template(kwargs).encode(data), self.headers)
+                response = conn.getresponse()
+                response_data = json.loads(response.read().decode())
+                conn.reusable = not response.will_close
             
             if response.status == 200:
                 result = response_data["choices"][0]["message"]["content"]
@@ -133,132 +145,91 @@ class GrokProvider(LLMProvider):
                 model (str): The model to use (default: grok-3)
             
         Returns:
-            Generator: A generator that yields partial responses
+            Generator: Stream events (TextDelta, Usage, Finish, Error)
         """
         start_time = time.time()
         try:
             if not self.api_key:
-                yield "Grok API key not found. Please set it in the .env file."
+                yield Error("Grok API key not found. Please set it in the .env file.")
                 return
             
-            # Create messages array with proper format
-            messages = []
-            
-            # Add system prompt if provided
-            system_prompt = kwargs.get("system_prompt")
-            if system_prompt:
-                messages.append({"role": "system", "content": system_prompt})
-            
-            # Add user message
-            messages.append({"role": "user", "content": prompt})
-            
-            # Get model name from kwargs or use default
-            model = kwargs.get("model", "grok-3")
-            
             # Prepare data for API call
-            data = {
-                "model": model,
-                "messages": messages,
-                "stream": True
-            }
+            data = self._build_payload(prompt, stream=True, **kwargs)
             
             # Log the request details
-            self.log_request(prompt, model, system_prompt)
+            self.log_request(prompt, data["model"], kwargs.get("system_prompt"))
             
             # Make the API call
-            conn = http.client.HTTPSConnection(self.base_domain)
-            conn.request("POST", self.endpoint, json.dumps(data), self.headers)
-            response = conn.getresponse()
-            
-            if response.status == 200:
-                full_response = ""
-                # Buffer for handling incomplete JSON chunks
-                buffer = ""
-                
-                while True:
-                    chunk = response.read(1024)
-                    if not chunk:
-                        break
-                    
-                    # Process the chunk
-                    chunk_str = chunk.decode('utf-8')
-                    buffer += chunk_str
-                    
-                    # Split buffer by newlines and process complete lines
-                    lines = buffer.split('\n')
-                    # Keep the last (potentially incomplete) line in the buffer
-                    buffer = lines.pop() if lines else ""
-                    
-                    for line in lines:
-                        if line.startswith('data: '):
-                            if line.strip() == 'data: [DONE]':
-                                continue
-                            
-                            json_str = line[6:].strip()
-                            if not json_str:
-                                continue
-                            
-                            try:
-                                chunk_data = json.loads(json_str)
-                                if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                                    delta = chunk_data['choices'][0].get('delta', {})
-                                    if 'content' in delta and delta['content']:
-                                        # Only yield the new content chunk, not the full response
-                                        yield delta['content']
-                                        full_response += delta['content']
-                            except json.JSONDecodeError as e:
-                                logger.warning(f"Failed to parse JSON from chunk: {json_str} - Error: {e}")
-                                # Try to salvage partial content from the malformed JSON
-                                try:
-                                    # Try to extract content between quotes after "content":"
-                                    import re
-                                    content_match = re.search(r'"content":\s*"([^"]*)"', json_str)
-                                    if content_match:
-                                        content = content_match.group(1)
-                                        logger.info(f"Recovered partial content: {content}")
-                                        yield content
-                                        full_response += content
-                                except Exception as recovery_error:
-                                    logger.warning(f"Failed to recover content from malformed JSON: {recovery_error}")
+            pool, path = self.get_sync_endpoint("/chat/completions")
+            with pool.connection() as conn:
+                conn.request("POST", path, self.get_prompt_template(kwargs).encode(data), self.headers)
+                response = conn.getresponse()
+            
+                if response.status == 200:
+                    full_response = StreamAccumulator()
+                    parser = ChatStreamParser("Grok")
                 
-                # Process any remaining data in buffer
-                if buffer and buffer.startswith('data: ') and buffer.strip() != 'data: [DONE]':
-                    json_str = buffer[6:].strip()
-                    if json_str:
-                        try:
-                            chunk_data = json.loads(json_str)
-                            if 'choices' in chunk_data and len(chunk_data['choices']) > 0:
-                                delta = chunk_data['choices'][0].get('delta', {})
-                                if 'content' in delta and delta['content']:
-                                    yield delta['content']
-                                    full_response += delta['content']
-                        except json.JSONDecodeError:
-                            logger.warning(f"Failed to parse JSON from final buffer: {json_str}")
-                            # Try to salvage partial content from the malformed JSON in final buffer
-                            try:
-                                import re
-                                content_match = re.search(r'"content":\s*"([^"]*)"', json_str)
-                                if content_match:
-                                    content = content_match.group(1)
-                                    logger.info(f"Recovered partial content from final buffer: {content}")
-                                    yield content
-                                    full_response += content
-                            except Exception as recovery_error:
-                                logger.warning(f"Failed to recover content from final malformed JSON: {recovery_error}")
+                    while not parser.done:
+                        # read1 returns as soon as data arrives instead of waiting for a full block
+                        chunk = response.read1(4096)
+                        if not chunk:
+                            break
+                        for event in parser.feed(chunk):
+                            # Only yield the new content, not the full response
+                            yield full_response.add(event)
                 
-                # Log the complete response at the end
-                elapsed_time = time.time() - start_time
-                self.log_response(full_response, elapsed_time)
+                    if parser.done:
+                        # Drain the end of the body so the connection can be reused
+                        response.read()
+                    else:
+                        for event in parser.flush():
+                            yield full_response.add(event)
                 
-            else:
-                error_message = f"Error from Grok API: {response.status}"
-                logger.error(error_message)
-                yield error_message
+                    # Log the complete response at the end
+                    elapsed_time = time.time() - start_time
+                    self.log_response(full_response.text, elapsed_time)
                 
-            conn.close()
+                else:
+                    error_message = f"Error from Grok API: {response.status}"
+                    logger.error(error_message)
+                    yield Error(error_message, status=response.status)
+
+                conn.reusable = response.isclosed() and not response.will_close
                 
         except Exception as e:
             elapsed_time = time.time() - start_time
             error_message = f"Exception streaming from Grok API: {str(e)}"
             logger.error(error_message)
-            yield error_message
\ No newline at end of file
+            yield Error(error_message)
+    
+    async def call_stream_async(self, prompt, **kwargs):
+        """
+        Call Grok API with native asyncio streaming support
+        
+        Args:
+            prompt (str): The prompt to send to the API
+            **kwargs: Additional parameters including:
+                system_prompt (str): Optional system prompt to set context
+                model (str): The model to use (default: grok-3)
+            
+        Yields:
+            StreamEvent: TextDelta, Usage, Finish or Error events
+        """
+        if not self.api_key:
+            yield Error("Grok API key not found. Please set it in the .env file.")
+            return
+        
+        start_time = time.time()
+        data = self._build_payload(prompt, stream=True, **kwargs)
+        self.log_request(prompt, data["model"], kwargs.get("system_prompt"))
+        
+        # Only the user turn is serialized, the system prompt prefix is pre-encoded
+        payload = self.get_prompt_template(kwargs).encode(data)
+        full_response = StreamAccumulator()
+        async with aclosing(self._stream_chat_completions(
+            "Grok", f"{self.base_url}/chat/completions", payload, self.headers
+        )) as events:
+            async for event in events:
+                yield full_response.add(event)
+        
+        self.log_response(full_response.text, time.time() - start_time)
@@ -2,8 +2,11 @@ import os
 import json
 import requests
 import logging
+import time
+from contextlib import aclosing
 from openai import OpenAI
 from ..base_provider import LLMProvider
+from ..stream_events import Error, StreamAccumulator, events_from_sdk_chunk
 
 logger = logging.getLogger("llm_client")
 
@@ -20,7 +23,43 @@ class OpenAIProvider(LLMProvider):
         """
         super().__init__(api_key)
         self.api_key = api_key or os.getenv('GITHUB_API_KEY')  # Use GitHub API key
-        self.endpoint = "https://models.inference.ai.azure.com"  # GitHub API endpoint
+        self.base_url = "https://models.inference.ai.azure.com"  # GitHub API endpoint
+        # Created lazily once per endpoint and API key and reused, so their HTTP connection pools survive across calls
+        self._clients = {}
+    
+    @property
+    def client(self):
+        """
+        Shared OpenAI client for the current GitHub endpoint and API key
+        """
+        base_url, api_key = self.base_url, self.api_key
+        client = self._clients.get((base_url, api_key))
+        if client is None:
+            client = self._clients[(base_url, api_key)] = OpenAI(
+                base_url=base_url,
+                api_key=api_key,
+            )
+        return client
+    
+    def _build_payload(self, prompt, **kwargs):
+        """
+        Build the chat completion payload shared by all call paths
+        
+        Args:
+            prompt (str): The prompt to send to the API
+            **kwargs: Additional parameters including system_prompt, model,
+                temperature and max_tokens
+            
+        Returns:
+            dict: Request payload without the stream flag
+        """
+        return {
+            "messages": self.get_prompt_template(kwargs, "You are a helpful assistant.").build_messages(prompt),
+            "temperature": kwargs.get("temperature", 0.7),
+            "top_p": 1.0,
+            "max_tokens": kwargs.get("max_tokens", 2000),
+            "model": kwargs.get("model", "gpt-4o-mini")
+        }
     
     def call(self, prompt, **kwargs):
         """
@@ -39,42 +78,19 @@ class OpenAIProvider(LLMProvider):
             if not self.api_key:
                 return "GitHub API key not found. Please set it in the .env file."
                 
-            # Get parameters from kwargs
-            system_prompt = kwargs.get("system_prompt", "You are a helpful assistant.")
-            model = kwargs.get("model", "gpt-4o-mini")
-            temperature = kwargs.get("temperature", 0.7)
-            max_tokens = kwargs.get("max_tokens", 2000)
+            payload = self._build_payload(prompt, **kwargs)
             
             # Log the request
-            self.log_request("OpenAI", prompt, model=model, system_prompt=system_prompt)
+            self.log_request("OpenAI", prompt, model=payload["model"], system_prompt=kwargs.get("system_prompt", "You are a helpful assistant."))
             
-            # Create OpenAI client with GitHub API endpoint
-            client = OpenAI(
-                base_url=self.endpoint,
-                api_key=self.api_key,
-            )
+            # Reuse the shared OpenAI client with GitHub API endpoint
+            client = self.client
 
             # Record start time for timing
-            import time
             start_time = time.time()
 
             # Make the API call
-            response = client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt,
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt,
-                    }
-                ],
-                temperature=temperature,
-                top_p=1.0,
-                max_tokens=max_tokens,
-                model=model
-            )
+            response = client.chat.completions.create(**payload)
             
             response_content = response.choices[0].message.content
             
@@ -99,72 +115,80 @@ class OpenAIProvider(LLMProvider):
                 model (str): The model to use (default: gpt-4o-mini)
             
         Yields:
-            str: Response chunks
+            StreamEvent: TextDelta, Usage, Finish or Error events
         """
         try:
             if not self.api_key:
-                yield "GitHub API key not found. Please set it in the .env file."
+                yield Error("GitHub API key not found. Please set it in the .env file.")
                 return
                 
-            # Get parameters from kwargs
-            system_prompt = kwargs.get("system_prompt", "You are a helpful assistant.")
-            model = kwargs.get("model", "gpt-4o-mini")
-            temperature = kwargs.get("temperature", 0.7)
-            max_tokens = kwargs.get("max_tokens", 2000)
+            payload = self._build_payload(prompt, **kwargs)
             
             # Log the request
-            self.log_request("OpenAI (Stream)", prompt, model=model, system_prompt=system_prompt)
+            self.log_request("OpenAI (Stream)", prompt, model=payload["model"], system_prompt=kwargs.get("system_prompt", "You are a helpful assistant."))
             
             # Record start time for timing
-            import time
             start_time = time.time()
             
-            # Create OpenAI client with GitHub API endpoint
-            client = OpenAI(
-                base_url=self.endpoint,
-                api_key=self.api_key,
-            )
+            # Reuse the shared OpenAI client with GitHub API endpoint
+            client = self.client
 
             # Make the streaming API call
-            stream = client.chat.completions.create(
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt,
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt,
-                    }
-                ],
-                temperature=temperature,
-                top_p=1.0,
-                max_tokens=max_tokens,
-                model=model,
-                stream=True
-            )
+            # The final chunk then reports usage
+            stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **payload)
             
-            collected_content = ""
+            collected_content = StreamAccumulator()
             
             # Process the streaming response
             for chunk in stream:
-                if hasattr(chunk, 'choices') and len(chunk.choices) > 0 and hasattr(chunk.choices[0], 'delta'):
-                    delta = chunk.choices[0].delta
-                    if hasattr(delta, "content") and delta.content:
-                        content = delta.content
-                        collected_content += content
-                        yield content
-            
-            # If no content was collected, yield a placeholder message
-            if not collected_content:
-                yield "No response content received from the model."
+                for event in events_from_sdk_chunk(chunk):
+                    yield collected_content.add(event)
             
             # Log the final complete response
             elapsed_time = time.time() - start_time
-            self.log_response("OpenAI (Stream)", collected_content, elapsed_time)
+            self.log_response("OpenAI (Stream)", collected_content.text, elapsed_time)
                     
         except Exception as e:
             logger.error(f"Error in streaming OpenAI API via GitHub: {e}")
-            yield f"Error in OpenAI streaming: {str(e)}"
-            # Add a fallback response so the user gets something useful
-            yield "\n\nFallback message: I'm having trouble connecting to the OpenAI service. Please check your API key and network connection, then try again."
\ No newline at end of file
+            # Include a fallback hint so the user gets something useful
+            yield Error(
+                f"Error in OpenAI streaming: {str(e)}\n\nFallback message: I'm having trouble connecting to the OpenAI service. "
+                "Please check your API key and network connection, then try again."
+            )
+    
+    async def call_stream_async(self, prompt, **kwargs):
+        """
+        Call OpenAI API via GitHub API with native asyncio streaming support
+        
+        Args:
+            prompt (str): The prompt to send to the API
+            **kwargs: Additional parameters including:
+                system_prompt (str): Optional system prompt to set context
+                model (str): The model to use (default: gpt-4o-mini)
+            
+        Yields:
+            StreamEvent: TextDelta, Usage, Finish or Error events
+        """
+        if not self.api_key:
+            yield Error("GitHub API key not found. Please set it in the .env file.")
+            return
+        
+        start_time = time.time()
+        payload = self._build_payload(prompt, **kwargs)
+        self.log_request("OpenAI (Stream)", prompt, model=payload["model"], system_prompt=kwargs.get("system_prompt", "You are a helpful assistant."))
+        
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        
+        # Only the user turn is serialized, the system prompt prefix is pre-encoded
+        body = self.get_prompt_template(kwargs, "You are a helpful assistant.").encode(dict(payload, stream=True, stream_options={"include_usage": True}))
+        collected_content = StreamAccumulator()
+        async with aclosing(self._stream_chat_completions(
+            "OpenAI", f"{self.base_url}/chat/completions", body, headers
+        )) as events:
+            async for event in events:
+                yield collected_content.add(event)
+        
+        self.log_response("OpenAI (Stream)", collected_content.text, time.time() - start_time)
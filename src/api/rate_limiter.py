@@ -0,0 +1,300 @@
+import asyncio
+import logging
+import math
+import re
+import time
+
+from .token_budget import token_estimator
+
+logger = logging.getLogger("rate_limiter")
+
+# Durations in rate limit headers look like "1s", "6m0s", "250ms" or plain seconds
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+_DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+# Completion limit the providers send when the caller sets none
+DEFAULT_COMPLETION_TOKENS = 1000
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimate the token count of a text
+
+    Args:
+        text (str): The text
+
+    Returns:
+        int: Estimated tokens, see TokenEstimator
+    """
+    return token_estimator.estimate(text) if text else 0
+
+
+def estimate_request_tokens(prompt, system_prompt=None, max_tokens=None):
+    """
+    Estimate the tokens a chat request may consume
+
+    Args:
+        prompt (str): User prompt
+        system_prompt (str, optional): System prompt
+        max_tokens (int, optional): Completion limit, the providers' default of 1000 if None
+
+    Returns:
+        int: Estimated prompt tokens plus the completion limit
+    """
+    return estimate_tokens(prompt) + estimate_tokens(system_prompt) + (max_tokens or DEFAULT_COMPLETION_TOKENS)
+
+
+def parse_reset(value):
+    """
+    Parse an x-ratelimit-reset-* header value
+
+    Args:
+        value (str): Duration such as "1s", "6m0s", "250ms" or "12.5"
+
+    Returns:
+        float: Seconds until the limit resets, or None if the value is invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+class AdaptiveLimiter:
+    """
+    Adaptive concurrency and tokens-per-minute limiter for one provider
+
+    The concurrency limit follows AIMD: it grows by about one per limit's worth
+    of fast successful calls and halves on a 429 or when time to first token
+    rises well above the best seen recently. Each request also reserves its
+    estimated prompt plus completion tokens from a per-minute bucket, corrected
+    by the reported usage afterwards. Rate limit headers lower the budget and
+    pause the provider until the server's reset time. With several API keys
+    the headers only describe the key that answered, so the budget adopted
+    from them is scaled by the number of keys and exhausted keys are left to
+    the key pool. Callers that cannot start immediately queue for up to
+    `max_wait` seconds.
+    """
+    def __init__(self, name, max_concurrency=8, min_concurrency=1, tokens_per_minute=None,
+                 max_wait=10, latency_tolerance=2.0, decrease_cooldown=2.0):
+        """
+        Initialize the limiter
+
+        Args:
+            name (str): Provider name, used in logs
+            max_concurrency (int): Upper bound of the concurrency limit
+            min_concurrency (int): Lower bound of the concurrency limit
+            tokens_per_minute (int, optional): Token budget per minute, unlimited if None
+            max_wait (float): Seconds a request may queue before it is rejected
+            latency_tolerance (float): First token latency above this multiple of
+                the baseline counts as overload
+            decrease_cooldown (float): Minimum seconds between two decreases
+        """
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.limit = float(max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.tokens = float(tokens_per_minute or 0)
+        self.max_wait = max_wait
+        self.latency_tolerance = latency_tolerance
+        self.decrease_cooldown = decrease_cooldown
+        self.in_flight = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        self.baseline = None
+        self.stats = {'requests': 0, 'queued': 0, 'rejected': 0, 'decreases': 0, 'rate_limited': 0}
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._changed = asyncio.Event()
+
+    def _refill(self, now):
+        if self.tokens_per_minute:
+            elapsed = now - self._last_refill
+            self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60.0)
+        self._last_refill = now
+
+    def _wait_time(self, now, cost):
+        """
+        Seconds until a request of the given cost may start, 0 if it may start now
+        """
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.in_flight >= max(self.min_concurrency, int(self.limit)):
+            # Woken by release()
+            return math.inf
+        if self.tokens_per_minute and self.tokens < cost:
+            return (cost - self.tokens) * 60.0 / self.tokens_per_minute
+        return 0
+
+    async def acquire(self, cost=0, max_wait=None):
+        """
+        Wait for a concurrency slot and reserve tokens
+
+        Args:
+            cost (int): Estimated tokens of the request
+            max_wait (float, optional): Seconds this request may queue, the limiter's max_wait if None
+
+        Returns:
+            int: The tokens actually reserved, pass them to release()
+
+        Raises:
+            asyncio.TimeoutError: If the request could not start in time
+        """
+        loop = asyncio.get_running_loop()
+        if max_wait is None:
+            max_wait = self.max_wait
+        deadline = loop.time() + max_wait
+        if self.tokens_per_minute:
+            # A request larger than the whole budget could never start
+            cost = min(cost, self.tokens_per_minute)
+        else:
+            cost = 0
+
+        queued = False
+        try:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_time(now, cost)
+                if wait <= 0:
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    self.stats['rejected'] += 1
+                    logger.warning(f"{self.name} is saturated, rejected a request after {max_wait:.1f}s in queue")
+                    raise asyncio.TimeoutError()
+                if not queued:
+                    queued = True
+                    self.waiting += 1
+                    self.stats['queued'] += 1
+                try:
+                    await asyncio.wait_for(self._changed.wait(), min(wait, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if queued:
+                self.waiting -= 1
+
+        self.in_flight += 1
+        self.tokens -= cost
+        self.stats['requests'] += 1
+        return cost
+
+    def release(self, reserved=0, used_tokens=None, latency=None, failed=False):
+        """
+        Return a concurrency slot and settle the token reservation
+
+        Args:
+            reserved (int): Tokens returned by acquire()
+            used_tokens (int, optional): Tokens the provider reported, the
+                difference to the reservation is refunded or charged
+            latency (float, optional): Seconds to first token of a successful call
+            failed (bool): The call failed, the limit is not increased
+        """
+        self.in_flight -= 1
+        if self.tokens_per_minute and used_tokens is not None:
+            self.tokens = min(self.tokens_per_minute, self.tokens + reserved - used_tokens)
+        if not failed and latency is not None:
+            self._observe_latency(latency)
+        # Waiters woken by set() return even though the flag is cleared right away
+        self._changed.set()
+        self._changed.clear()
+
+    def _observe_latency(self, latency):
+        if self.baseline is None:
+            self.baseline = latency
+        else:
+            # The baseline follows improvements at once and degradations slowly
+            self.baseline = min(latency, self.baseline * 0.95 + latency * 0.05)
+        if latency > self.baseline * self.latency_tolerance:
+            self._decrease(f"first token after {latency:.1f}s, baseline {self.baseline:.1f}s")
+        else:
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+
+    def _decrease(self, reason):
+        now = time.monotonic()
+        if now - self._last_decrease < self.decrease_cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit / 2)
+        self.stats['decreases'] += 1
+        logger.warning(f"Lowering {self.name} concurrency limit to {self.limit:.1f}: {reason}")
+
+    def observe_response(self, status, headers, keys=1):
+        """
+        Adapt to the status and rate limit headers of a provider response
+
+        Args:
+            status (int): HTTP status
+            headers (dict): Response headers with lower-cased names
+            keys (int): API keys the provider rotates over
+        """
+        now = time.monotonic()
+        if status == 429:
+            self.stats['rate_limited'] += 1
+            if keys <= 1:
+                self._decrease("rate limited by the provider")
+
+        if keys > 1:
+            if self.tokens_per_minute is None:
+                # Every key has a budget of its own
+                limit_tokens = headers.get('x-ratelimit-limit-tokens')
+                if limit_tokens and limit_tokens.isdigit():
+                    self.tokens_per_minute = int(limit_tokens) * keys
+                    self.tokens = self.tokens_per_minute
+                    self._last_refill = now
+            # Remaining and reset headers only describe the key that answered
+            return
+
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        if remaining_requests is not None and remaining_requests.strip() == '0':
+            reset = parse_reset(headers.get('x-ratelimit-reset-requests'))
+            if reset:
+                self.paused_until = max(self.paused_until, now + reset)
+
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        if remaining_tokens is not None:
+            try:
+                remaining_tokens = float(remaining_tokens)
+            except ValueError:
+                return
+            if self.tokens_per_minute is None:
+                # Adopt the server's budget once its limit is known
+                limit_tokens = headers.get('x-ratelimit-limit-tokens')
+                if limit_tokens and limit_tokens.isdigit():
+                    self.tokens_per_minute = int(limit_tokens)
+                    self.tokens = self.tokens_per_minute
+                    self._last_refill = now
+            if self.tokens_per_minute:
+                self._refill(now)
+                self.tokens = min(self.tokens, remaining_tokens)
+            if remaining_tokens <= 0:
+                reset = parse_reset(headers.get('x-ratelimit-reset-tokens'))
+                if reset:
+                    self.paused_until = max(self.paused_until, now + reset)
+
+    def get_stats(self):
+        """
+        Get limiter state
+
+        Returns:
+            dict: Current limit, requests in flight and queued, token budget and counters
+        """
+        stats = dict(self.stats)
+        stats.update({
+            'limit': round(self.limit, 2),
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'tokens_per_minute': self.tokens_per_minute,
+            'tokens': int(self.tokens) if self.tokens_per_minute else None,
+            'paused_for': max(0.0, round(self.paused_until - time.monotonic(), 1)),
+        })
+        return stats
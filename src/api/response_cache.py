@@ -0,0 +1,315 @@
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .stream_events import TextDelta, Finish
+
+logger = logging.getLogger("response_cache")
+
+
+def make_cache_key(provider, prompt, model=None, system_prompt=None, temperature=None, mode=None, history=(), max_tokens=None):
+    """
+    Build the cache key for an LLM request
+
+    Whitespace in the prompts is collapsed so trivially different spellings of
+    the same question share an entry.
+
+    Args:
+        provider (str): Provider name
+        prompt (str): User prompt
+        model (str, optional): Model name
+        system_prompt (str, optional): System prompt
+        temperature (float, optional): Sampling temperature
+        mode (str, optional): Provider mode, e.g. DeepSeek "reasoner"
+        history (tuple): Earlier conversation messages sent with the prompt
+        max_tokens (int, optional): Completion limit, answers cut at a smaller
+            limit must not be served for a larger one
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    normalized = [
+        provider,
+        model or '',
+        mode or '',
+        " ".join((system_prompt or '').split()),
+        " ".join((prompt or '').split()),
+        None if temperature is None else round(float(temperature), 3),
+        max_tokens,
+    ]
+    if history:
+        normalized.append([[message['role'], message['content']] for message in history])
+    return hashlib.sha256(json.dumps(normalized, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class CacheStats:
+    """
+    Counters describing how well the response cache is used
+    """
+    def __init__(self):
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def to_dict(self, entries=0, size=0):
+        """
+        Get the counters as a dictionary
+
+        Args:
+            entries (int): Number of entries in the memory tier
+            size (int): Bytes held by the memory tier
+
+        Returns:
+            dict: Cache statistics including the hit ratio
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'entries': entries,
+            'bytes': size,
+            'hit_ratio': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+
+class DiskCache:
+    """
+    SQLite-backed second tier that survives restarts
+    """
+    def __init__(self, path, ttl):
+        """
+        Open (or create) the cache database
+
+        Args:
+            path (str): Database file path
+            ttl (float): Seconds an entry stays valid
+        """
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+
+    def get(self, key):
+        """
+        Look up a response
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            str: The cached response, or None if missing or expired
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT response FROM responses WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, response):
+        """
+        Store a response
+
+        Args:
+            key (str): Cache key
+            response (str): Response text
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, expires_at) VALUES (?, ?, ?)",
+                (key, response, time.time() + self.ttl)
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._db.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+
+    def close(self):
+        """
+        Close the database
+        """
+        with self._lock:
+            self._db.close()
+
+
+class ResponseCache:
+    """
+    LRU cache of complete LLM responses with a TTL and a total size cap
+
+    The memory tier is bounded by the UTF-8 size of the cached responses. An
+    optional DiskCache tier is consulted on memory misses and its hits are
+    promoted back into memory.
+    """
+    def __init__(self, ttl=3600, max_bytes=16 * 1024 * 1024, disk_path=None):
+        """
+        Initialize the cache
+
+        Args:
+            ttl (float): Seconds an entry stays valid
+            max_bytes (int): Maximum total size of the responses kept in memory
+            disk_path (str, optional): SQLite file for the disk tier, disabled if empty
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+        self._entries = OrderedDict()  # key -> (response, expires_at, size), least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self.disk = None
+        if disk_path:
+            try:
+                self.disk = DiskCache(disk_path, ttl)
+            except sqlite3.Error as e:
+                logger.error(f"Could not open disk cache at {disk_path}, using memory only: {e}")
+
+    def get(self, key):
+        """
+        Look up a response
+
+        Args:
+            key (str): Cache key from make_cache_key
+
+        Returns:
+            str: The cached response, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                response, expires_at, size = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return response
+                del self._entries[key]
+                self._size -= size
+                self.stats.expirations += 1
+
+        if self.disk is not None:
+            try:
+                response = self.disk.get(key)
+            except sqlite3.Error as e:
+                logger.warning(f"Disk cache lookup failed: {e}")
+                response = None
+            if response is not None:
+                with self._lock:
+                    self.stats.disk_hits += 1
+                    self._store(key, response)
+                return response
+
+        with self._lock:
+            self.stats.misses += 1
+        return None
+
+    def set(self, key, response):
+        """
+        Store a complete response in every tier
+
+        Args:
+            key (str): Cache key from make_cache_key
+            response (str): Response text
+        """
+        with self._lock:
+            self.stats.stores += 1
+            self._store(key, response)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, response)
+            except sqlite3.Error as e:
+                logger.warning(f"Disk cache write failed: {e}")
+
+    def _store(self, key, response):
+        """
+        Insert into the memory tier and evict down to max_bytes, lock must be held
+        """
+        size = len(response.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= old[2]
+        self._entries[key] = (response, time.monotonic() + self.ttl, size)
+        self._size += size
+        while self._size > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+            self.stats.evictions += 1
+
+    def clear(self):
+        """
+        Drop every entry from the memory tier
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self):
+        """
+        Get the cache statistics
+
+        Returns:
+            dict: Cache statistics
+        """
+        with self._lock:
+            return self.stats.to_dict(entries=len(self._entries), size=self._size)
+
+
+def _replay_parts(response, chunk_chars):
+    """
+    Split a cached response into the pieces replayed as text deltas
+    """
+    chunk_chars = max(1, chunk_chars)
+    return [response[i:i + chunk_chars] for i in range(0, len(response), chunk_chars)]
+
+
+def replay_stream(response, chunk_chars=80, interval=0.05):
+    """
+    Replay a cached response as a stream of events
+
+    Args:
+        response (str): Cached response text
+        chunk_chars (int): Characters per text delta
+        interval (float): Seconds to wait between deltas
+
+    Yields:
+        StreamEvent: TextDelta events followed by a Finish event
+    """
+    for i, part in enumerate(_replay_parts(response, chunk_chars)):
+        if i and interval > 0:
+            time.sleep(interval)
+        yield TextDelta(part)
+    yield Finish("stop")
+
+
+async def replay_stream_async(response, chunk_chars=80, interval=0.05):
+    """
+    Replay a cached response as an async stream of events
+
+    Args:
+        response (str): Cached response text
+        chunk_chars (int): Characters per text delta
+        interval (float): Seconds to wait between deltas
+
+    Yields:
+        StreamEvent: TextDelta events followed by a Finish event
+    """
+    for i, part in enumerate(_replay_parts(response, chunk_chars)):
+        if i and interval > 0:
+            await asyncio.sleep(interval)
+        yield TextDelta(part)
+    yield Finish("stop")
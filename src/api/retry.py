@@ -0,0 +1,217 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import aclosing
+from email.utils import parsedate_to_datetime
+
+from core.request_context import get_request_context
+from .stream_events import Error, TextDelta, ReasoningDelta
+
+logger = logging.getLogger("retry")
+
+# Statuses worth retrying: timeouts, rate limits and transient server errors
+RETRYABLE_STATUSES = frozenset({408, 425, 429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header value
+
+    Args:
+        value (str): Delay in seconds or an HTTP date
+
+    Returns:
+        float: Seconds to wait, or None if the value is missing or invalid
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """
+    Classify a stream error
+
+    Args:
+        error (Error): The error event
+
+    Returns:
+        bool: True for rate limits, transient server errors and transport failures
+    """
+    if error.status is not None:
+        return error.status in RETRYABLE_STATUSES
+    return error.transient
+
+
+class RetryBudget:
+    """
+    Process-wide token bucket limiting retries to a fraction of requests
+
+    Every request deposits `ratio` tokens and every retry spends one. During an
+    outage the bucket drains, so failures are returned at once instead of
+    multiplying upstream traffic. The bucket starts full.
+    """
+    def __init__(self, ratio=0.2, max_tokens=10):
+        """
+        Initialize the budget
+
+        Args:
+            ratio (float): Allowed retries per request, e.g. 0.2 for 20% extra traffic
+            max_tokens (float): Maximum tokens the bucket can hold
+        """
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = float(max_tokens)
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        """
+        Deposit the share earned by one request
+        """
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_spend(self):
+        """
+        Spend one token for a retry
+
+        Returns:
+            bool: True if the retry is within budget
+        """
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+class RetryPolicy:
+    """
+    Async retry policy for provider streams
+
+    A failed attempt is retried only if it failed before producing any content,
+    the error is retryable and the shared budget allows it. Delays use full
+    jitter, and a Retry-After hint from the server is honoured as a minimum.
+    No retry is started when the current request's deadline cannot fit the
+    delay plus `min_attempt_seconds`.
+    """
+    def __init__(self, max_retries=2, base_delay=0.5, max_delay=8, max_retry_after=30, budget=None,
+                 min_attempt_seconds=5):
+        """
+        Initialize the policy
+
+        Args:
+            max_retries (int): Retries after the first attempt
+            base_delay (float): Backoff cap of the first retry in seconds
+            max_delay (float): Upper bound of the exponential backoff cap
+            max_retry_after (float): Retry-After hints longer than this are not waited for
+            budget (RetryBudget, optional): Shared budget, retries are unlimited without one
+            min_attempt_seconds (float): Least time an attempt needs before the deadline
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+        self.min_attempt_seconds = min_attempt_seconds
+        self.stats = {'retries': 0, 'budget_denied': 0, 'retry_after_too_long': 0, 'deadline_denied': 0}
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Get the delay before a retry
+
+        Args:
+            attempt (int): Number of the retry, starting at 0
+            retry_after (float, optional): Server hint in seconds
+
+        Returns:
+            float: Seconds to wait
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def stream(self, name, start, can_retry=None):
+        """
+        Stream events, retrying attempts that fail before producing content
+
+        Args:
+            name (str): Provider name, used in logs
+            start (callable): Returns a new async iterator of stream events per attempt
+            can_retry (callable, optional): Returns False to stop retrying, e.g.
+                when the provider's circuit opened
+
+        Yields:
+            StreamEvent: Events of the final attempt, including its error if it failed
+        """
+        if self.budget is not None:
+            self.budget.record_request()
+
+        attempt = 0
+        while True:
+            started = False
+            error = None
+            async with aclosing(start()) as events:
+                async for event in events:
+                    if isinstance(event, Error) and not started:
+                        error = event
+                        break
+                    if isinstance(event, (TextDelta, ReasoningDelta)):
+                        started = True
+                    yield event
+
+            if error is None:
+                return
+            delay = self.backoff(attempt, error.retry_after)
+            if not self._should_retry(name, attempt, error, can_retry, delay):
+                yield error
+                return
+
+            self.stats['retries'] += 1
+            logger.warning(f"{name} failed ({error}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    def _should_retry(self, name, attempt, error, can_retry, delay):
+        if attempt >= self.max_retries or not is_retryable(error):
+            return False
+        if error.retry_after is not None and error.retry_after > self.max_retry_after:
+            self.stats['retry_after_too_long'] += 1
+            logger.warning(f"{name} asked to retry after {error.retry_after:.0f}s, not waiting")
+            return False
+        context = get_request_context()
+        if context is not None and not context.can_afford(delay + self.min_attempt_seconds):
+            self.stats['deadline_denied'] += 1
+            logger.warning(f"Not retrying {name}, {context.remaining():.1f}s left before the request deadline")
+            return False
+        if can_retry is not None and not can_retry():
+            return False
+        if self.budget is not None and not self.budget.try_spend():
+            self.stats['budget_denied'] += 1
+            logger.warning(f"Retry budget exhausted, not retrying {name}")
+            return False
+        return True
+
+    def get_stats(self):
+        """
+        Get retry statistics
+
+        Returns:
+            dict: Retries sent, retries denied by the budget or the deadline and
+                ignored long Retry-After hints
+        """
+        stats = dict(self.stats)
+        if self.budget is not None:
+            stats['budget_tokens'] = self.budget.tokens
+        return stats
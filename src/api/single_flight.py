@@ -0,0 +1,184 @@
+import asyncio
+import logging
+
+from core.request_context import RequestContext, get_request_context, use_request_context
+
+from .stream_events import Error
+
+logger = logging.getLogger("single_flight")
+
+
+class SharedStream:
+    """
+    One upstream event stream fanned out to any number of subscribers
+
+    Every event is kept, so a subscriber that joins late first receives the
+    full prefix and then follows the live events. The upstream is only
+    cancelled when the last subscriber goes away before it finished.
+
+    The upstream runs under a request context of its own rather than the
+    first subscriber's. Its deadline is the latest of all subscribers', and
+    it keeps the user, chat and command labels only while every subscriber
+    shares them, so the usage of a stream coalesced across users is recorded
+    as a shared entry.
+    """
+    def __init__(self, key, source, on_finished):
+        """
+        Start pumping the upstream stream
+
+        Args:
+            key (str): Request key the stream is registered under
+            source: Async iterator of stream events
+            on_finished (callable): Called with this stream once it is over
+        """
+        self.key = key
+        self.events = []
+        self.finished = False
+        self.subscribers = 0
+        self._source = source
+        self._on_finished = on_finished
+        self._changed = asyncio.Event()
+        self.context = _shared_context(get_request_context())
+        # The task copies the context variable, so the upstream sees the shared context
+        with use_request_context(self.context):
+            self._task = asyncio.create_task(self._pump())
+
+    def join(self, context):
+        """
+        Widen the shared request context for a late subscriber
+
+        Args:
+            context (RequestContext): The subscriber's context, None outside a request
+        """
+        shared = self.context
+        if shared is None:
+            return
+        if context is None:
+            # A subscriber without a deadline lifts it for everyone
+            shared.timeout = shared.deadline = float('inf')
+            shared.user_id = shared.chat_id = shared.command = None
+            return
+        if context.deadline > shared.deadline:
+            shared.timeout += context.deadline - shared.deadline
+            shared.deadline = context.deadline
+        if context.user_id != shared.user_id:
+            shared.user_id = None
+        if context.chat_id != shared.chat_id:
+            shared.chat_id = None
+        if context.command != shared.command:
+            shared.command = None
+
+    async def _pump(self):
+        """
+        Read the upstream stream and wake every subscriber on each event
+        """
+        try:
+            async for event in self._source:
+                self.events.append(event)
+                self._notify()
+        except asyncio.CancelledError:
+            logger.info(f"Shared stream {self.key[:12]} cancelled, no subscribers left")
+            raise
+        except Exception as e:
+            logger.error(f"Error in shared stream {self.key[:12]}: {e}")
+            self.events.append(Error(f"Error streaming from provider: {str(e)}"))
+        finally:
+            self.finished = True
+            self._notify()
+            self._on_finished(self)
+
+    def _notify(self):
+        # Waiters woken by set() return even though the flag is cleared right away
+        self._changed.set()
+        self._changed.clear()
+
+    async def subscribe(self):
+        """
+        Iterate over the stream from its first event
+
+        Cancelling or abandoning one subscription does not affect the others.
+
+        Yields:
+            StreamEvent: Every event of the upstream stream
+        """
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.finished:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished:
+                self._task.cancel()
+
+
+def _shared_context(context):
+    """
+    Copy a request context for an upstream stream shared between subscribers
+
+    Args:
+        context (RequestContext): The first subscriber's context, None outside a request
+
+    Returns:
+        RequestContext: A context with the same deadline and labels, None if context is None
+    """
+    if context is None:
+        return None
+    shared = RequestContext(context.timeout, context.user_id, context.chat_id, context.command)
+    shared.deadline = context.deadline
+    return shared
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight streaming requests into one upstream stream
+    """
+    def __init__(self):
+        self._streams = {}
+        self.upstream = 0
+        self.coalesced = 0
+
+    def subscribe(self, key, factory):
+        """
+        Subscribe to the stream for a request, starting it if none is running
+
+        Args:
+            key (str): Request key, identical requests must share it
+            factory (callable): Returns the upstream async event stream, only
+                called when no stream for the key is in flight
+
+        Returns:
+            Async iterator of stream events
+        """
+        stream = self._streams.get(key)
+        if stream is None or stream.finished:
+            stream = SharedStream(key, factory(), self._finished)
+            self._streams[key] = stream
+            self.upstream += 1
+        else:
+            self.coalesced += 1
+            stream.join(get_request_context())
+            logger.info(f"Joining in-flight stream {key[:12]} with {stream.subscribers} subscriber(s)")
+        return stream.subscribe()
+
+    def _finished(self, stream):
+        if self._streams.get(stream.key) is stream:
+            del self._streams[stream.key]
+
+    def get_stats(self):
+        """
+        Get coalescing statistics
+
+        Returns:
+            dict: Upstream and coalesced request counts and streams in flight
+        """
+        return {
+            'upstream': self.upstream,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._streams),
+        }
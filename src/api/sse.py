@@ -0,0 +1,154 @@
+import json
+import logging
+
+from .stream_events import events_from_chunk
+
+logger = logging.getLogger("sse")
+
+
+class SSEDecoder:
+    """
+    Incremental decoder for text/event-stream response bodies
+
+    Bytes are appended to a single bytearray and scanned in place for line
+    breaks. Consumed lines are dropped once per feed, so the buffer is never
+    re-sliced per line. Lines are split on raw bytes and a newline byte cannot
+    occur inside a multi-byte UTF-8 sequence, so characters split across reads
+    are never decoded in halves. Only the "data" field is kept, the "event",
+    "id" and "retry" fields and comments are ignored.
+    """
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scanned = 0  # bytes of the buffer already searched for a newline
+        self._data = []  # data lines of the event being assembled
+
+    def feed(self, data):
+        """
+        Add bytes from the response body
+
+        Args:
+            data (bytes): The next piece of the body, of any size
+
+        Returns:
+            list: Data payloads (bytes) of every event completed by this piece
+        """
+        buffer = self._buffer
+        buffer += data
+        payloads = []
+        start = 0
+        search_from = self._scanned
+
+        while True:
+            end = buffer.find(b'\n', search_from)
+            if end < 0:
+                break
+            self._line(start, end, payloads)
+            start = search_from = end + 1
+
+        if start:
+            del buffer[:start]
+        self._scanned = len(buffer)
+        return payloads
+
+    def flush(self):
+        """
+        Finish decoding at the end of the body
+
+        A final line without a line break and an event without its closing
+        blank line are still delivered, since some servers close the stream
+        without them.
+
+        Returns:
+            list: Data payloads (bytes) of the remaining events
+        """
+        payloads = []
+        if self._buffer:
+            self._line(0, len(self._buffer), payloads)
+            self._buffer.clear()
+            self._scanned = 0
+        self._dispatch(payloads)
+        return payloads
+
+    def _line(self, start, end, payloads):
+        """
+        Handle the line buffer[start:end], excluding the line break
+        """
+        buffer = self._buffer
+        if end > start and buffer[end - 1] == 0x0D:  # \r\n line endings
+            end -= 1
+        if end == start:
+            # A blank line ends the event
+            self._dispatch(payloads)
+        elif buffer.startswith(b'data:', start, end):
+            value_start = start + 5
+            if value_start < end and buffer[value_start] == 0x20:
+                value_start += 1
+            self._data.append(bytes(buffer[value_start:end]))
+
+    def _dispatch(self, payloads):
+        """
+        Emit the data of the event being assembled, if any
+        """
+        if self._data:
+            payloads.append(self._data[0] if len(self._data) == 1 else b'\n'.join(self._data))
+            self._data = []
+
+
+class ChatStreamParser:
+    """
+    Turns an OpenAI-compatible chat completion stream into stream events
+
+    JSON is only decoded once an event is complete, and decoding stops at the
+    "[DONE]" sentinel.
+    """
+    def __init__(self, provider_name="LLM"):
+        """
+        Initialize the parser
+
+        Args:
+            provider_name (str): Name of the provider, used in log messages
+        """
+        self.provider_name = provider_name
+        self.done = False
+        self._decoder = SSEDecoder()
+
+    def feed(self, data):
+        """
+        Add bytes from the response body
+
+        Args:
+            data (bytes): The next piece of the body
+
+        Returns:
+            list: Stream events completed by this piece
+        """
+        return self._parse(self._decoder.feed(data))
+
+    def flush(self):
+        """
+        Finish parsing at the end of the body
+
+        Returns:
+            list: Stream events from data left in the buffer
+        """
+        return self._parse(self._decoder.flush())
+
+    def _parse(self, payloads):
+        """
+        Decode complete data payloads into stream events
+        """
+        events = []
+        for payload in payloads:
+            if self.done:
+                break
+            if payload == b'[DONE]':
+                self.done = True
+                break
+            try:
+                # Decoding first skips json's encoding detection on bytes input
+                chunk = json.loads(payload.decode('utf-8'))
+            except ValueError as e:
+                logger.warning(f"Failed to parse {self.provider_name} stream chunk: {e}")
+                continue
+            events.extend(events_from_chunk(chunk))
+        return events
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+
+from .stream_events import Error
+
+logger = logging.getLogger("stall_detection")
+
+# Shortest overlap between the partial answer and its continuation that is trimmed,
+# shorter matches are too likely to be coincidental
+MIN_OVERLAP = 8
+
+
+async def guard_stalls(events, stall_timeout, on_stall=None):
+    """
+    Pass a stream through, ending it with an error if it stalls mid-answer
+
+    The guard only starts once the first event arrived, the time before that
+    is bounded by the first byte timeout and hedging. After that, a gap of more
+    than `stall_timeout` seconds between two events counts as a stall: the
+    source stream is abandoned, which closes its connection, and a transient
+    Error is yielded in its place.
+
+    Args:
+        events: Async iterator of stream events, closed by the guard
+        stall_timeout (float): Longest gap between events in seconds
+        on_stall (callable, optional): Called without arguments when the stream stalls
+
+    Yields:
+        StreamEvent: The source's events, then an Error if it stalled
+    """
+    started = False
+    try:
+        while True:
+            try:
+                if started:
+                    event = await asyncio.wait_for(anext(events), stall_timeout)
+                else:
+                    event = await anext(events)
+            except StopAsyncIteration:
+                return
+            except asyncio.TimeoutError:
+                logger.warning(f"Stream stalled, no data for {stall_timeout:.1f}s")
+                if on_stall is not None:
+                    on_stall()
+                yield Error(f"The response stalled for {stall_timeout:.1f}s", transient=True)
+                return
+            started = True
+            yield event
+    finally:
+        await events.aclose()
+
+
+def build_continuation_prompt(prompt, partial):
+    """
+    Build the prompt asking another model to finish an interrupted answer
+
+    Assistant prefill is not supported the same way by every OpenAI-compatible
+    endpoint, so the partial answer is handed over in the user prompt instead.
+
+    Args:
+        prompt (str): The original prompt
+        partial (str): The answer text streamed so far
+
+    Returns:
+        str: The continuation prompt
+    """
+    return (
+        f"{prompt}\n\n"
+        "An earlier answer to this request was cut off. Continue it exactly where it stops, "
+        "without repeating any of it and without commenting on the interruption.\n\n"
+        f"Answer so far:\n{partial}"
+    )
+
+
+class ContinuationJoiner:
+    """
+    Joins a continuation onto the partial answer it continues
+
+    Models asked to continue often restate the last words of the partial
+    answer. The first `window` characters of the continuation are held back
+    until the overlap with the end of the partial answer can be trimmed.
+    """
+    def __init__(self, partial, window=100):
+        """
+        Initialize the joiner
+
+        Args:
+            partial (str): The answer text streamed so far
+            window (int): Characters of the continuation held back for the overlap check
+        """
+        self.tail = partial[-window:]
+        self.window = window
+        self.joined = False
+        self._pending = []
+        self._pending_length = 0
+
+    def feed(self, text):
+        """
+        Add continuation text
+
+        Args:
+            text (str): The next piece of the continuation
+
+        Returns:
+            str: Text that can be shown now, possibly empty
+        """
+        if self.joined:
+            return text
+        self._pending.append(text)
+        self._pending_length += len(text)
+        if self._pending_length < self.window:
+            return ""
+        return self.flush()
+
+    def flush(self):
+        """
+        Release the held back text, e.g. at the end of the continuation
+
+        Returns:
+            str: The held back text without the overlap, possibly empty
+        """
+        if self.joined:
+            return ""
+        self.joined = True
+        pending = "".join(self._pending)
+        self._pending = []
+        # Whitespace at the seam is not compared, the partial answer may end mid-line
+        tail = self.tail.rstrip()
+        text = pending.lstrip()
+        for size in range(min(len(tail), len(text)), MIN_OVERLAP - 1, -1):
+            if tail.endswith(text[:size]):
+                logger.info(f"Trimmed {size} repeated characters from a continuation")
+                rest = text[size:]
+                return rest.lstrip() if tail != self.tail else rest
+        return pending
@@ -0,0 +1,272 @@
+class StreamEvent:
+    """
+    Base class for typed events yielded by streaming LLM calls
+    
+    Providers yield one event per upstream delta rather than the full text so
+    far, so consumers do constant work per token.
+    """
+    __slots__ = ()
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+
+class TextDelta(StreamEvent):
+    """
+    New answer text
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class ReasoningDelta(StreamEvent):
+    """
+    New reasoning text from models that stream their chain of thought separately
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Usage(StreamEvent):
+    """
+    Token usage reported by the provider
+    """
+    __slots__ = ('prompt_tokens', 'completion_tokens', 'total_tokens', 'details')
+
+    def __init__(self, prompt_tokens=0, completion_tokens=0, total_tokens=None, details=None):
+        self.prompt_tokens = prompt_tokens or 0
+        self.completion_tokens = completion_tokens or 0
+        self.total_tokens = total_tokens if total_tokens is not None else self.prompt_tokens + self.completion_tokens
+        self.details = details or {}
+
+    @classmethod
+    def from_dict(cls, usage):
+        """
+        Build a usage event from an OpenAI-compatible usage object
+
+        Args:
+            usage (dict): The "usage" field of a response or stream chunk
+
+        Returns:
+            Usage: The usage event
+        """
+        details = {
+            key: value for key, value in usage.items()
+            if key not in ('prompt_tokens', 'completion_tokens', 'total_tokens')
+        }
+        return cls(
+            usage.get('prompt_tokens'),
+            usage.get('completion_tokens'),
+            usage.get('total_tokens'),
+            details
+        )
+
+    @property
+    def cache_hit_tokens(self):
+        """
+        Prompt tokens served from the provider's context cache, None if not reported
+        """
+        if 'prompt_cache_hit_tokens' in self.details:
+            # DeepSeek
+            return self.details['prompt_cache_hit_tokens'] or 0
+        prompt_details = self.details.get('prompt_tokens_details')
+        if isinstance(prompt_details, dict) and 'cached_tokens' in prompt_details:
+            # OpenAI-compatible
+            return prompt_details['cached_tokens'] or 0
+        return None
+
+    @property
+    def cache_miss_tokens(self):
+        """
+        Prompt tokens the provider had to process, None if cache use is not reported
+        """
+        if 'prompt_cache_miss_tokens' in self.details:
+            return self.details['prompt_cache_miss_tokens'] or 0
+        hit = self.cache_hit_tokens
+        return None if hit is None else max(0, self.prompt_tokens - hit)
+
+
+class Finish(StreamEvent):
+    """
+    The model finished generating
+    """
+    __slots__ = ('reason',)
+
+    def __init__(self, reason=None):
+        self.reason = reason
+
+
+class Error(StreamEvent):
+    """
+    The stream failed, no further events follow
+
+    `status` is the HTTP status of a failed response, `retry_after` the delay
+    the server asked for and `transient` marks transport failures such as
+    timeouts or resets.
+    """
+    __slots__ = ('message', 'status', 'retry_after', 'transient')
+
+    def __init__(self, message, status=None, retry_after=None, transient=False):
+        self.message = message
+        self.status = status
+        self.retry_after = retry_after
+        self.transient = transient
+
+    def __str__(self):
+        return self.message
+
+
+def events_from_chunk(chunk):
+    """
+    Convert one OpenAI-compatible streaming chunk into stream events
+
+    Args:
+        chunk (dict): Decoded JSON of a single "data:" frame
+
+    Returns:
+        list: Stream events carried by the chunk, possibly empty
+    """
+    events = []
+    choices = chunk.get('choices')
+    if choices:
+        choice = choices[0]
+        delta = choice.get('delta') or {}
+        reasoning = delta.get('reasoning_content')
+        if reasoning:
+            events.append(ReasoningDelta(reasoning))
+        content = delta.get('content')
+        if content:
+            events.append(TextDelta(content))
+        if choice.get('finish_reason'):
+            events.append(Finish(choice['finish_reason']))
+    usage = chunk.get('usage')
+    if usage:
+        events.append(Usage.from_dict(usage))
+    return events
+
+
+def events_from_sdk_chunk(chunk):
+    """
+    Convert one chunk of an openai SDK stream into stream events
+
+    Args:
+        chunk: ChatCompletionChunk object yielded by the SDK
+
+    Returns:
+        list: Stream events carried by the chunk, possibly empty
+    """
+    events = []
+    if chunk.choices:
+        choice = chunk.choices[0]
+        delta = choice.delta
+        if delta is not None:
+            # reasoning_content is a DeepSeek extension the SDK passes through
+            reasoning = getattr(delta, 'reasoning_content', None)
+            if reasoning:
+                events.append(ReasoningDelta(reasoning))
+            if delta.content:
+                events.append(TextDelta(delta.content))
+        if choice.finish_reason:
+            events.append(Finish(choice.finish_reason))
+    usage = getattr(chunk, 'usage', None)
+    if usage:
+        events.append(Usage(
+            usage.prompt_tokens,
+            usage.completion_tokens,
+            usage.total_tokens,
+            getattr(usage, 'model_extra', None)
+        ))
+    return events
+
+
+class StreamAccumulator:
+    """
+    Collects stream events with constant work per event
+
+    Text is kept as a list of deltas and only joined when read, and the
+    joined result is cached until the next delta arrives.
+    """
+    def __init__(self):
+        self._parts = []
+        self._reasoning_parts = []
+        self._text = ""
+        self._dirty = False
+        self.length = 0
+        self.usage = None
+        self.finish_reason = None
+        self.error = None
+
+    def add(self, event):
+        """
+        Add an event to the accumulator
+
+        Plain strings are accepted as text deltas for providers that have not
+        moved to typed events yet.
+
+        Args:
+            event (StreamEvent or str): The event
+
+        Returns:
+            StreamEvent: The event that was added
+        """
+        if isinstance(event, str):
+            event = TextDelta(event)
+        if isinstance(event, TextDelta):
+            self._parts.append(event.text)
+            self.length += len(event.text)
+            self._dirty = True
+        elif isinstance(event, ReasoningDelta):
+            self._reasoning_parts.append(event.text)
+        elif isinstance(event, Usage):
+            self.usage = event
+        elif isinstance(event, Finish):
+            self.finish_reason = event.reason
+        elif isinstance(event, Error):
+            self.error = event
+        return event
+
+    @property
+    def text(self):
+        """
+        The answer text received so far
+        """
+        if self._dirty:
+            self._text = "".join(self._parts)
+            self._parts = [self._text]
+            self._dirty = False
+        return self._text
+
+    @property
+    def reasoning(self):
+        """
+        The reasoning text received so far
+        """
+        return "".join(self._reasoning_parts)
+
+
+async def collect_stream(stream):
+    """
+    Consume an async event stream and return the accumulator
+
+    Args:
+        stream: Async iterator of stream events
+
+    Returns:
+        StreamAccumulator: The accumulated stream
+    """
+    accumulator = StreamAccumulator()
+    async for event in stream:
+        accumulator.add(event)
+        if accumulator.error:
+            break
+    return accumulator
@@ -0,0 +1,328 @@
+import logging
+import re
+import threading
+from functools import lru_cache
+
+logger = logging.getLogger("token_budget")
+
+# Context window, completion limit and whether the model spends completion tokens on reasoning
+MODEL_LIMITS = {
+    'deepseek-chat': (65536, 8192, False),
+    'deepseek-reasoner': (65536, 32768, True),
+    'grok-3': (131072, 16384, False),
+    'grok-3-reasoner': (131072, 16384, True),
+    'gpt-4o-mini': (128000, 16384, False),
+    'gpt-4o': (128000, 16384, False),
+    'gpt-4.1': (1047576, 32768, False),
+}
+
+# Limits of unknown models, by family
+FAMILY_LIMITS = {
+    'deepseek': (65536, 8192, False),
+    'grok': (131072, 16384, False),
+    'openai': (128000, 16384, False),
+    'default': (32768, 4096, False),
+}
+
+# How each family's tokenizer splits text: characters per token of ASCII words
+# and of other alphabetic scripts, and tokens per CJK character
+FAMILY_PROFILES = {
+    'deepseek': {'word_chars': 6.0, 'letter_chars': 3.0, 'cjk': 0.6},
+    'grok': {'word_chars': 6.0, 'letter_chars': 3.0, 'cjk': 0.9},
+    'openai': {'word_chars': 6.0, 'letter_chars': 3.0, 'cjk': 1.0},
+    'default': {'word_chars': 5.0, 'letter_chars': 2.5, 'cjk': 1.0},
+}
+
+# Chat formatting tokens added per message and once per request
+MESSAGE_OVERHEAD = 4
+REQUEST_OVERHEAD = 3
+
+# Pieces of text that tokenizers treat alike, found in one regex pass
+_PIECES = re.compile(
+    r"(?P<word>[A-Za-z]+)"
+    r"|(?P<digits>\d+)"
+    r"|(?P<cjk>[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+)"
+    r"|(?P<letters>[^\W\d_]+)"
+    r"|(?P<newline>\s*\n\s*)"
+    r"|(?P<space>\s+)"
+    r"|(?P<other>.)",
+    re.S
+)
+
+_PROVIDER_FAMILIES = {'deepseek': 'deepseek', 'grok': 'grok', 'openai': 'openai', 'github': 'openai'}
+
+
+class PromptTooLong(Exception):
+    """
+    Raised when a prompt does not fit the model's context window and cannot be trimmed
+    """
+    pass
+
+
+def model_family(model=None, provider=None):
+    """
+    Get the tokenizer family of a model
+
+    Args:
+        model (str, optional): Model name
+        provider (str, optional): Provider name, used when the model is unknown
+
+    Returns:
+        str: "deepseek", "grok", "openai" or "default"
+    """
+    name = (model or '').lower()
+    for family in ('deepseek', 'grok'):
+        if family in name:
+            return family
+    if name.startswith(('gpt', 'o1', 'o3', 'o4')):
+        return 'openai'
+    return _PROVIDER_FAMILIES.get(provider, 'default')
+
+
+@lru_cache(maxsize=256)
+def _count_pieces(text):
+    """
+    Count the pieces of a text by kind
+
+    Cached because system prompts repeat on every request.
+
+    Args:
+        text (str): The text
+
+    Returns:
+        dict: Kind to (number of pieces, total characters)
+    """
+    counts = {}
+    for match in _PIECES.finditer(text):
+        kind = match.lastgroup
+        number, chars = counts.get(kind, (0, 0))
+        counts[kind] = (number + 1, chars + match.end() - match.start())
+    return counts
+
+
+class TokenEstimator:
+    """
+    Offline token count estimate calibrated per model family
+
+    Text is split the way byte-pair tokenizers roughly split it: short ASCII
+    words are one token, longer ones one per few characters, numbers one per
+    three digits, CJK characters close to one each and punctuation one per
+    character. The per-family profile sets these rates, and a correction
+    factor learned from the prompt token counts providers report absorbs
+    what the heuristic gets wrong.
+    """
+    def __init__(self, alpha=0.1):
+        """
+        Initialize the estimator
+
+        Args:
+            alpha (float): Weight of each reported count in the correction factor
+        """
+        self.alpha = alpha
+        self._factors = {}
+        self._lock = threading.Lock()
+
+    def _raw(self, text, family):
+        if not text:
+            return 0.0
+        profile = FAMILY_PROFILES.get(family, FAMILY_PROFILES['default'])
+        counts = _count_pieces(text)
+        words, word_chars = counts.get('word', (0, 0))
+        digits, digit_chars = counts.get('digits', (0, 0))
+        letters, letter_chars = counts.get('letters', (0, 0))
+        tokens = words + max(0.0, word_chars - words * profile['word_chars']) / profile['word_chars']
+        tokens += (digit_chars + 2 * digits) / 3
+        tokens += max(letters, letter_chars / profile['letter_chars'])
+        tokens += counts.get('cjk', (0, 0))[1] * profile['cjk']
+        tokens += counts.get('newline', (0, 0))[0] + counts.get('other', (0, 0))[0]
+        # Single spaces merge into the following word, longer runs cost about one token
+        return tokens + counts.get('space', (0, 0))[0] * 0.1
+
+    def estimate(self, text, family='default'):
+        """
+        Estimate the token count of a text
+
+        Args:
+            text (str): The text
+            family (str): Tokenizer family, see model_family()
+
+        Returns:
+            int: Estimated tokens
+        """
+        return int(self._raw(text, family) * self._factors.get(family, 1.0) + 0.5)
+
+    def estimate_messages(self, family, *contents):
+        """
+        Estimate the prompt tokens of a chat request
+
+        Args:
+            family (str): Tokenizer family
+            *contents (str): Content of each message, empty ones are skipped
+
+        Returns:
+            int: Estimated prompt tokens including the chat formatting
+        """
+        contents = [content for content in contents if content]
+        tokens = sum(self._raw(content, family) for content in contents) * self._factors.get(family, 1.0)
+        return int(tokens + 0.5) + MESSAGE_OVERHEAD * len(contents) + REQUEST_OVERHEAD
+
+    def calibrate(self, family, contents, prompt_tokens):
+        """
+        Correct the family's estimates with a prompt token count reported by a provider
+
+        Args:
+            family (str): Tokenizer family
+            contents (tuple): Content of each message of the request
+            prompt_tokens (int): Prompt tokens the provider counted
+        """
+        contents = [content for content in contents if content]
+        raw = sum(self._raw(content, family) for content in contents)
+        # Tiny prompts are dominated by formatting overhead and say little about the text
+        if raw < 50 or not prompt_tokens:
+            return
+        ratio = (prompt_tokens - MESSAGE_OVERHEAD * len(contents) - REQUEST_OVERHEAD) / raw
+        ratio = min(2.0, max(0.5, ratio))
+        with self._lock:
+            factor = self._factors.get(family, 1.0)
+            self._factors[family] = factor + self.alpha * (ratio - factor)
+
+    def get_stats(self):
+        """
+        Get the learned correction factors
+
+        Returns:
+            dict: Family to correction factor
+        """
+        return {family: round(factor, 3) for family, factor in self._factors.items()}
+
+
+class ContextBudget:
+    """
+    Fits each request into its model's context window
+
+    The completion limit depends on where the answer goes: answers shown in
+    the chat get a modest limit, answers delivered as a file the model's full
+    completion limit. Reasoning models get extra room for their thinking. If
+    the prompt leaves too little room, the completion limit shrinks first,
+    then the middle of the prompt is cut, and a prompt that cannot fit is
+    rejected before anything is sent.
+    """
+    def __init__(self, estimator, inline_max_tokens=2000, file_max_tokens=8000, reasoning_tokens=4000,
+                 min_completion_tokens=256, safety_margin=0.1, trim=True):
+        """
+        Initialize the budget manager
+
+        Args:
+            estimator (TokenEstimator): Token estimator
+            inline_max_tokens (int): Completion limit for answers shown in the chat
+            file_max_tokens (int): Completion limit for answers delivered as a file
+            reasoning_tokens (int): Extra completion tokens for reasoning models
+            min_completion_tokens (int): Smallest completion limit worth sending a request for
+            safety_margin (float): Share added to prompt estimates to cover estimation error
+            trim (bool): Whether oversized prompts are trimmed instead of rejected
+        """
+        self.estimator = estimator
+        self.inline_max_tokens = inline_max_tokens
+        self.file_max_tokens = file_max_tokens
+        self.reasoning_tokens = reasoning_tokens
+        self.min_completion_tokens = min_completion_tokens
+        self.safety_margin = safety_margin
+        self.trim = trim
+        self.stats = {'planned': 0, 'shrunk': 0, 'trimmed': 0, 'rejected': 0}
+
+    def limits(self, model=None, provider=None):
+        """
+        Get the limits of a model
+
+        Args:
+            model (str, optional): Model name
+            provider (str, optional): Provider name, used when the model is unknown
+
+        Returns:
+            tuple: (context window, completion limit, reasoning model)
+        """
+        return MODEL_LIMITS.get(model) or FAMILY_LIMITS[model_family(model, provider)]
+
+    def plan(self, provider, model, prompt, system_prompt=None, max_tokens=None, channel='inline', history=()):
+        """
+        Choose the completion limit of a request and trim its prompt if needed
+
+        Args:
+            provider (str): Provider name
+            model (str): Model name, None for the provider's default
+            prompt (str): User prompt
+            system_prompt (str, optional): System prompt
+            max_tokens (int, optional): Completion limit asked for by the caller
+            channel (str): "inline" for answers shown in the chat, "file" for
+                answers delivered as a document
+            history (tuple): Contents of earlier conversation messages sent with the prompt
+
+        Returns:
+            tuple: (prompt, max_tokens), the prompt trimmed if it did not fit
+
+        Raises:
+            PromptTooLong: If the prompt cannot fit even when trimmed
+        """
+        window, completion_limit, reasoning = self.limits(model, provider)
+        family = model_family(model, provider)
+        wanted = max_tokens or (self.file_max_tokens if channel == 'file' else self.inline_max_tokens)
+        if reasoning and not max_tokens:
+            wanted += self.reasoning_tokens
+        wanted = min(wanted, completion_limit)
+        self.stats['planned'] += 1
+
+        margin = 1.0 + self.safety_margin
+        system_tokens = self.estimator.estimate_messages(family, system_prompt, *history) * margin
+        prompt_tokens = self.estimator.estimate(prompt, family) * margin
+        room = int(window - system_tokens - prompt_tokens - MESSAGE_OVERHEAD)
+        if room >= wanted:
+            return prompt, wanted
+        if room >= self.min_completion_tokens:
+            self.stats['shrunk'] += 1
+            return prompt, room
+
+        keep_tokens = window - system_tokens - MESSAGE_OVERHEAD - min(wanted, self.min_completion_tokens * 4)
+        if not self.trim or keep_tokens < self.min_completion_tokens:
+            self.stats['rejected'] += 1
+            raise PromptTooLong(
+                f"The message is too long for {model or provider}: about {int(system_tokens + prompt_tokens)} tokens, "
+                f"the model takes {window} including the answer"
+            )
+        self.stats['trimmed'] += 1
+        trimmed = trim_middle(prompt, int(len(prompt) * keep_tokens / prompt_tokens))
+        logger.info(f"Trimmed a {len(prompt)} character prompt to {len(trimmed)} to fit {model or provider}")
+        return trimmed, min(wanted, self.min_completion_tokens * 4)
+
+    def get_stats(self):
+        """
+        Get budget decisions and the estimator's correction factors
+
+        Returns:
+            dict: Planned, shrunk, trimmed and rejected request counts, and the factors
+        """
+        return dict(self.stats, calibration=self.estimator.get_stats())
+
+
+def trim_middle(text, max_chars):
+    """
+    Cut the middle of a text, keeping its start and most of its end
+
+    The start usually holds the instructions and the end the actual question.
+
+    Args:
+        text (str): The text
+        max_chars (int): Characters to keep
+
+    Returns:
+        str: The text with a marker where characters were left out
+    """
+    if len(text) <= max_chars:
+        return text
+    head = max_chars // 3
+    tail = max_chars - head
+    omitted = len(text) - head - tail
+    return f"{text[:head]}\n\n[... {omitted} characters omitted ...]\n\n{text[-tail:] if tail else ''}"
+
+
+# Global token estimator, shared so calibration benefits every user
+token_estimator = TokenEstimator()
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from core.executors import executors
+
+logger = logging.getLogger("usage_ledger")
+
+# USD per million tokens: (prompt, prompt served from the provider's cache, completion)
+MODEL_PRICES = {
+    'deepseek-chat': (0.27, 0.07, 1.10),
+    'deepseek-reasoner': (0.55, 0.14, 2.19),
+    'grok-3': (3.00, 0.75, 15.00),
+    'grok-3-reasoner': (3.00, 0.75, 15.00),
+    'gpt-4o-mini': (0.15, 0.075, 0.60),
+    'gpt-4o': (2.50, 1.25, 10.00),
+    'gpt-4.1': (2.00, 0.50, 8.00),
+}
+
+# Positions in a counter row
+REQUESTS, PROMPT, CACHED, COMPLETION, COST = range(5)
+
+
+def _today():
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+
+class UsageLedger:
+    """
+    Token usage and cost per day, user, chat, command, provider and model
+
+    Recording a request only adds to in-memory counters. A background task
+    flushes the counters accumulated since the last flush in one batch, so
+    requests never wait for the disk. A path ending in .jsonl appends one
+    line per counter row, any other path is a SQLite database whose rows are
+    summed per key. Daily token totals per user are kept in memory for quota
+    checks, and restored from the database on start.
+    """
+    def __init__(self, path=None, flush_interval=60, prices=None):
+        """
+        Initialize the ledger
+
+        Args:
+            path (str, optional): SQLite or .jsonl file, persistence is disabled if empty
+            flush_interval (float): Seconds between flushes
+            prices (dict, optional): Model to (prompt, cached prompt, completion)
+                USD per million tokens, overriding the defaults
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.prices = dict(MODEL_PRICES, **(prices or {}))
+        self.stats = {'recorded': 0, 'unpriced': 0, 'flushes': 0, 'flushed_rows': 0, 'flush_errors': 0}
+        self._counters = {}  # (day, user_id, chat_id, command, provider, model) -> counter row
+        self._totals = [0, 0, 0, 0, 0.0]
+        self._daily = {}  # user_id -> (day, tokens)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._task = None
+        self._db = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if not path.endswith('.jsonl'):
+                try:
+                    self._open_db(path)
+                except sqlite3.Error as e:
+                    logger.error(f"Could not open usage ledger at {path}, usage is not persisted: {e}")
+                    self.path = None
+
+    def _open_db(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS usage (day TEXT NOT NULL, user_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, "
+                "command TEXT NOT NULL, provider TEXT NOT NULL, model TEXT NOT NULL, requests INTEGER NOT NULL, "
+                "prompt_tokens INTEGER NOT NULL, cached_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL, "
+                "cost REAL NOT NULL, PRIMARY KEY (day, user_id, chat_id, command, provider, model))"
+            )
+        day = _today()
+        for user_id, tokens in self._db.execute(
+            "SELECT user_id, SUM(prompt_tokens + completion_tokens) FROM usage WHERE day = ? GROUP BY user_id", (day,)
+        ):
+            self._daily[user_id] = (day, tokens)
+
+    def cost(self, model, usage):
+        """
+        Get the cost of a request
+
+        Args:
+            model (str): Model name
+            usage (Usage): Usage reported by the provider
+
+        Returns:
+            float: Cost in USD, None if the model has no price
+        """
+        price = self.prices.get(model)
+        if price is None:
+            return None
+        cached = usage.cache_hit_tokens or 0
+        return (
+            (usage.prompt_tokens - cached) * price[0] + cached * price[1] + usage.completion_tokens * price[2]
+        ) / 1_000_000
+
+    def record(self, provider, model, usage, user_id=None, chat_id=None, command=None):
+        """
+        Add a completed request to the counters
+
+        Args:
+            provider (str): Provider name
+            model (str): Model name, None if the provider's default was used
+            usage (Usage): Usage reported by the provider
+            user_id (int, optional): User who sent the command
+            chat_id (int, optional): Chat the command was sent in
+            command (str, optional): Command name
+        """
+        model = model or ''
+        cost = self.cost(model, usage)
+        cached = usage.cache_hit_tokens or 0
+        tokens = usage.prompt_tokens + usage.completion_tokens
+        day = _today()
+        key = (day, user_id or 0, chat_id or 0, command or '', provider, model)
+        with self._lock:
+            row = self._counters.get(key)
+            if row is None:
+                row = self._counters[key] = [0, 0, 0, 0, 0.0]
+            for counters in (row, self._totals):
+                counters[REQUESTS] += 1
+                counters[PROMPT] += usage.prompt_tokens
+                counters[CACHED] += cached
+                counters[COMPLETION] += usage.completion_tokens
+                counters[COST] += cost or 0.0
+            self.stats['recorded'] += 1
+            if cost is None:
+                self.stats['unpriced'] += 1
+            if user_id:
+                last_day, used = self._daily.get(user_id, (day, 0))
+                self._daily[user_id] = (day, (used if last_day == day else 0) + tokens)
+
+    def tokens_today(self, user_id):
+        """
+        Get the tokens a user consumed today (UTC)
+
+        Args:
+            user_id (int): User ID
+
+        Returns:
+            int: Prompt and completion tokens
+        """
+        with self._lock:
+            day, tokens = self._daily.get(user_id, (None, 0))
+        return tokens if day == _today() else 0
+
+    def flush(self):
+        """
+        Write the counters accumulated since the last flush in one batch
+
+        Counters that could not be written are kept for the next flush.
+
+        Returns:
+            int: Rows written
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._counters = self._counters, {}
+                day = _today()
+                self._daily = {user_id: entry for user_id, entry in self._daily.items() if entry[0] == day}
+            if not pending:
+                return 0
+            if not self.path:
+                # Nothing to persist to, the counters only feed the statistics
+                return 0
+            try:
+                if self._db is not None:
+                    self._write_db(pending)
+                else:
+                    self._write_jsonl(pending)
+            except (sqlite3.Error, OSError) as e:
+                logger.warning(f"Usage ledger flush failed, retrying next time: {e}")
+                with self._lock:
+                    self.stats['flush_errors'] += 1
+                    for key, row in pending.items():
+                        current = self._counters.setdefault(key, [0, 0, 0, 0, 0.0])
+                        for index, value in enumerate(row):
+                            current[index] += value
+                return 0
+            with self._lock:
+                self.stats['flushes'] += 1
+                self.stats['flushed_rows'] += len(pending)
+            return len(pending)
+
+    def _write_db(self, pending):
+        with self._db:
+            self._db.executemany(
+                "INSERT INTO usage (day, user_id, chat_id, command, provider, model, requests, prompt_tokens, "
+                "cached_tokens, completion_tokens, cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (day, user_id, chat_id, command, provider, model) DO UPDATE SET "
+                "requests = requests + excluded.requests, prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+                "cached_tokens = cached_tokens + excluded.cached_tokens, "
+                "completion_tokens = completion_tokens + excluded.completion_tokens, cost = cost + excluded.cost",
+                [key + tuple(row) for key, row in pending.items()]
+            )
+
+    def _write_jsonl(self, pending):
+        fields = ('day', 'user_id', 'chat_id', 'command', 'provider', 'model')
+        lines = []
+        for key, row in pending.items():
+            entry = dict(zip(fields, key))
+            entry.update(
+                requests=row[REQUESTS],
+                prompt_tokens=row[PROMPT],
+                cached_tokens=row[CACHED],
+                completion_tokens=row[COMPLETION],
+                cost=round(row[COST], 6)
+            )
+            lines.append(json.dumps(entry) + "\n")
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+
+    def start(self):
+        """
+        Start flushing in the background
+
+        Must be called from the running event loop.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """
+        Stop the flush loop and write what is left
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await executors.run('file_io', self.flush)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await executors.run('file_io', self.flush)
+
+    def get_stats(self):
+        """
+        Get ledger statistics
+
+        Returns:
+            dict: Request and token totals, cost in USD, counters not yet
+                flushed and flush counters
+        """
+        with self._lock:
+            return dict(
+                self.stats,
+                requests=self._totals[REQUESTS],
+                prompt_tokens=self._totals[PROMPT],
+                cached_tokens=self._totals[CACHED],
+                completion_tokens=self._totals[COMPLETION],
+                cost=round(self._totals[COST], 6),
+                pending_rows=len(self._counters)
+            )
@@ -4,6 +4,11 @@ import os
 import time
 import logging
 
+from api.conversation_store import ConversationStore
+from core.config import config
+from core.scheduler import FairScheduler
+from core.worker_pool import WorkerPool
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -27,6 +32,21 @@ class BotBase(ABC):
         self.client = None
         self.is_running = False
         self.start_time = None
+        # Bounded pool every incoming command runs in
+        self.ingress = WorkerPool(workers=config.ingress_workers, max_queue=config.ingress_max_queue)
+        # Shares LLM capacity fairly between users and chats
+        self.scheduler = FairScheduler(
+            concurrency=config.llm_scheduler_concurrency,
+            feedback_interval=config.llm_scheduler_feedback_interval
+        )
+        # Recent turns of each reply thread, for follow-up questions
+        self.conversations = ConversationStore(
+            max_tokens=config.conversation_max_tokens,
+            max_turns=config.conversation_max_turns,
+            max_bytes=config.conversation_max_bytes,
+            ttl=config.conversation_ttl,
+            disk_path=config.conversation_disk_path
+        ) if config.conversation_enabled else None
     
     @abstractmethod
     async def initialize(self):
@@ -33,16 +33,201 @@ class Config:
         # Load from credentials file (as fallback)
         self._load_credentials()
         
+        # Every provider can rotate between several keys
+        self.api_keys = self._load_api_keys()
+        self.llm_key_cooldown = float(os.getenv('LLM_KEY_COOLDOWN', 60))
+        
         # Load MCP server configurations
         self.mcp_servers = self._load_mcp_config()
         
+        # Per-command system prompt overrides, compiled once into prompt templates
+        self.llm_prompts, self.llm_format_instructions = self._load_prompts()
+        
         # Message length limits
         self.telegram_max_length = 2500
         
-        # Retry settings
-        self.max_retries = 3
-        self.retry_delay = 2
+        # Retry settings for failed provider streams
+        self.max_retries = int(os.getenv('LLM_RETRY_MAX_RETRIES', 2))
+        self.retry_delay = float(os.getenv('LLM_RETRY_BASE_DELAY', 0.5))
+        self.retry_max_delay = float(os.getenv('LLM_RETRY_MAX_DELAY', 8))
+        self.retry_max_retry_after = float(os.getenv('LLM_RETRY_MAX_RETRY_AFTER', 30))
+        self.retry_budget_percent = float(os.getenv('LLM_RETRY_BUDGET_PERCENT', 20))
+        
+        # Request deadline set at command dispatch and the transport timeouts derived from it
+        self.request_deadline = float(os.getenv('REQUEST_DEADLINE', 300))
+        self.llm_connect_timeout = float(os.getenv('LLM_CONNECT_TIMEOUT', 10))
+        self.llm_first_byte_timeout = float(os.getenv('LLM_FIRST_BYTE_TIMEOUT', 60))
+        self.llm_idle_timeout = float(os.getenv('LLM_IDLE_TIMEOUT', 30))
+        self.llm_min_attempt_seconds = float(os.getenv('LLM_MIN_ATTEMPT_SECONDS', 5))
+        
+        # Alternative base URLs per provider ("<PROVIDER>_BASE_URLS", comma-separated),
+        # probed in the background and routed to by latency
+        self.llm_base_urls = {
+            provider: [url.strip() for url in os.getenv(f'{provider.upper()}_BASE_URLS').split(',') if url.strip()]
+            for provider in ('openai', 'deepseek', 'github', 'grok')
+            if os.getenv(f'{provider.upper()}_BASE_URLS')
+        }
+        self.llm_endpoint_probe_interval = float(os.getenv('LLM_ENDPOINT_PROBE_INTERVAL', 30))
+        self.llm_endpoint_max_failures = int(os.getenv('LLM_ENDPOINT_MAX_FAILURES', 3))
+        self.llm_endpoint_outlier_factor = float(os.getenv('LLM_ENDPOINT_OUTLIER_FACTOR', 3))
+        self.llm_endpoint_ejection_seconds = float(os.getenv('LLM_ENDPOINT_EJECTION_SECONDS', 30))
+        
+        # Provider HTTP connection pool settings
+        self.http_pool_max_connections = int(os.getenv('HTTP_POOL_MAX_CONNECTIONS', 10))
+        self.http_pool_idle_timeout = float(os.getenv('HTTP_POOL_IDLE_TIMEOUT', 60))
+        
+        # Connection pre-warming: provider hosts are resolved and connected at startup
+        # and kept warm while idle, so the first request after a pause skips DNS and TLS
+        self.llm_dns_ttl = float(os.getenv('LLM_DNS_TTL', 300))
+        self.llm_prewarm_enabled = os.getenv('LLM_PREWARM_ENABLED', 'true').lower() == 'true'
+        self.llm_keep_warm_interval = float(os.getenv('LLM_KEEP_WARM_INTERVAL', 45))
+        self.llm_keep_warm_connections = int(os.getenv('LLM_KEEP_WARM_CONNECTIONS', 1))
+        self.llm_keep_warm_probe = os.getenv('LLM_KEEP_WARM_PROBE', 'false').lower() == 'true'
+        
+        # LLM response cache settings
+        self.llm_cache_enabled = os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+        self.llm_cache_ttl = float(os.getenv('LLM_CACHE_TTL', 3600))
+        self.llm_cache_max_bytes = int(os.getenv('LLM_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+        self.llm_cache_disk_path = os.getenv('LLM_CACHE_DISK_PATH', '')
+        self.llm_cache_disabled_providers = {
+            name.strip() for name in os.getenv('LLM_CACHE_DISABLED_PROVIDERS', '').split(',') if name.strip()
+        }
+        self.llm_cache_replay_chunk_chars = int(os.getenv('LLM_CACHE_REPLAY_CHUNK_CHARS', 80))
+        self.llm_cache_replay_interval = float(os.getenv('LLM_CACHE_REPLAY_INTERVAL', 0.05))
+        
+        # Share one upstream stream between identical concurrent requests
+        self.llm_single_flight_enabled = os.getenv('LLM_SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+        
+        # Hedged requests: race a secondary provider when the primary is slow to start
+        self.llm_hedge_enabled = os.getenv('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+        self.llm_hedge_providers = dict(
+            pair.split(':', 1) for pair in os.getenv('LLM_HEDGE_PROVIDERS', 'grok:deepseek').split(',') if ':' in pair
+        )
+        self.llm_hedge_delay = float(os.getenv('LLM_HEDGE_DELAY', 3.0))
+        self.llm_hedge_min_delay = float(os.getenv('LLM_HEDGE_MIN_DELAY', 0.5))
+        self.llm_hedge_budget_percent = float(os.getenv('LLM_HEDGE_BUDGET_PERCENT', 10))
+        
+        # Adaptive per-provider concurrency and tokens-per-minute limits
+        self.llm_limiter_max_concurrency = int(os.getenv('LLM_LIMITER_MAX_CONCURRENCY', 8))
+        self.llm_limiter_max_wait = float(os.getenv('LLM_LIMITER_MAX_WAIT', 10))
+        self.llm_limiter_tokens_per_minute = {
+            name.strip(): int(limit) for name, _, limit in (
+                pair.partition(':') for pair in os.getenv('LLM_LIMITER_TOKENS_PER_MINUTE', '').split(',')
+            ) if limit.strip().isdigit()
+        }
+        
+        # Bounded ingress: command workers, waiting commands and the longest accepted prompt
+        self.ingress_workers = int(os.getenv('INGRESS_WORKERS', 16))
+        self.ingress_max_queue = int(os.getenv('INGRESS_MAX_QUEUE', 64))
+        self.max_prompt_chars = int(os.getenv('MAX_PROMPT_CHARS', 8000))
+        
+        # Worker threads of the dedicated pools for blocking LLM calls, scraping and file I/O
+        self.llm_executor_workers = int(os.getenv('LLM_EXECUTOR_WORKERS', 8))
+        self.scraping_executor_workers = int(os.getenv('SCRAPING_EXECUTOR_WORKERS', 2))
+        self.file_io_executor_workers = int(os.getenv('FILE_IO_EXECUTOR_WORKERS', 2))
+        
+        # Fair-share scheduling of LLM requests across users and chats
+        self.llm_scheduler_concurrency = int(os.getenv('LLM_SCHEDULER_CONCURRENCY', 8))
+        self.llm_scheduler_feedback_interval = float(os.getenv('LLM_SCHEDULER_FEEDBACK_INTERVAL', 3))
+        self.llm_priority_ids = {
+            int(value) for value in os.getenv('LLM_PRIORITY_IDS', '').split(',') if value.strip().lstrip('-').isdigit()
+        }
+        
+        # Mid-stream stall detection: silence worth LLM_STALL_TOKENS at a provider's usual
+        # speed ends the stream and the answer is continued on the next provider of the chain
+        self.llm_stall_timeout = float(os.getenv('LLM_STALL_TIMEOUT', 20))
+        self.llm_stall_min_seconds = float(os.getenv('LLM_STALL_MIN_SECONDS', 5))
+        self.llm_stall_tokens = float(os.getenv('LLM_STALL_TOKENS', 150))
+        
+        # Context budget: completion limits by delivery channel, fitted into the model's context window
+        self.llm_inline_max_tokens = int(os.getenv('LLM_INLINE_MAX_TOKENS', 2000))
+        self.llm_file_max_tokens = int(os.getenv('LLM_FILE_MAX_TOKENS', 8000))
+        self.llm_reasoning_tokens = int(os.getenv('LLM_REASONING_TOKENS', 4000))
+        self.llm_min_completion_tokens = int(os.getenv('LLM_MIN_COMPLETION_TOKENS', 256))
+        self.llm_trim_oversized_prompts = os.getenv('LLM_TRIM_OVERSIZED_PROMPTS', 'true').lower() == 'true'
+        
+        # Conversations: replies to an answer continue its thread with the recent turns as context
+        self.conversation_enabled = os.getenv('CONVERSATION_ENABLED', 'true').lower() == 'true'
+        self.conversation_max_tokens = int(os.getenv('CONVERSATION_MAX_TOKENS', 3000))
+        self.conversation_max_turns = int(os.getenv('CONVERSATION_MAX_TURNS', 20))
+        self.conversation_max_bytes = int(os.getenv('CONVERSATION_MAX_BYTES', 16 * 1024 * 1024))
+        self.conversation_ttl = float(os.getenv('CONVERSATION_TTL', 86400))
+        self.conversation_disk_path = os.getenv('CONVERSATION_DISK_PATH', '')
+        
+        # Reply chains: text of the replied-to messages is added to a prompt, resolved from recently seen messages
+        self.reply_context_enabled = os.getenv('REPLY_CONTEXT_ENABLED', 'true').lower() == 'true'
+        self.reply_context_max_hops = int(os.getenv('REPLY_CONTEXT_MAX_HOPS', 5))
+        self.reply_context_max_tokens = int(os.getenv('REPLY_CONTEXT_MAX_TOKENS', 2000))
+        self.message_cache_per_chat = int(os.getenv('MESSAGE_CACHE_PER_CHAT', 200))
+        self.message_cache_max_bytes = int(os.getenv('MESSAGE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+        
+        # Usage ledger: tokens and cost per user, chat, command, provider and model, flushed in batches
+        self.usage_ledger_path = os.getenv('USAGE_LEDGER_PATH', 'logs/usage.db')
+        self.usage_flush_interval = float(os.getenv('USAGE_FLUSH_INTERVAL', 60))
+        self.usage_prices = self._parse_prices(os.getenv('USAGE_PRICES', ''))
+        self.usage_user_daily_tokens = int(os.getenv('USAGE_USER_DAILY_TOKENS', 0))
+        
+        # Per-provider circuit breakers
+        self.llm_breaker_failure_rate = float(os.getenv('LLM_BREAKER_FAILURE_RATE', 0.5))
+        self.llm_breaker_min_requests = int(os.getenv('LLM_BREAKER_MIN_REQUESTS', 5))
+        self.llm_breaker_window = float(os.getenv('LLM_BREAKER_WINDOW', 60))
+        self.llm_breaker_open_seconds = float(os.getenv('LLM_BREAKER_OPEN_SECONDS', 30))
+        self.llm_breaker_slow_call_seconds = float(os.getenv('LLM_BREAKER_SLOW_CALL_SECONDS', 20))
+        self.llm_breaker_probe_interval = float(os.getenv('LLM_BREAKER_PROBE_INTERVAL', 5))
+        
+        # Fallback chains per command: "command=provider[:model],provider[:model];..."
+        self.llm_fallback_chains = self._parse_fallback_chains(os.getenv(
+            'LLM_FALLBACK_CHAINS',
+            'gpt=openai,deepseek:deepseek-chat;'
+            'r1=deepseek:deepseek-reasoner,grok:grok-3-reasoner;'
+            'grok=grok:grok-3,deepseek:deepseek-chat;'
+            'grok_think=grok:grok-3,deepseek:deepseek-reasoner'
+        ))
+        
+    def _parse_fallback_chains(self, value):
+        """
+        Parse the per-command fallback chain setting
+        
+        Args:
+            value (str): e.g. "r1=deepseek:deepseek-reasoner,grok;gpt=openai,deepseek"
+            
+        Returns:
+            dict: Command name to a list of (provider, model or None) tuples
+        """
+        chains = {}
+        for entry in value.split(';'):
+            command, _, providers = entry.partition('=')
+            if not command.strip() or not providers.strip():
+                continue
+            chain = []
+            for item in providers.split(','):
+                provider, _, model = item.strip().partition(':')
+                if provider:
+                    chain.append((provider, model or None))
+            chains[command.strip()] = chain
+        return chains
+    
+    def _parse_prices(self, value):
+        """
+        Parse the model price overrides
         
+        Args:
+            value (str): e.g. "deepseek-chat=0.27:0.07:1.10,gpt-4.1=2:0.5:8", USD per
+                million prompt, cached prompt and completion tokens
+            
+        Returns:
+            dict: Model name to a (prompt, cached prompt, completion) tuple
+        """
+        prices = {}
+        for entry in value.split(','):
+            model, _, rates = entry.partition('=')
+            try:
+                prompt, cached, completion = (float(rate) for rate in rates.split(':'))
+            except ValueError:
+                continue
+            prices[model.strip()] = (prompt, cached, completion)
+        return prices
+    
     def _load_credentials(self):
         """
         Load configuration from credentials file (if exists)
@@ -72,6 +257,31 @@ class Config:
         else:
             self.secrets = {}
 
+    def _load_api_keys(self):
+        """
+        Collect the API keys of every provider
+        
+        Keys come from <PROVIDER>_API_KEYS or <PROVIDER>_API_KEY in the
+        environment, both comma-separated, or else from api_keys or api_key in
+        the provider's section of the credentials file. The single-key
+        attributes such as grok_api_key are set to the first key.
+        
+        Returns:
+            dict: Provider name to its list of keys
+        """
+        api_keys = {}
+        for provider in ('openai', 'deepseek', 'github', 'grok'):
+            value = os.getenv(f'{provider.upper()}_API_KEYS') or os.getenv(f'{provider.upper()}_API_KEY', '')
+            if value:
+                keys = value.split(',')
+            else:
+                section = self.secrets.get(provider, {})
+                keys = section.get('api_keys') or [section.get('api_key', '')]
+            keys = [key.strip() for key in keys if key and key.strip()]
+            api_keys[provider] = keys
+            setattr(self, f'{provider}_api_key', keys[0] if keys else '')
+        return api_keys
+    
     def _load_mcp_config(self):
         """
         Load MCP server configuration from JSON file
@@ -95,6 +305,29 @@ class Config:
             print(f"MCP config file not found at {file_path}")
             return {}
     
+    def _load_prompts(self):
+        """
+        Load per-command system prompts from the prompts file (if exists)
+        
+        The file is TOML with a [prompts] table mapping template names such as
+        "grok" or "r1" to system prompts, and an optional top-level
+        format_instructions string appended to every system prompt.
+        
+        Returns:
+            tuple: (template name to system prompt, format instructions or None)
+        """
+        file_path = os.getenv(
+            'LLM_PROMPTS_FILE', os.path.join(os.path.dirname(parent_dir), 'config', 'prompts.toml')
+        )
+        if not os.path.exists(file_path):
+            return {}, None
+        try:
+            data = toml.load(file_path)
+        except Exception as e:
+            print(f"Error loading prompts file: {e}")
+            return {}, None
+        return dict(data.get('prompts', {})), data.get('format_instructions') or None
+    
     def is_test_environment(self):
         """
         Check if running in test environment
@@ -116,6 +349,18 @@ class Config:
         else:
             return None
         
+    def get_api_keys(self, provider):
+        """
+        Get all API keys of a provider
+        
+        Args:
+            provider (str): Provider name
+            
+        Returns:
+            list: The provider's keys, empty if none are configured
+        """
+        return self.api_keys.get(provider, [])
+        
     def get_mcp_server(self, server_name):
         """
         Get configuration for a specific MCP server
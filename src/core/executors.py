@@ -0,0 +1,189 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import config
+
+logger = logging.getLogger("executors")
+
+# Upper bounds in seconds of the queue wait histogram buckets
+WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+class NamedExecutor:
+    """
+    Named, separately sized thread pool for one kind of blocking work
+
+    Keeping LLM calls, scraping and file I/O in their own pools means a burst of
+    slow calls of one kind queues behind its own workers instead of starving
+    the default executor that asyncio and telethon rely on. Each call records
+    how long it waited for a worker in a bucketed histogram.
+    """
+    def __init__(self, name, workers):
+        """
+        Initialize the executor
+
+        Args:
+            name (str): Pool name, also the prefix of its thread names
+            workers (int): Maximum number of worker threads
+        """
+        self.name = name
+        self.workers = workers
+        self.active = 0
+        self.queued = 0
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0}
+        self.wait_histogram = [0] * (len(WAIT_BUCKETS) + 1)
+        self.max_wait = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Run a blocking callable in the pool
+
+        Like asyncio.to_thread(), the caller's context variables are visible to
+        the callable.
+
+        Args:
+            func (callable): Blocking function to call
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            The return value of func
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(contextvars.copy_context().run, func, *args, **kwargs)
+        with self._lock:
+            self.queued += 1
+            self.stats['submitted'] += 1
+        return await loop.run_in_executor(self._executor, self._call, call, time.monotonic())
+
+    def _call(self, call, submitted):
+        wait = time.monotonic() - submitted
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self._record_wait(wait)
+        failed = True
+        try:
+            result = call()
+            failed = False
+            return result
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.stats['failed' if failed else 'completed'] += 1
+
+    def _record_wait(self, wait):
+        for index, bound in enumerate(WAIT_BUCKETS):
+            if wait <= bound:
+                break
+        else:
+            index = len(WAIT_BUCKETS)
+        self.wait_histogram[index] += 1
+        if wait > self.max_wait:
+            self.max_wait = wait
+            if wait > WAIT_BUCKETS[-1]:
+                logger.warning(f"{self.name} pool is saturated, a call waited {wait:.1f}s for a worker")
+
+    def shutdown(self):
+        """
+        Stop accepting work and let running calls finish in the background
+        """
+        self._executor.shutdown(wait=False)
+
+    def get_stats(self):
+        """
+        Get pool statistics
+
+        Returns:
+            dict: Active and queued calls, counters and the queue wait histogram
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            histogram = {f"<={bound}s": count for bound, count in zip(WAIT_BUCKETS, self.wait_histogram)}
+            histogram[f">{WAIT_BUCKETS[-1]}s"] = self.wait_histogram[-1]
+            stats.update({
+                'workers': self.workers,
+                'active': self.active,
+                'queued': self.queued,
+                'max_wait': round(self.max_wait, 3),
+                'wait_histogram': histogram,
+            })
+        return stats
+
+
+class ExecutorRegistry:
+    """
+    Registry of the named executors, created on first use
+    """
+    def __init__(self, sizes):
+        """
+        Initialize the registry
+
+        Args:
+            sizes (dict): Pool name to number of workers
+        """
+        self.sizes = sizes
+        self.executors = {}
+
+    def get(self, name):
+        """
+        Get a pool by name
+
+        Args:
+            name (str): Pool name, e.g. "llm", "scraping" or "file_io"
+
+        Returns:
+            NamedExecutor: The pool
+        """
+        executor = self.executors.get(name)
+        if executor is None:
+            if name not in self.sizes:
+                raise KeyError(f"Unknown executor: {name}")
+            executor = self.executors[name] = NamedExecutor(name, self.sizes[name])
+        return executor
+
+    async def run(self, name, func, *args, **kwargs):
+        """
+        Run a blocking callable in the named pool
+
+        Args:
+            name (str): Pool name
+            func (callable): Blocking function to call
+            *args: Positional arguments for func
+            **kwargs: Keyword arguments for func
+
+        Returns:
+            The return value of func
+        """
+        return await self.get(name).run(func, *args, **kwargs)
+
+    def shutdown(self):
+        """
+        Shut down all pools created so far
+        """
+        for executor in self.executors.values():
+            executor.shutdown()
+
+    def get_stats(self):
+        """
+        Get statistics of all pools created so far
+
+        Returns:
+            dict: Pool name to its statistics
+        """
+        return {name: executor.get_stats() for name, executor in self.executors.items()}
+
+
+# Global executor registry instance
+executors = ExecutorRegistry({
+    'llm': config.llm_executor_workers,
+    'scraping': config.scraping_executor_workers,
+    'file_io': config.file_io_executor_workers,
+})
@@ -3,6 +3,61 @@ import io
 import logging
 from abc import ABC, abstractmethod
 
+from api.stream_events import Error, TextDelta, StreamAccumulator
+from core.executors import executors
+
+async def iterate_stream(stream):
+    """
+    Iterate over a response stream without blocking the event loop
+    
+    Native async iterators are consumed directly and closed as soon as the
+    consumer stops, so a cancelled request releases its upstream connection
+    at once. Blocking sync generators are advanced from the LLM executor so a
+    slow provider cannot stall other chats.
+    
+    Args:
+        stream: Async iterator, sync generator or plain iterable
+        
+    Yields:
+        Items produced by the stream
+    """
+    if hasattr(stream, '__aiter__'):
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            aclose = getattr(stream, 'aclose', None)
+            if aclose is not None:
+                await aclose()
+        return
+    
+    iterator = iter(stream)
+    done = object()
+    while True:
+        item = await executors.run('llm', next, iterator, done)
+        if item is done:
+            break
+        yield item
+
+
+async def notify_cancelled(edit, partial_text=""):
+    """
+    Mark a response message as cancelled, keeping the text received so far
+    
+    Best effort with a short timeout, it runs while the request's task is
+    being cancelled and must not hold up shutdown.
+    
+    Args:
+        edit: Async callable that replaces the message text
+        partial_text (str): Response text received before the cancellation
+    """
+    text = f"{partial_text}\n\n[Cancelled]" if partial_text else "Cancelled."
+    try:
+        await asyncio.wait_for(edit(text), 5)
+    except Exception as e:
+        logging.getLogger("stream_handler").warning(f"Could not mark response as cancelled: {e}")
+
+
 class MessageHandler(ABC):
     """
     Unified message handling base class that provides cross-platform message handling functionality
@@ -61,7 +116,7 @@ class StreamHandler:
         
         Args:
             message: Message object
-            stream_generator: Stream response generator
+            stream_generator: Stream of StreamEvent objects
             message_edit_func: Function to edit the message
             send_file_func: Function to send a file
             min_update_interval (float): Minimum update interval (seconds)
@@ -72,9 +127,10 @@ class StreamHandler:
         consecutive_errors = 0
         max_consecutive_errors = 3
         telegram_char_limit = 2500  # Character limit for Telegram message updates
+        events = iterate_stream(stream_generator)
         
         try:
-            all_chunks = []
+            accumulator = StreamAccumulator()
             error_occurred = False
             response_too_long = False
             message_not_modified_error = False
@@ -85,19 +141,22 @@ class StreamHandler:
             
             # Process streaming content
             chunk_counter = 0
-            async for chunk in self._async_generator_from_sync(stream_generator):
-                chunk_counter += 1
+            async for event in events:
+                event = accumulator.add(event)
                 
-                if isinstance(chunk, str) and (chunk.startswith("Error") or chunk.startswith("API returned error")):
-                    error_message = f"Sorry, there was an issue with the API: {chunk}"
+                if isinstance(event, Error):
+                    error_message = f"Sorry, there was an issue with the API: {event}"
                     await message_edit_func(message, error_message)
                     error_occurred = True
-                    self.logger.error(f"API error received: {chunk}")
+                    self.logger.error(f"API error received: {event}")
                     break
                 
-                all_chunks.append(chunk)
-                full_response = chunk
-                current_length = len(full_response)
+                # Reasoning, usage and finish events don't change the visible text
+                if not isinstance(event, TextDelta):
+                    continue
+                
+                chunk_counter += 1
+                current_length = accumulator.length
                 
                 if chunk_counter % 5 == 0 or current_length > telegram_char_limit - 500:
                     self.logger.debug(f"Chunk #{chunk_counter}: Current response length is {current_length} characters")
@@ -124,6 +183,7 @@ class StreamHandler:
                 # Update message at minimum update interval if not too long
                 if time_since_last_update >= min_update_interval and not response_too_long and not telegram_limit_exceeded:
                     try:
+                        full_response = accumulator.text
                         display_text = full_response + "\n\nTyping..."
                         
                         if len(display_text) > self.max_length:
@@ -156,8 +216,8 @@ class StreamHandler:
                                 break
             
             # Process final response
-            if all_chunks and not error_occurred:
-                final_response = all_chunks[-1]
+            if accumulator.length and not error_occurred:
+                final_response = accumulator.text
                 final_length = len(final_response)
                 self.logger.info(f"Stream completed. Final response length: {final_length} characters")
                 
@@ -258,32 +318,38 @@ class StreamHandler:
                 except Exception as e:
                     self.logger.error(f"Error sending no response message: {e}")
                 
+        except asyncio.CancelledError:
+            self.logger.info("Stream processing cancelled")
+            await notify_cancelled(lambda text: message_edit_func(message, text), accumulator.text[:self.max_length - 20])
+            raise
         except Exception as e:
             self.logger.error(f"Error in process_stream_with_updates: {str(e)}")
             try:
                 await message_edit_func(message, f"Error processing stream: {str(e)}")
             except Exception as send_error:
                 self.logger.error(f"Error sending error message: {send_error}")
+        finally:
+            # Close the upstream at once, also when cancelled between two events
+            await events.aclose()
     
     async def process_stream_without_updates(self, stream_generator, split_long_messages=True):
         """
         Process stream response without updating the message, returns the complete response
         
         Args:
-            stream_generator: Stream response generator
+            stream_generator: Stream of StreamEvent objects
             split_long_messages (bool): Whether to split long messages instead of returning a file
             
         Returns:
             str, list, or BytesIO: Complete response text, list of parts, or file object
         """
-        full_response = ""
+        accumulator = StreamAccumulator()
         try:
-            async for chunk in self._async_generator_from_sync(stream_generator):
-                if chunk.startswith("Error") or chunk.startswith("API returned error"):
-                    return f"Sorry, there was an issue with the API: {chunk}"
-                    
-                full_response = chunk
+            async for event in iterate_stream(stream_generator):
+                if isinstance(accumulator.add(event), Error):
+                    return f"Sorry, there was an issue with the API: {event}"
                 
+            full_response = accumulator.text
             if full_response:
                 if len(full_response) > self.max_length and split_long_messages:
                     # Split the message into parts
@@ -366,18 +432,3 @@ class StreamHandler:
             parts[0] = f"[Part 1/{len(parts)}] {parts[0]}"
             
         return parts
-    
-    async def _async_generator_from_sync(self, sync_gen):
-        """
-        Convert a synchronous generator to an asynchronous generator
-        
-        Args:
-            sync_gen: Synchronous generator
-            
-        Yields:
-            Items produced by the generator
-        """
-        loop = asyncio.get_running_loop()
-        for item in sync_gen:
-            yield item
-            await asyncio.sleep(0.01)
\ No newline at end of file
@@ -0,0 +1,160 @@
+import contextvars
+import time
+from contextlib import contextmanager
+
+from core.config import config
+
+_current = contextvars.ContextVar('request_context', default=None)
+
+# Smallest timeout handed to a transport, a socket timeout of 0 means non-blocking
+MIN_TIMEOUT = 0.001
+
+
+class Timeouts:
+    """
+    Transport timeouts for one attempt, in seconds
+    """
+    __slots__ = ('connect', 'first_byte', 'idle', 'total', 'deadline')
+
+    def __init__(self, connect, first_byte, idle, total, deadline=None):
+        """
+        Initialize the timeouts
+
+        Args:
+            connect (float): Timeout for opening the connection
+            first_byte (float): Timeout from sending the request to the response headers
+            idle (float): Timeout between two chunks of the response body
+            total (float): Timeout for a whole non-streaming response
+            deadline (float, optional): time.monotonic() value no read may pass
+        """
+        self.connect = connect
+        self.first_byte = first_byte
+        self.idle = idle
+        self.total = total
+        self.deadline = deadline
+
+    def read_timeout(self):
+        """
+        Get the timeout of the next body read
+
+        Returns:
+            float: The idle timeout, shortened to what is left before the deadline,
+                MIN_TIMEOUT once it passed
+        """
+        if self.deadline is None:
+            return self.idle
+        return max(MIN_TIMEOUT, min(self.idle, self.deadline - time.monotonic()))
+
+
+class RequestContext:
+    """
+    Deadline and origin of one user request
+
+    Created when a command is dispatched and carried in a context variable, so
+    every task, executor call and provider stream started on the request's
+    behalf sees the same absolute deadline without passing it around. The
+    user, chat and command attribute the request's token usage.
+    """
+    def __init__(self, timeout, user_id=None, chat_id=None, command=None):
+        """
+        Initialize the context
+
+        Args:
+            timeout (float): Seconds from now until the request must be answered
+            user_id (int, optional): User who sent the command
+            chat_id (int, optional): Chat the command was sent in
+            command (str, optional): Command name
+        """
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.command = command
+
+    def remaining(self):
+        """
+        Get the time left
+
+        Returns:
+            float: Seconds until the deadline, 0 once it passed
+        """
+        return max(0.0, self.deadline - time.monotonic())
+
+    @property
+    def expired(self):
+        """
+        Whether the deadline has passed
+        """
+        return self.remaining() <= 0
+
+    def can_afford(self, seconds):
+        """
+        Check whether something taking the given time still fits
+
+        Args:
+            seconds (float): Time needed
+
+        Returns:
+            bool: True if at least that much time is left
+        """
+        return self.remaining() >= seconds
+
+
+def get_request_context():
+    """
+    Get the context of the request being served
+
+    Returns:
+        RequestContext: The current context, or None outside a request
+    """
+    return _current.get()
+
+
+@contextmanager
+def use_request_context(context):
+    """
+    Make a context current for the enclosed block
+
+    Tasks created inside the block copy the context variable, so they keep the
+    context after the block ends.
+
+    Args:
+        context (RequestContext): The context
+
+    Yields:
+        RequestContext: The context
+    """
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
+
+
+def get_timeouts():
+    """
+    Get the transport timeouts for an attempt starting now
+
+    The configured connect, first byte and idle timeouts and the request
+    deadline are each shortened to the time left before the current request's
+    deadline.
+
+    Returns:
+        Timeouts: Timeouts to use for the attempt
+    """
+    timeouts = Timeouts(
+        config.llm_connect_timeout,
+        config.llm_first_byte_timeout,
+        config.llm_idle_timeout,
+        config.request_deadline
+    )
+    context = _current.get()
+    if context is not None:
+        # Never zero, which sockets would take as non-blocking mode
+        remaining = max(context.remaining(), MIN_TIMEOUT)
+        timeouts.connect = min(timeouts.connect, remaining)
+        timeouts.first_byte = min(timeouts.first_byte, remaining)
+        timeouts.idle = min(timeouts.idle, remaining)
+        timeouts.total = min(timeouts.total, remaining)
+        timeouts.deadline = context.deadline
+    return timeouts
@@ -0,0 +1,247 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+logger = logging.getLogger("scheduler")
+
+
+class _Ticket:
+    """
+    A request waiting for or holding a scheduler slot
+    """
+    __slots__ = ('key', 'cost', 'priority', 'future', 'on_position', 'last_position')
+
+    def __init__(self, key, cost, priority, future, on_position):
+        self.key = key
+        self.cost = cost
+        self.priority = priority
+        self.future = future
+        self.on_position = on_position
+        self.last_position = None
+
+
+class _DeficitRoundRobin:
+    """
+    Deficit round-robin queue with one FIFO flow per key
+    """
+    def __init__(self, quantum):
+        self.quantum = quantum
+        self.flows = OrderedDict()
+        self.deficits = {}
+        self._turn = None
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.flows.values())
+
+    def push(self, ticket):
+        queue = self.flows.get(ticket.key)
+        if queue is None:
+            queue = self.flows[ticket.key] = deque()
+            self.deficits[ticket.key] = 0
+        queue.append(ticket)
+
+    def pop(self):
+        while self.flows:
+            key, queue = next(iter(self.flows.items()))
+            if key != self._turn:
+                # A flow starting its turn earns one quantum
+                self._turn = key
+                self.deficits[key] += self.quantum
+            ticket = queue[0]
+            if ticket.cost <= self.deficits[key]:
+                self.deficits[key] -= ticket.cost
+                queue.popleft()
+                if not queue:
+                    self._drop(key)
+                return ticket
+            self.flows.move_to_end(key)
+            self._turn = None
+        return None
+
+    def remove(self, ticket):
+        queue = self.flows.get(ticket.key)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                self._drop(ticket.key)
+
+    def _drop(self, key):
+        del self.flows[key]
+        del self.deficits[key]
+        if self._turn == key:
+            self._turn = None
+
+    def position(self, ticket):
+        """
+        Approximate number of tickets served before this one, assuming equal costs
+        """
+        queue = self.flows.get(ticket.key)
+        if queue is None:
+            return 0
+        index = queue.index(ticket)
+        ahead = index
+        # Flows before this one in the rotation get one more turn first
+        before = True
+        for key, other in self.flows.items():
+            if key == ticket.key:
+                before = False
+            else:
+                ahead += min(len(other), index + 1 if before else index)
+        return ahead
+
+
+class FairScheduler:
+    """
+    Fair-share scheduler for LLM requests
+
+    At most `concurrency` requests run at once. Waiting requests are queued per
+    key, typically a (chat, user) pair, and served by deficit round-robin so
+    one busy user cannot starve other chats. Requests in the priority lane,
+    e.g. from the owner or admin chats, are always served first. Waiters get
+    their queue position through a callback, checked for all waiters together
+    every `feedback_interval` seconds and only reported when it changed.
+    """
+    def __init__(self, concurrency=8, quantum=1, feedback_interval=3.0):
+        """
+        Initialize the scheduler
+
+        Args:
+            concurrency (int): Requests allowed to run at the same time
+            quantum (float): Cost credited to a flow per round
+            feedback_interval (float): Seconds between queue position updates
+        """
+        self.concurrency = concurrency
+        self.feedback_interval = feedback_interval
+        self.running = 0
+        self.stats = {'scheduled': 0, 'queued': 0, 'priority': 0}
+        self._lanes = (_DeficitRoundRobin(quantum), _DeficitRoundRobin(quantum))
+        self._feedback_task = None
+
+    async def acquire(self, key, cost=1, priority=False, on_position=None):
+        """
+        Wait for a slot
+
+        Args:
+            key: Flow key, requests with the same key share one fair share
+            cost (float): Cost of the request in quantum units
+            priority (bool): Serve from the priority lane
+            on_position (callable, optional): Async callable receiving the
+                1-based queue position while the request waits
+        """
+        self.stats['scheduled'] += 1
+        if priority:
+            self.stats['priority'] += 1
+        if self.running < self.concurrency and not any(self._lanes):
+            self.running += 1
+            return
+
+        ticket = _Ticket(key, cost, priority, asyncio.get_running_loop().create_future(), on_position)
+        self._lanes[0 if priority else 1].push(ticket)
+        self.stats['queued'] += 1
+        self._ensure_feedback()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # The slot was granted just before the cancellation arrived
+                self.release()
+            else:
+                self._lanes[0 if priority else 1].remove(ticket)
+            raise
+
+    def release(self):
+        """
+        Return a slot and start the next waiting request
+        """
+        self.running -= 1
+        while self.running < self.concurrency:
+            ticket = self._lanes[0].pop() or self._lanes[1].pop()
+            if ticket is None:
+                break
+            if ticket.future.done():
+                continue
+            self.running += 1
+            ticket.future.set_result(None)
+
+    async def stream(self, source, key, cost=1, priority=False, on_position=None):
+        """
+        Iterate over a stream once the scheduler grants a slot
+
+        The slot is held until the stream ends or the consumer stops iterating,
+        and the source is closed right away in either case so a cancelled
+        request releases its upstream connection.
+
+        Args:
+            source: Async generator of stream events, started only after the slot is granted
+            key: Flow key, see acquire()
+            cost (float): Cost of the request in quantum units
+            priority (bool): Serve from the priority lane
+            on_position (callable, optional): Async queue position callback
+
+        Yields:
+            Items of the source stream
+        """
+        try:
+            await self.acquire(key, cost, priority, on_position)
+        except BaseException:
+            await source.aclose()
+            raise
+        try:
+            async for item in source:
+                yield item
+        finally:
+            self.release()
+            await source.aclose()
+
+    def position(self, ticket):
+        """
+        Get the approximate 1-based queue position of a waiting request
+
+        Args:
+            ticket: The waiting request
+
+        Returns:
+            int: Requests expected to start before it, plus one
+        """
+        ahead = self._lanes[0].position(ticket) if ticket.priority else len(self._lanes[0]) + self._lanes[1].position(ticket)
+        return ahead + 1
+
+    def _ensure_feedback(self):
+        if self._feedback_task is None or self._feedback_task.done():
+            self._feedback_task = asyncio.create_task(self._feedback_loop())
+
+    async def _feedback_loop(self):
+        """
+        Report changed queue positions of all waiters in one pass per interval
+        """
+        while any(self._lanes):
+            await asyncio.sleep(self.feedback_interval)
+            updates = []
+            for lane in self._lanes:
+                for queue in list(lane.flows.values()):
+                    for ticket in list(queue):
+                        if ticket.on_position is None:
+                            continue
+                        position = self.position(ticket)
+                        if position != ticket.last_position:
+                            ticket.last_position = position
+                            updates.append(ticket.on_position(position))
+            if updates:
+                for result in await asyncio.gather(*updates, return_exceptions=True):
+                    if isinstance(result, Exception):
+                        logger.warning(f"Failed to report queue position: {result}")
+
+    def get_stats(self):
+        """
+        Get scheduler statistics
+
+        Returns:
+            dict: Running and waiting requests and counters
+        """
+        stats = dict(self.stats)
+        stats.update({
+            'running': self.running,
+            'waiting': len(self._lanes[0]) + len(self._lanes[1]),
+            'waiting_priority': len(self._lanes[0]),
+        })
+        return stats
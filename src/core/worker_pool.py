@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+logger = logging.getLogger("worker_pool")
+
+
+class WorkerPool:
+    """
+    Bounded pool for incoming command work
+
+    At most `workers` jobs run at once and at most `max_queue` more wait for a
+    free worker. Submissions beyond that are refused so the caller can shed
+    load cheaply instead of starting work it cannot finish in time.
+    """
+    def __init__(self, workers=16, max_queue=64):
+        """
+        Initialize the pool
+
+        Args:
+            workers (int): Jobs allowed to run at the same time
+            max_queue (int): Jobs allowed to wait for a worker
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.running = 0
+        self.waiting = 0
+        self.stats = {'accepted': 0, 'shed': 0, 'peak_queue_depth': 0}
+        self._semaphore = asyncio.Semaphore(workers)
+
+    @property
+    def queue_depth(self):
+        """
+        Jobs waiting that cannot start on a free worker right away
+        """
+        return max(0, self.waiting - max(0, self.workers - self.running))
+
+    def submit(self, factory):
+        """
+        Submit a job unless the pool is full
+
+        Args:
+            factory (callable): Returns the job's coroutine, only called once a worker is free
+
+        Returns:
+            asyncio.Task: The job's task, or None if the job was shed
+        """
+        if self.waiting + self.running >= self.workers + self.max_queue:
+            self.stats['shed'] += 1
+            logger.warning(f"Shedding load: {self.running} jobs running, {self.waiting} queued")
+            return None
+        self.stats['accepted'] += 1
+        # Counted here, not in the task, so a burst within one loop iteration sees it
+        self.waiting += 1
+        self.stats['peak_queue_depth'] = max(self.stats['peak_queue_depth'], self.queue_depth)
+        return asyncio.create_task(self._run(factory))
+
+    async def _run(self, factory):
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            return await factory()
+        finally:
+            self.running -= 1
+            self._semaphore.release()
+
+    def get_stats(self):
+        """
+        Get pool statistics
+
+        Returns:
+            dict: Queue depth, running jobs and admission counters
+        """
+        stats = dict(self.stats)
+        stats.update({
+            'queue_depth': self.queue_depth,
+            'running': self.running,
+            'workers': self.workers,
+            'max_queue': self.max_queue,
+        })
+        return stats
@@ -39,16 +39,16 @@ if __name__ == "__main__":
         
         # Register LLM providers
         if config.openai_api_key:
-            llm_client.register_provider('openai', OpenAIProvider(config.openai_api_key))
+            llm_client.register_provider('openai', OpenAIProvider(config.get_api_keys('openai')))
         
         if config.deepseek_api_key:
-            llm_client.register_provider('deepseek', DeepseekProvider(config.deepseek_api_key))
+            llm_client.register_provider('deepseek', DeepseekProvider(config.get_api_keys('deepseek')))
         
         if config.github_api_key:
-            llm_client.register_provider('github', GitHubProvider(config.github_api_key))
+            llm_client.register_provider('github', GitHubProvider(config.get_api_keys('github')))
         
         if config.grok_api_key:
-            llm_client.register_provider('grok', GrokProvider(config.grok_api_key))
+            llm_client.register_provider('grok', GrokProvider(config.get_api_keys('grok')))
         
         return llm_client
     
@@ -10,8 +10,11 @@ from telethon.errors.rpcerrorlist import FloodWaitError
 
 from core.bot_base import BotBase
 from core.config import config
+from core.executors import executors
+from core.request_context import RequestContext, use_request_context
 from core.message_handler import StreamHandler
 from utils.animations import animated_thinking, INITIAL_MESSAGE_ART, SIMPLE_INITIAL_MESSAGE
+from .message_cache import MessageCache
 from .commands import (
     BasicCommandHandler,
     LLMCommandHandler,
@@ -21,6 +24,12 @@ from .commands import (
 
 logger = logging.getLogger("telegram_bot")
 
+def _is_channel_id(chat_id):
+    """
+    Check whether a marked chat ID belongs to a channel or supergroup
+    """
+    return chat_id is not None and chat_id <= -1000000000000
+
 class TelegramBot(BotBase):
     """
     Telegram platform bot implementation
@@ -42,6 +51,13 @@ class TelegramBot(BotBase):
         self.active_tasks = set()  # Set to track active tasks
         self.task_messages = {}  # Dictionary to store task messages
         self.task_start_times = {}  # Dictionary to store task start times
+        self.user_tasks = {}  # (chat_id, sender_id) -> tasks started by that user, for /cancel
+        self.prompt_tasks = {}  # (chat_id, message_id) -> task started by that message, for cancel-on-delete
+        # Recently seen messages, so reply chains resolve without get_messages calls
+        self.message_cache = MessageCache(
+            per_chat=config.message_cache_per_chat,
+            max_bytes=config.message_cache_max_bytes
+        ) if config.reply_context_enabled else None
         self.logger = logger
         self.llm_client = None
     
@@ -83,11 +99,19 @@ class TelegramBot(BotBase):
         """
         Register all command handlers
         """
+        # Cache every message seen, before the command handlers read reply chains
+        if self.message_cache is not None:
+            self.client.add_event_handler(self._on_message_seen, events.NewMessage())
+            self.client.add_event_handler(self._on_message_seen, events.MessageEdited())
+        
         # Register basic command handlers
         basic_handler = BasicCommandHandler(self, self.llm_client)
         await basic_handler.register_handlers()
         self.logger.info("Basic command handlers registered")
         
+        # Cancel commands whose triggering message gets deleted
+        self.client.add_event_handler(self._on_messages_deleted, events.MessageDeleted())
+        
         # Register LLM command handlers
         if self.llm_client:
             self.logger.info("Initializing LLM command handlers")
@@ -122,7 +146,7 @@ class TelegramBot(BotBase):
                                     self.logger.info(f"Task {task_id} completed in {duration:.2f} seconds")
                                 
                                 # Handle any exceptions
-                                if task.exception():
+                                if not task.cancelled() and task.exception():
                                     self.logger.error(f"Task {task_id} failed: {task.exception()}")
                                     if message:
                                         try:
@@ -145,6 +169,11 @@ class TelegramBot(BotBase):
         # Start task monitor
         self.monitor_task = asyncio.create_task(self._monitor_tasks())
         
+        # Resolve and connect to the providers now, so the first request skips DNS and TLS
+        if self.llm_client:
+            self.llm_client.start_keep_warm()
+            self.llm_client.usage.start()
+        
         # Check if we're running in a non-interactive environment (e.g., server)
         is_interactive = os.isatty(sys.stdin.fileno()) if hasattr(sys, 'stdin') and hasattr(sys.stdin, 'fileno') else False
         
@@ -193,6 +222,14 @@ class TelegramBot(BotBase):
                 except asyncio.CancelledError:
                     pass
         
+        if self.llm_client:
+            await self.llm_client.stop_keep_warm()
+            # Writes the usage recorded since the last flush
+            await self.llm_client.usage.stop()
+        
+        # Stop accepting blocking calls, running ones finish in the background
+        executors.shutdown()
+        
         if self.client:
             await self.client.disconnect()
         self.logger.info("Telegram bot stopped")
@@ -287,8 +324,166 @@ class TelegramBot(BotBase):
             raise ValueError("LLM client not initialized")
         
         return asyncio.create_task(
-            asyncio.to_thread(self.llm_client.call_llm, provider, prompt, **kwargs)
+            executors.run('llm', self.llm_client.call_llm, provider, prompt, **kwargs)
+        )
+    
+    async def dispatch(self, event, task_id, factory, prompt=None):
+        """
+        Admit a command into the bounded ingress pool
+        
+        Oversized prompts and prompts of users over their daily token quota
+        are rejected and a full pool sheds the command with a plain "busy"
+        reply, all before any placeholder or upstream work. An admitted
+        command runs under a request context whose deadline bounds every
+        provider call made on its behalf and whose labels attribute its usage.
+        
+        Args:
+            event: Triggering event
+            task_id: Unique ID the task is tracked under
+            factory: Callable returning the command's coroutine
+            prompt: Prompt to check against the length limit (optional)
+            
+        Returns:
+            Task: The command's task, or None if it was rejected
+        """
+        if prompt and len(prompt) > config.max_prompt_chars:
+            await event.reply(
+                f"Your prompt is too long ({len(prompt)} characters, the limit is {config.max_prompt_chars})."
+            )
+            return None
+        
+        limit = config.usage_user_daily_tokens
+        if limit and prompt is not None and self.llm_client and not self._is_priority(event):
+            if self.llm_client.usage.tokens_today(event.sender_id) >= limit:
+                await event.reply("You have used up today's token quota, please try again tomorrow.")
+                return None
+        
+        # The task copies the current context, so everything it runs sees the deadline
+        context = RequestContext(
+            config.request_deadline,
+            user_id=event.sender_id,
+            chat_id=event.chat_id,
+            command=task_id.rsplit('_', 2)[0]
         )
+        with use_request_context(context):
+            task = self.ingress.submit(factory)
+        if task is None:
+            await event.reply("The bot is busy right now, please try again in a minute.")
+            return None
+        
+        # Store the task in the handlers dictionary and track it as active
+        self.handlers[task_id] = task
+        self.active_tasks.add(task)
+        task.add_done_callback(self.active_tasks.discard)
+        task.add_done_callback(lambda t: self.handlers.pop(task_id, None))
+        self._track_cancellable(event, task)
+        return task
+    
+    def _track_cancellable(self, event, task):
+        """
+        Index a command's task by its user and triggering message so /cancel
+        and deleting the message can abort it
+        
+        Args:
+            event: Triggering event
+            task: The command's task
+        """
+        user_key = (event.chat_id, event.sender_id)
+        prompt_key = (event.chat_id, event.id)
+        self.user_tasks.setdefault(user_key, set()).add(task)
+        self.prompt_tasks[prompt_key] = task
+        
+        def untrack(t):
+            tasks = self.user_tasks.get(user_key)
+            if tasks is not None:
+                tasks.discard(t)
+                if not tasks:
+                    del self.user_tasks[user_key]
+            if self.prompt_tasks.get(prompt_key) is t:
+                del self.prompt_tasks[prompt_key]
+        
+        task.add_done_callback(untrack)
+    
+    def cancel_user_tasks(self, chat_id, sender_id):
+        """
+        Cancel a user's in-flight commands in a chat
+        
+        Cancellation propagates through the stream into the provider, which
+        closes its upstream connection instead of reading the rest of the answer.
+        
+        Args:
+            chat_id: Chat ID
+            sender_id: User ID
+            
+        Returns:
+            int: Number of commands cancelled
+        """
+        cancelled = 0
+        for task in list(self.user_tasks.get((chat_id, sender_id), ())):
+            if not task.done():
+                task.cancel()
+                cancelled += 1
+        if cancelled:
+            self.logger.info(f"Cancelled {cancelled} command(s) of user {sender_id} in chat {chat_id}")
+        return cancelled
+    
+    async def _on_message_seen(self, event):
+        """
+        Remember a new or edited message for reply chain lookups
+        
+        Args:
+            event: NewMessage or MessageEdited event
+        """
+        self.message_cache.remember(event.chat_id, event.message)
+    
+    async def _on_messages_deleted(self, event):
+        """
+        Cancel commands whose triggering message was deleted
+        
+        Args:
+            event: MessageDeleted event
+        """
+        for message_id in event.deleted_ids:
+            for (chat_id, prompt_id), task in list(self.prompt_tasks.items()):
+                if prompt_id != message_id or task.done():
+                    continue
+                # Deletions in private chats and basic groups carry no chat ID,
+                # their message IDs are unique outside channels and supergroups
+                if (event.chat_id is None and not _is_channel_id(chat_id)) or event.chat_id == chat_id:
+                    self.logger.info(f"Message {message_id} in chat {chat_id} was deleted, cancelling its command")
+                    task.cancel()
+    
+    def schedule_stream(self, event, stream_generator, response_message=None):
+        """
+        Run an LLM stream through the fair-share scheduler
+        
+        Requests are queued per chat and user, the owner and configured admin
+        chats are served first. While queued, the placeholder message shows
+        the queue position.
+        
+        Args:
+            event: Triggering event
+            stream_generator: Async iterator of stream events, started once a slot is free
+            response_message: Placeholder message for queue position updates (optional)
+            
+        Returns:
+            Async iterator of the stream events
+        """
+        async def show_position(position):
+            await response_message.edit(f"Queued at position {position}, waiting for a free slot...")
+        
+        return self.scheduler.stream(
+            stream_generator,
+            key=(event.chat_id, event.sender_id),
+            priority=self._is_priority(event),
+            on_position=show_position if response_message is not None else None
+        )
+    
+    def _is_priority(self, event):
+        """
+        Check whether an event comes from the owner or a configured admin chat or user
+        """
+        return bool(getattr(event, 'out', False)) or bool({event.chat_id, event.sender_id} & config.llm_priority_ids)
     
     async def handle_llm_request(self, event, provider, prompt, model_name=None, system_prompt=None, display_name=None):
         """
@@ -319,7 +514,9 @@ class TelegramBot(BotBase):
             model = model_name if model_name else provider
             
             # Get appropriate stream generator based on provider
-            stream_generator = self.llm_client.call_llm_stream(provider, prompt, model=model)
+            stream_generator = self.llm_client.call_llm_stream_async(provider, prompt, model=model)
+            
+            stream_generator = self.schedule_stream(event, stream_generator, response_message)
             
             # Process stream and update message - increased update interval to 3.0 seconds to avoid repetition issues
             await MessageHelper.process_stream_with_updates(
@@ -1,6 +1,9 @@
 import asyncio
 import logging
 from telethon.errors.rpcerrorlist import FloodWaitError
+from core.executors import executors
+from core.config import config
+from ..message_cache import build_reply_prompt
 from .utils import MessageHelper, FloodWaitHandler
 
 logger = logging.getLogger("telegram_commands")
@@ -69,6 +72,87 @@ class CommandHandler:
         except Exception as reply_error:
             logger.error(f"Unable to send error message: {reply_error}")
             
+    def schedule_stream(self, event, stream_generator, response_message=None):
+        """
+        Run an LLM stream through the bot's fair-share scheduler, if it has one
+        
+        Args:
+            event: Triggering event
+            stream_generator: Async iterator of stream events
+            response_message: Placeholder message for queue position updates (optional)
+            
+        Returns:
+            Async iterator of the stream events
+        """
+        schedule = getattr(self.client, 'schedule_stream', None)
+        if schedule is None:
+            return stream_generator
+        return schedule(event, stream_generator, response_message)
+    
+    async def open_conversation(self, event):
+        """
+        Find the reply thread a prompt belongs to
+        
+        Args:
+            event: Triggering event
+            
+        Returns:
+            tuple: (thread key, earlier messages of the thread), (None, []) if conversations are disabled
+        """
+        conversations = getattr(self.client, 'conversations', None)
+        if conversations is None:
+            return None, []
+        key = await conversations.thread_for(event.chat_id, event.id, getattr(event, 'reply_to_msg_id', None))
+        return key, await conversations.history(key)
+    
+    async def add_reply_context(self, event, prompt, history=None):
+        """
+        Add the text of the messages a prompt replies to
+        
+        Replies within a conversation already carry its history, so only
+        prompts starting a new thread get the reply chain.
+        
+        Args:
+            event: Triggering event
+            prompt: The user's prompt
+            history: Earlier messages of the prompt's conversation (optional)
+            
+        Returns:
+            str: The prompt followed by the replied-to messages, oldest first
+        """
+        cache = getattr(self.client, 'message_cache', None)
+        reply_to = getattr(event, 'reply_to_msg_id', None)
+        if cache is None or reply_to is None or history:
+            return prompt
+        chain = await cache.reply_chain(
+            self.client.client,
+            event.chat_id,
+            reply_to,
+            max_hops=config.reply_context_max_hops,
+            max_tokens=config.reply_context_max_tokens
+        )
+        return build_reply_prompt(prompt, chain)
+    
+    def record_conversation(self, key, event, prompt, stream_generator, response_message=None, command=None):
+        """
+        Add a stream's answer to its reply thread once the stream completes
+        
+        Args:
+            key: Thread key from open_conversation()
+            event: Triggering event
+            prompt: The user's prompt
+            stream_generator: Async iterator of stream events
+            response_message: Message the answer is shown in (optional)
+            command: Command producing the answer (optional)
+            
+        Returns:
+            Async iterator of the stream events
+        """
+        if key is None:
+            return stream_generator
+        message_ids = (event.id, getattr(response_message, 'id', None))
+        return self.client.conversations.record_stream(key, prompt, stream_generator, message_ids, command)
+    
     async def register_handlers(self):
         """
         Register command handlers, should be implemented by subclasses
@@ -90,5 +174,5 @@ class CommandHandler:
             Task: Async task
         """
         return asyncio.create_task(
-            asyncio.to_thread(llm_client.call_llm, provider, prompt, **kwargs)
+            executors.run('llm', llm_client.call_llm, provider, prompt, **kwargs)
         ) 
\ No newline at end of file
@@ -3,9 +3,9 @@ import platform
 import os
 import logging
 import random
-import asyncio
 from telethon import events
 from telethon.errors.rpcerrorlist import FloodWaitError
+from core.executors import executors
 from .base import CommandHandler
 from ..commands.utils import MessageHelper
 from services.unwire_fetch import fetch_unwire_news, fetch_unwire_recent
@@ -56,6 +56,11 @@ class BasicCommandHandler(CommandHandler):
             events.NewMessage(pattern=r'^/\.env$')
         )
         
+        self.client.add_event_handler(
+            self.cancel_handler,
+            events.NewMessage(pattern=r'^/cancel$')
+        )
+        
         # Modified pattern to support /unwire with optional date parameter
         self.client.add_event_handler(
             self.unwire_handler,
@@ -69,25 +74,18 @@ class BasicCommandHandler(CommandHandler):
         # Create a unique task ID for this command execution
         task_id = f"ping_{event.id}_{int(time.time())}"
         
-        # Create a task for command processing
-        task = asyncio.create_task(self._process_ping(event))
-        
-        # Store the task in the bot's handlers dictionary with the unique task ID
-        self.client.handlers[task_id] = task
-        
-        # Add task to active tasks set
-        self.client.active_tasks.add(task)
-        task.add_done_callback(self.client.active_tasks.discard)
-        task.add_done_callback(lambda t: self.client.handlers.pop(task_id, None))
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_ping(event))
     
-    async def _process_ping(self, event):
-        """Process ping command asynchronously"""
-        start_time = time.time()
-        message = await event.respond("Pinging...")
-        end_time = time.time()
-        latency = round((end_time - start_time) * 1000, 2)
+    def _detect_service_location(self):
+        """
+        Detect the hosting service and location of this machine
+        
+        Blocking: queries cloud metadata endpoints and IP geolocation services.
         
-        # Get service information
+        Returns:
+            tuple: (service, location), "Unknown" where detection failed
+        """
         service = "Unknown"
         location = "Unknown"
         
@@ -182,27 +180,54 @@ class BasicCommandHandler(CommandHandler):
             service = "Unknown"
             location = "Unknown"
         
+        return service, location
+    
+    async def _process_ping(self, event):
+        """Process ping command asynchronously"""
+        start_time = time.time()
+        message = await event.respond("Pinging...")
+        end_time = time.time()
+        latency = round((end_time - start_time) * 1000, 2)
+        
+        # Get service information without blocking the event loop
+        service, location = await executors.run('scraping', self._detect_service_location)
+        
         # Format the response
         response = f"{latency}ms\nService: {service}\nLocation: {location}"
         
+        # Report ingress load
+        ingress = getattr(self.client, 'ingress', None)
+        if ingress is not None:
+            stats = ingress.get_stats()
+            response += f"\nQueue: {stats['queue_depth']} waiting, {stats['running']} running, {stats['shed']} shed"
+        
+        # Report the blocking-call pools
+        for name, stats in executors.get_stats().items():
+            response += f"\nPool {name}: {stats['active']}/{stats['workers']} active, {stats['queued']} queued"
+        
         # Edit the message with the response
         await message.edit(response)
     
+    async def cancel_handler(self, event):
+        """
+        Handle /cancel command - Abort the sender's in-flight commands in this chat
+        
+        Runs directly instead of through the ingress pool so it works even
+        when the pool is full.
+        """
+        cancelled = self.client.cancel_user_tasks(event.chat_id, event.sender_id)
+        if cancelled:
+            await event.reply(f"Cancelled {cancelled} running request(s).")
+        else:
+            await event.reply("Nothing to cancel.")
+    
     async def hi_dog_handler(self, event):
         """Handle /hi_dog command"""
         # Create a unique task ID for this command execution
         task_id = f"hi_dog_{event.id}_{int(time.time())}"
         
-        # Create a task for command processing
-        task = asyncio.create_task(self._process_hi_dog(event))
-        
-        # Store the task in the bot's handlers dictionary with the unique task ID
-        self.client.handlers[task_id] = task
-        
-        # Add task to active tasks set
-        self.client.active_tasks.add(task)
-        task.add_done_callback(self.client.active_tasks.discard)
-        task.add_done_callback(lambda t: self.client.handlers.pop(task_id, None))
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_hi_dog(event))
     
     async def _process_hi_dog(self, event):
         """Process hi_dog command asynchronously"""
@@ -291,16 +316,8 @@ _██_
         # Create a unique task ID for this command execution
         task_id = f"test_{event.id}_{int(time.time())}"
         
-        # Create a task for command processing
-        task = asyncio.create_task(self._process_test(event))
-        
-        # Store the task in the bot's handlers dictionary with the unique task ID
-        self.client.handlers[task_id] = task
-        
-        # Add task to active tasks set
-        self.client.active_tasks.add(task)
-        task.add_done_callback(self.client.active_tasks.discard)
-        task.add_done_callback(lambda t: self.client.handlers.pop(task_id, None))
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_test(event))
     
     async def _process_test(self, event):
         """Process test command asynchronously"""
@@ -316,16 +333,8 @@ _██_
         # Create a unique task ID for this command execution
         task_id = f"env_{event.id}_{int(time.time())}"
         
-        # Create a task for command processing
-        task = asyncio.create_task(self._process_env(event))
-        
-        # Store the task in the bot's handlers dictionary with the unique task ID
-        self.client.handlers[task_id] = task
-        
-        # Add task to active tasks set
-        self.client.active_tasks.add(task)
-        task.add_done_callback(self.client.active_tasks.discard)
-        task.add_done_callback(lambda t: self.client.handlers.pop(task_id, None))
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_env(event))
     
     async def _process_env(self, event):
         """Process env command asynchronously"""
@@ -357,16 +366,8 @@ _██_
         # Create a unique task ID for this command execution
         task_id = f"unwire_{event.id}_{int(time.time())}"
         
-        # Create a task for command processing
-        task = asyncio.create_task(self._process_unwire(event))
-        
-        # Store the task in the bot's handlers dictionary with the unique task ID
-        self.client.handlers[task_id] = task
-        
-        # Add task to active tasks set
-        self.client.active_tasks.add(task)
-        task.add_done_callback(self.client.active_tasks.discard)
-        task.add_done_callback(lambda t: self.client.handlers.pop(task_id, None))
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_unwire(event))
     
     async def _process_unwire(self, event):
         """Process unwire command asynchronously"""
@@ -376,7 +377,7 @@ _██_
             
             # If no date specified, get today's news
             if len(command_text) == 1:
-                news_content = fetch_unwire_news()
+                news_content = await executors.run('scraping', fetch_unwire_news)
             else:
                 # Try to get news for specified date
                 date_str = command_text[1]
@@ -384,7 +385,7 @@ _██_
                 try:
                     from datetime import datetime
                     datetime.strptime(date_str, '%Y-%m-%d')
-                    news_content = fetch_unwire_news(date=date_str)
+                    news_content = await executors.run('scraping', fetch_unwire_news, date=date_str)
                 except ValueError:
                     error_msg = "Invalid date format. Please use YYYY-MM-DD format (e.g., 2025-04-19)."
                     await event.respond(error_msg)
@@ -1,15 +1,28 @@
 import asyncio
 import logging
+from contextlib import aclosing
 from telethon import events
 from telethon.errors.rpcerrorlist import FloodWaitError
 from .base import CommandHandler
 from .utils import MessageHelper
+from api.prompt_templates import prompt_templates
+from core.request_context import get_request_context
+from api.stream_events import Error, TextDelta, StreamAccumulator, collect_stream
 from utils.animations import animated_thinking, INITIAL_MESSAGE_ART, SIMPLE_INITIAL_MESSAGE, THINKING_ANIMATIONS
 import time
 import os
 
 logger = logging.getLogger("telegram_llm_commands")
 
+# Provider and model a plain reply continues each command's thread with
+REPLY_TARGETS = {
+    'gpt': ('openai', "gpt-4.1"),
+    'r1': ('deepseek', "deepseek-reasoner"),
+    'deepseek': ('deepseek', "deepseek-reasoner"),
+    'grok': ('grok', "grok-3"),
+    'grok_think': ('grok', "grok-3"),
+}
+
 class LLMCommandHandler(CommandHandler):
     """
     Handler class for LLM-related commands
@@ -54,9 +67,15 @@ class LLMCommandHandler(CommandHandler):
             events.NewMessage(pattern=r'^/grok_think (.+)')
         )
         
+        # Plain replies to an answer continue its conversation
+        self.client.add_event_handler(
+            self.reply_handler,
+            events.NewMessage(func=self._continues_conversation)
+        )
+        
         logger.info("LLM command handlers registered")
     
-    async def handle_llm_request(self, event, provider, prompt, model_name=None, system_prompt=None, display_name=None):
+    async def handle_llm_request(self, event, provider, prompt, model_name=None, system_prompt=None, display_name=None, command=None):
         """
         Handle LLM request
         
@@ -67,6 +86,7 @@ class LLMCommandHandler(CommandHandler):
             model_name: Model name
             system_prompt: System prompt
             display_name: Display name
+            command: Command name whose fallback chain is used, if any
             
         Returns:
             None
@@ -83,9 +103,21 @@ class LLMCommandHandler(CommandHandler):
                 return
             
             model = model_name if model_name else provider
+            key, history = await self.open_conversation(event)
+            prompt = await self.add_reply_context(event, prompt, history)
             
             # Get appropriate stream generator based on provider
-            stream_generator = self.client.llm_client.call_llm_stream(provider, prompt, model=model)
+            if command:
+                stream_generator = self.client.llm_client.call_llm_stream_with_fallback(
+                    command, provider, prompt, model=model, system_prompt=system_prompt, history=history
+                )
+            else:
+                stream_generator = self.client.llm_client.call_llm_stream_async(
+                    provider, prompt, model=model, system_prompt=system_prompt, history=history
+                )
+            
+            stream_generator = self.record_conversation(key, event, prompt, stream_generator, response_message, command or provider)
+            stream_generator = self.schedule_stream(event, stream_generator, response_message)
             
             # Process stream and update message - increased update interval to 3.0 seconds to avoid repetition issues
             await MessageHelper.process_stream_with_updates(
@@ -118,7 +150,7 @@ class LLMCommandHandler(CommandHandler):
         """
         try:
             # Get stream generator
-            stream_generator = self.llm_client.call_llm_stream(llm_type, prompt, model=model, system_prompt=system_prompt)
+            stream_generator = self.llm_client.call_llm_stream_async(llm_type, prompt, model=model, system_prompt=system_prompt)
             
             # Process stream and update message
             await MessageHelper.process_stream_with_updates(
@@ -142,28 +174,59 @@ class LLMCommandHandler(CommandHandler):
         # Create a unique task ID for this command execution
         task_id = f"deepseek_{event.id}_{int(time.time())}"
         
-        # Create a task for command processing
-        task = asyncio.create_task(self._process_deepseek(event))
-        
-        # Store the task in the bot's handlers dictionary with the unique task ID
-        self.client.handlers[task_id] = task
-        
-        # Add task to active tasks set
-        self.client.active_tasks.add(task)
-        task.add_done_callback(self.client.active_tasks.discard)
-        task.add_done_callback(lambda t: self.client.handlers.pop(task_id, None))
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_deepseek(event), prompt=event.pattern_match.group(1))
     
     async def r1_handler(self, event):
         """Handle the /r1 command"""
         task_id = f"r1_{event.id}_{int(time.time())}"
-        task = asyncio.create_task(self._process_r1(event))
-        self.client.handlers[task_id] = task
-        self.client.active_tasks.add(task)
-        task.add_done_callback(self.client.active_tasks.discard)
-        task.add_done_callback(lambda t: self.client.handlers.pop(task_id, None))
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_r1(event), prompt=event.pattern_match.group(1))
 
     async def grok_handler(self, event):
         """Grok command handler"""
+        task_id = f"grok_{event.id}_{int(time.time())}"
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_grok(event), prompt=event.pattern_match.group(1))
+    
+    async def _continues_conversation(self, event):
+        """
+        Check whether a message is a plain reply to a message of a known conversation
+        """
+        conversations = getattr(self.client, 'conversations', None)
+        text = event.raw_text or ''
+        if conversations is None or not event.is_reply or not text.strip() or text.startswith('/'):
+            return False
+        return await conversations.command(event.chat_id, event.reply_to_msg_id) in REPLY_TARGETS
+    
+    async def reply_handler(self, event):
+        """Handle a plain reply continuing a conversation"""
+        task_id = f"reply_{event.id}_{int(time.time())}"
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_reply(event), prompt=event.raw_text)
+    
+    async def _process_reply(self, event):
+        """Continue a conversation with the command that started it"""
+        command = await self.client.conversations.command(event.chat_id, event.reply_to_msg_id)
+        if command not in REPLY_TARGETS:
+            # The thread expired between the filter and now
+            return
+        provider, model = REPLY_TARGETS[command]
+        context = get_request_context()
+        if context is not None:
+            # Usage of the reply counts towards the command it continues
+            context.command = command
+        await self.handle_llm_request(
+            event,
+            provider,
+            event.raw_text.strip(),
+            model_name=model,
+            system_prompt=prompt_templates.system_prompt(command),
+            command=command
+        )
+    
+    async def _process_grok(self, event):
+        """Process grok command asynchronously"""
         # Get prompt from message
         prompt = event.pattern_match.group(1).strip()
         
@@ -173,18 +236,25 @@ class LLMCommandHandler(CommandHandler):
             return
         
         # Use handle_llm_request for processing
-        system_prompt = "You are a helpful AI assistant called Grok. Always provide clear, detailed and accurate responses."
+        system_prompt = prompt_templates.system_prompt('grok')
         await self.handle_llm_request(
             event, 
             'grok', 
             prompt, 
             system_prompt=system_prompt, 
             model_name="grok-3",
-            display_name="Grok"
+            display_name="Grok",
+            command='grok'
         )
         
     async def grok_think_handler(self, event):
         """Grok thinking mode handler"""
+        task_id = f"grok_think_{event.id}_{int(time.time())}"
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_grok_think(event), prompt=event.pattern_match.group(1))
+    
+    async def _process_grok_think(self, event):
+        """Process grok_think command asynchronously"""
         try:
             # Get prompt
             prompt = event.pattern_match.group(1).strip()
@@ -215,7 +285,6 @@ class LLMCommandHandler(CommandHandler):
             prompt: User prompt
         """
         response_message = None
-        max_retries = 3
         
         try:
             # Send initial response message with animation
@@ -229,9 +298,16 @@ class LLMCommandHandler(CommandHandler):
                 logger.error(f"Error sending initial message: {e}. Using simple message instead.")
                 response_message = await event.respond("Thinking...")
             
-            # Create task for LLM call
+            # Create task for LLM call, collecting the stream so the animation can run meanwhile
+            key, history = await self.open_conversation(event)
+            prompt = await self.add_reply_context(event, prompt, history)
+            stream_generator = self.llm_client.call_llm_stream_with_fallback(
+                'grok_think', 'grok', prompt, model='grok-3', system_prompt=prompt_templates.system_prompt('grok_think'),
+                channel='file', history=history
+            )
+            stream_generator = self.record_conversation(key, event, prompt, stream_generator, response_message, 'grok_think')
             llm_task = asyncio.create_task(
-                self.llm_client.call_llm_stream('grok', prompt, model='grok-3')
+                self._collect_stream(self.schedule_stream(event, stream_generator))
             )
             
             # Start animation and wait for LLM response
@@ -273,6 +349,21 @@ class LLMCommandHandler(CommandHandler):
                 except Exception as additional_error:
                     logger.error(f"Error sending additional error information: {str(additional_error)}")
     
+    async def _collect_stream(self, stream_generator):
+        """
+        Consume an async event stream and return the combined response text
+        
+        Args:
+            stream_generator: Async iterator of StreamEvent objects
+            
+        Returns:
+            str: The complete response, or the error message if the stream failed
+        """
+        accumulator = await collect_stream(stream_generator)
+        if accumulator.error:
+            return f"Error: {accumulator.error}"
+        return accumulator.text
+    
     async def handle_flood_wait_error(self, event, e, response_message=None):
         """
         Handle FloodWaitError error
@@ -329,41 +420,46 @@ class LLMCommandHandler(CommandHandler):
             self.client.task_messages[task_id] = response_message
             self.client.task_start_times[task_id] = time.time()
             
-            # Create an async generator for the stream
-            async def stream_generator():
-                # Get stream generator
-                sync_generator = self.client.llm_client.call_llm_stream(
-                    'deepseek', 
-                    prompt, 
-                    model="deepseek-reasoner",
-                    system_prompt="You are a helpful AI assistant with strong reasoning capabilities. Think through problems step by step and provide detailed, logical explanations with clear reasoning chains."
-                )
-                
-                # Convert sync generator to async
-                for chunk in sync_generator:
-                    if chunk:
-                        yield chunk
-                    # Small delay to allow other coroutines to run
-                    await asyncio.sleep(0)
+            # Stream natively on the event loop so other chats keep updating
+            key, history = await self.open_conversation(event)
+            prompt = await self.add_reply_context(event, prompt, history)
+            stream_generator = self.client.llm_client.call_llm_stream_with_fallback(
+                'r1',
+                'deepseek', 
+                prompt, 
+                model="deepseek-reasoner",
+                system_prompt=prompt_templates.system_prompt('r1'),
+                channel='inline',  # The answer is edited into a single message
+                history=history
+            )
+            
+            stream_generator = self.record_conversation(key, event, prompt, stream_generator, response_message, 'r1')
+            stream_generator = self.schedule_stream(event, stream_generator, response_message)
             
             # Process stream and update message
-            current_text = ""
-            async for chunk in stream_generator():
-                try:
-                    current_text += chunk
-                    # Update message if it's significantly different
-                    if len(current_text) % 50 == 0:  # Update every 50 chars
-                        await response_message.edit(current_text)
-                        await asyncio.sleep(0.1)  # Small delay to prevent rate limiting
+            accumulator = StreamAccumulator()
+            async with aclosing(stream_generator):
+                async for stream_event in stream_generator:
+                    stream_event = accumulator.add(stream_event)
+                    if isinstance(stream_event, Error):
+                        break
+                    if not isinstance(stream_event, TextDelta):
+                        continue
+                    try:
+                        # Update message if it's significantly different
+                        if accumulator.length % 50 == 0:  # Update every 50 chars
+                            await response_message.edit(accumulator.text)
+                            await asyncio.sleep(0.1)  # Small delay to prevent rate limiting
                         
-                except FloodWaitError as e:
-                    await asyncio.sleep(e.seconds)
-                    continue
-                except Exception as e:
-                    logger.error(f"Error updating message: {e}")
-                    continue
+                    except FloodWaitError as e:
+                        await asyncio.sleep(e.seconds)
+                        continue
+                    except Exception as e:
+                        logger.error(f"Error updating message: {e}")
+                        continue
             
             # Final update to ensure we don't miss the last chunk
+            current_text = str(accumulator.error) if accumulator.error else accumulator.text
             if current_text:
                 try:
                     await response_message.edit(current_text)
@@ -397,41 +493,44 @@ class LLMCommandHandler(CommandHandler):
             self.client.task_messages[task_id] = response_message
             self.client.task_start_times[task_id] = time.time()
             
-            # Create an async generator for the stream
-            async def stream_generator():
-                # Get stream generator
-                sync_generator = self.client.llm_client.call_llm_stream(
-                    'deepseek', 
-                    prompt, 
-                    model="deepseek-reasoner",
-                    system_prompt="You are a helpful AI assistant called DeepSeek. Always provide clear, detailed and accurate responses."
-                )
-                
-                # Convert sync generator to async
-                for chunk in sync_generator:
-                    if chunk:
-                        yield chunk
-                    # Small delay to allow other coroutines to run
-                    await asyncio.sleep(0)
+            # Stream natively on the event loop so other chats keep updating
+            key, history = await self.open_conversation(event)
+            prompt = await self.add_reply_context(event, prompt, history)
+            stream_generator = self.client.llm_client.call_llm_stream_async(
+                'deepseek', 
+                prompt, 
+                model="deepseek-reasoner",
+                system_prompt=prompt_templates.system_prompt('deepseek'),
+                history=history
+            )
+            
+            stream_generator = self.record_conversation(key, event, prompt, stream_generator, response_message, 'deepseek')
+            stream_generator = self.schedule_stream(event, stream_generator, response_message)
             
             # Process stream and update message
-            current_text = ""
-            async for chunk in stream_generator():
-                try:
-                    current_text += chunk
-                    # Update message if it's significantly different
-                    if len(current_text) % 50 == 0:  # Update every 50 chars
-                        await response_message.edit(current_text)
-                        await asyncio.sleep(0.1)  # Small delay to prevent rate limiting
+            accumulator = StreamAccumulator()
+            async with aclosing(stream_generator):
+                async for stream_event in stream_generator:
+                    stream_event = accumulator.add(stream_event)
+                    if isinstance(stream_event, Error):
+                        break
+                    if not isinstance(stream_event, TextDelta):
+                        continue
+                    try:
+                        # Update message if it's significantly different
+                        if accumulator.length % 50 == 0:  # Update every 50 chars
+                            await response_message.edit(accumulator.text)
+                            await asyncio.sleep(0.1)  # Small delay to prevent rate limiting
                         
-                except FloodWaitError as e:
-                    await asyncio.sleep(e.seconds)
-                    continue
-                except Exception as e:
-                    logger.error(f"Error updating message: {e}")
-                    continue
+                    except FloodWaitError as e:
+                        await asyncio.sleep(e.seconds)
+                        continue
+                    except Exception as e:
+                        logger.error(f"Error updating message: {e}")
+                        continue
             
             # Final update to ensure we don't miss the last chunk
+            current_text = str(accumulator.error) if accumulator.error else accumulator.text
             if current_text:
                 try:
                     await response_message.edit(current_text)
@@ -482,11 +581,8 @@ class LLMCommandHandler(CommandHandler):
     async def gpt_handler(self, event):
         """Handle the /gpt command"""
         task_id = f"gpt_{event.id}_{int(time.time())}"
-        task = asyncio.create_task(self._process_gpt(event))
-        self.client.handlers[task_id] = task
-        self.client.active_tasks.add(task)
-        task.add_done_callback(self.client.active_tasks.discard)
-        task.add_done_callback(lambda t: self.client.handlers.pop(task_id, None))
+        # Run the command in the bounded ingress pool
+        await self.client.dispatch(event, task_id, lambda: self._process_gpt(event), prompt=event.pattern_match.group(1))
 
     async def _process_gpt(self, event):
         """Process GPT command asynchronously"""
@@ -507,41 +603,45 @@ class LLMCommandHandler(CommandHandler):
             self.client.task_messages[task_id] = response_message
             self.client.task_start_times[task_id] = time.time()
             
-            # Create an async generator for the stream
-            async def stream_generator():
-                # Get stream generator using GitHub API
-                sync_generator = self.client.llm_client.call_llm_stream(
-                    'openai', 
-                    prompt, 
-                    model="gpt-4.1",  # GitHub hosted model
-                    system_prompt="You are GPT, a helpful AI assistant. Always provide clear, detailed and accurate responses."
-                )
-                
-                # Convert sync generator to async
-                for chunk in sync_generator:
-                    if chunk:
-                        yield chunk
-                    # Small delay to allow other coroutines to run
-                    await asyncio.sleep(0)
+            # Stream natively on the event loop so other chats keep updating
+            key, history = await self.open_conversation(event)
+            prompt = await self.add_reply_context(event, prompt, history)
+            stream_generator = self.client.llm_client.call_llm_stream_with_fallback(
+                'gpt',
+                'openai', 
+                prompt, 
+                model="gpt-4.1",  # GitHub hosted model
+                system_prompt=prompt_templates.system_prompt('gpt'),
+                history=history
+            )
+            
+            stream_generator = self.record_conversation(key, event, prompt, stream_generator, response_message, 'gpt')
+            stream_generator = self.schedule_stream(event, stream_generator, response_message)
             
             # Process stream and update message
-            current_text = ""
-            async for chunk in stream_generator():
-                try:
-                    current_text += chunk
-                    # Update message if it's significantly different
-                    if len(current_text) % 50 == 0:  # Update every 50 chars
-                        await response_message.edit(current_text)
-                        await asyncio.sleep(0.1)  # Small delay to prevent rate limiting
+            accumulator = StreamAccumulator()
+            async with aclosing(stream_generator):
+                async for stream_event in stream_generator:
+                    stream_event = accumulator.add(stream_event)
+                    if isinstance(stream_event, Error):
+                        break
+                    if not isinstance(stream_event, TextDelta):
+                        continue
+                    try:
+                        # Update message if it's significantly different
+                        if accumulator.length % 50 == 0:  # Update every 50 chars
+                            await response_message.edit(accumulator.text)
+                            await asyncio.sleep(0.1)  # Small delay to prevent rate limiting
                         
-                except FloodWaitError as e:
-                    await asyncio.sleep(e.seconds)
-                    continue
-                except Exception as e:
-                    logger.error(f"Error updating message: {e}")
-                    continue
+                    except FloodWaitError as e:
+                        await asyncio.sleep(e.seconds)
+                        continue
+                    except Exception as e:
+                        logger.error(f"Error updating message: {e}")
+                        continue
             
             # Final update to ensure we don't miss the last chunk
+            current_text = str(accumulator.error) if accumulator.error else accumulator.text
             if current_text:
                 try:
                     await response_message.edit(current_text)
@@ -5,8 +5,25 @@ import time
 import logging
 from telethon.errors.rpcerrorlist import FloodWaitError
 
+from core.executors import executors
+from core.message_handler import iterate_stream, notify_cancelled
+from api.stream_events import Error, StreamAccumulator
+
 logger = logging.getLogger("telegram_commands_utils")
 
+def _read_file(path):
+    """Read a file's bytes, run in the file I/O executor"""
+    with open(path, "rb") as f:
+        return f.read()
+
+def _write_text_file(path, text):
+    """Write a text file and create its directory, run in the file I/O executor"""
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
 class MessageHelper:
     """
     Utility class for handling Telegram messages
@@ -51,8 +68,7 @@ class MessageHelper:
                 
                 # Try to read file content and send as memory file
                 try:
-                    with open(text, "rb") as f:
-                        file_content = f.read()
+                    file_content = await executors.run('file_io', _read_file, text)
                     file_obj = io.BytesIO(file_content)
                     file_obj.name = os.path.basename(text)
                     
@@ -93,12 +109,8 @@ class MessageHelper:
                 
                 # If still failing, try to save to disk and send the file
                 try:
-                    if not os.path.exists('logs'):
-                        os.makedirs('logs')
-                    
                     file_path = "logs/output.txt"
-                    with open(file_path, "w", encoding="utf-8") as f:
-                        f.write(text)
+                    await executors.run('file_io', _write_text_file, file_path, text)
                     
                     # Wait again to avoid triggering rate limits
                     await asyncio.sleep(2)
@@ -214,27 +226,25 @@ class MessageHelper:
         
         Args:
             message_obj: Telegram message object to update
-            stream_generator: Generator producing text chunks
+            stream_generator: Async iterator or generator producing StreamEvent objects
             min_update_interval: Minimum interval between updates (seconds)
         """
-        full_response = ""
+        accumulator = StreamAccumulator()
         max_retries = 3
         max_message_length = 4096  # Telegram's maximum message length
+        events = iterate_stream(stream_generator)
         
         try:
-            # Collect all chunks into full response
-            for chunk in stream_generator:
-                if chunk is None:
+            # Collect all events into full response
+            async for event in events:
+                if event is None:
                     continue
-                    
-                # Check if chunk contains error message
-                if isinstance(chunk, str) and (chunk.startswith("Error:") or chunk.startswith("Sorry, an error occurred")):
-                    full_response = chunk
+                
+                # Stop at the first error event
+                if isinstance(accumulator.add(event), Error):
                     break
-                    
-                # Add chunk to full response
-                if isinstance(chunk, str):
-                    full_response += chunk
+            
+            full_response = str(accumulator.error) if accumulator.error else accumulator.text
             
             # Handle the complete response
             for retry in range(max_retries):
@@ -261,6 +271,10 @@ class MessageHelper:
                     if retry < max_retries - 1:
                         await asyncio.sleep(1)
                         
+        except asyncio.CancelledError:
+            logger.info("Stream processing cancelled")
+            await notify_cancelled(message_obj.edit, accumulator.text[:max_message_length - 20])
+            raise
         except Exception as e:
             logger.error(f"Error in process_stream_with_updates: {e}")
             for retry in range(max_retries):
@@ -271,6 +285,9 @@ class MessageHelper:
                     logger.error(f"Error sending error message (retry {retry+1}/{max_retries}): {send_error}")
                     if retry < max_retries - 1:
                         await asyncio.sleep(1)
+        finally:
+            # Close the upstream at once, also after an error event or a cancellation
+            await events.aclose()
 
 class FloodWaitHandler:
     """
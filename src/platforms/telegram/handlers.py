@@ -6,8 +6,12 @@ import time
 from telethon import events
 from telethon.errors.rpcerrorlist import FloodWaitError
 
+from core.config import config
 from core.message_handler import MessageHandler
 from core.command_registry import command_registry
+from core.executors import executors
+from core.request_context import get_request_context
+from api.prompt_templates import prompt_templates
 from utils.animations import animated_thinking, INITIAL_MESSAGE_ART, SIMPLE_INITIAL_MESSAGE
 
 logger = logging.getLogger("telegram_handlers")
@@ -68,16 +72,8 @@ class TelegramMessageHandler(MessageHandler):
             # Create a unique task ID for this command execution
             task_id = f"{cmd_name}_{event.id}_{int(time.time())}"
             
-            # Create a task for command processing
-            task = asyncio.create_task(self._process_command_async(cmd_info, event, task_id))
-            
-            # Store the task in the bot's handlers dictionary with the unique task ID
-            self.bot.handlers[task_id] = task
-            
-            # Add task to active tasks set
-            self.bot.active_tasks.add(task)
-            task.add_done_callback(self.bot.active_tasks.discard)
-            task.add_done_callback(lambda t: self.bot.handlers.pop(task_id, None))
+            # Run the command in the bounded ingress pool
+            await self.bot.dispatch(event, task_id, lambda: self._process_command_async(cmd_info, event, task_id), prompt=event.text)
         
         # Store handler reference
         self.bot.handlers[cmd_name] = command_handler
@@ -98,16 +94,8 @@ class TelegramMessageHandler(MessageHandler):
                 # Create a unique task ID for this command execution
                 task_id = f"{cmd_info['name']}_{message.id}_{int(time.time())}"
                 
-                # Create a task for command processing
-                task = asyncio.create_task(self._process_command_async(cmd_info, message, task_id, match=match))
-                
-                # Store the task in the bot's handlers dictionary with the unique task ID
-                self.bot.handlers[task_id] = task
-                
-                # Add task to active tasks set
-                self.bot.active_tasks.add(task)
-                task.add_done_callback(self.bot.active_tasks.discard)
-                task.add_done_callback(lambda t: self.bot.handlers.pop(task_id, None))
+                # Run the command in the bounded ingress pool
+                await self.bot.dispatch(message, task_id, lambda: self._process_command_async(cmd_info, message, task_id, match=match), prompt=message.text)
                 return
             
             # Unknown command
@@ -136,16 +124,8 @@ class TelegramMessageHandler(MessageHandler):
         # Create a unique task ID for this command execution
         task_id = f"{command}_{event.id}_{int(time.time())}"
         
-        # Create a task for command processing
-        task = asyncio.create_task(self._process_command_async(cmd_info, event, task_id, match=match))
-        
-        # Store the task in the bot's handlers dictionary with the unique task ID
-        self.bot.handlers[task_id] = task
-        
-        # Add task to active tasks set
-        self.bot.active_tasks.add(task)
-        task.add_done_callback(self.bot.active_tasks.discard)
-        task.add_done_callback(lambda t: self.bot.handlers.pop(task_id, None))
+        # Run the command in the bounded ingress pool
+        await self.bot.dispatch(event, task_id, lambda: self._process_command_async(cmd_info, event, task_id, match=match), prompt=event.text)
     
     async def _process_command_async(self, cmd_info, event, task_id, **kwargs):
         """
@@ -210,7 +190,8 @@ class TelegramMessageHandler(MessageHandler):
             prompt: Prompt
         """
         from api.llm_client import LLMClient
-        llm_client = LLMClient()
+        # Reuse the bot's client so circuit breaker state is shared between requests
+        llm_client = getattr(self.bot, 'llm_client', None) or LLMClient()
         
         try:
             thinking_msg = await event.reply(INITIAL_MESSAGE_ART)
@@ -223,13 +204,11 @@ class TelegramMessageHandler(MessageHandler):
             thinking_msg = await event.reply(SIMPLE_INITIAL_MESSAGE)
         
         error_occurred = False
-        max_retries = 3
-        retry_delay = 2
         
         try:
             if llm_client.environment.lower() == 'test':
                 test_task = asyncio.create_task(
-                    asyncio.to_thread(llm_client._call_test, prompt)
+                    executors.run('llm', llm_client._call_test, prompt)
                 )
                 response = await animated_thinking(thinking_msg, test_task)
                 await self.bot.safe_send_message(thinking_msg, response)
@@ -242,85 +221,31 @@ class TelegramMessageHandler(MessageHandler):
                 return
                 
             model = "grok-3-reasoner"
-            system_prompt = "You are a helpful AI assistant with reasoning capabilities. Think through problems step by step and explore different aspects of the question. Format your response clearly with proper spacing, line breaks, and structure. Use markdown-style formatting like *bold*, _italic_, and `code` for emphasis. Use numbered lists (1., 2., 3.) and bullet points (- or *) for lists. Ensure your response is well-structured and easy to read."
+            system_prompt = prompt_templates.system_prompt('grok_think')
             
             # Start animation
             animation_task = asyncio.create_task(self._show_limited_thinking_animation(thinking_msg))
             
-            # Try using Grok API
-            grok_success = False
-            for attempt in range(max_retries):
-                try:
-                    # Set timeout for API call
-                    stream_generator = llm_client.call_llm_stream('grok', prompt, system_prompt=system_prompt, model_name=model)
-                    
-                    # Cancel animation when we get the first response
-                    animation_task.cancel()
-                    
-                    # Process the stream with timeout
-                    async with asyncio.timeout(60):  # 60 second timeout
-                        await self.bot.stream_handler.process_stream_with_updates(
-                            thinking_msg, 
-                            stream_generator,
-                            self.bot.edit_message,
-                            lambda msg, file: msg.edit(file=file)
-                        )
-                    grok_success = True
-                    return  # If successful, return directly
-                    
-                except Exception as e:
-                    error_str = str(e)
-                    if "502" in error_str:
-                        if attempt < max_retries - 1:
-                            retry_wait = retry_delay * (2 ** attempt)  # Exponential backoff
-                            try:
-                                await thinking_msg.edit(f"Server error 502, retrying in {retry_wait} seconds... (attempt {attempt + 1}/{max_retries})")
-                            except Exception as edit_error:
-                                logger.error(f"Error editing message during retry: {edit_error}")
-                            await asyncio.sleep(retry_wait)
-                            continue
-                        else:
-                            # All retries have failed
-                            try:
-                                await thinking_msg.edit("Grok API is currently unavailable. Switching to DeepSeek model...")
-                            except Exception as edit_error:
-                                logger.error(f"Error editing message after all retries: {edit_error}")
-                            break
-                    elif "Content of the message was not modified" in error_str:
-                        # If it's a message not modified error, try using the backup model
-                        logger.info("Message not modified error detected. Switching to DeepSeek model...")
-                        try:
-                            await thinking_msg.edit("Message update error. Switching to DeepSeek model...")
-                        except Exception as edit_error:
-                            logger.error(f"Error editing message for model switch: {edit_error}")
-                        break
-                    else:
-                        error_msg = f"Sorry, an error occurred: {str(e)}"
-                        await self.bot.safe_send_message(thinking_msg, error_msg, event=event)
-                        error_occurred = True
-                        break
+            # The grok_think fallback chain fails over to DeepSeek when Grok is down
+            stream_generator = llm_client.call_llm_stream_with_fallback(
+                'grok_think', 'grok', prompt, system_prompt=system_prompt, model_name=model, channel='file'
+            )
+            if hasattr(self.bot, 'schedule_stream'):
+                stream_generator = self.bot.schedule_stream(event, stream_generator)
+            
+            # Cancel animation when we get the first response
+            animation_task.cancel()
             
-            # If Grok API failed, try using backup model
-            if not grok_success:
-                try:
-                    # Use DeepSeek as a backup model
-                    model = "deepseek-coder-33b-instruct"
-                    stream_generator = llm_client.call_llm_stream('deepseek', prompt, model=model, mode="reasoner")
-                    
-                    # Process streaming response
-                    await self.bot.stream_handler.process_stream_with_updates(
-                        thinking_msg, 
-                        stream_generator,
-                        self.bot.edit_message,
-                        lambda msg, file: msg.edit(file=file)
-                    )
-                    return
-                    
-                except Exception as e:
-                    error_msg = f"Both Grok API and DeepSeek model failed. Error: {str(e)}"
-                    await self.bot.safe_send_message(thinking_msg, error_msg, event=event)
-                    error_occurred = True
-                    
+            # Bounded by the request deadline set at dispatch
+            context = get_request_context()
+            async with asyncio.timeout(context.remaining() if context else config.request_deadline):
+                await self.bot.stream_handler.process_stream_with_updates(
+                    thinking_msg, 
+                    stream_generator,
+                    self.bot.edit_message,
+                    lambda msg, file: msg.edit(file=file)
+                )
+                
         except FloodWaitError as e:
             wait_seconds = e.seconds
             logger.warning(f"FloodWaitError when updating response: {wait_seconds} seconds wait required")
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from api.token_budget import token_estimator, trim_middle
+
+logger = logging.getLogger("telegram_message_cache")
+
+# Bytes of bookkeeping counted per cached message
+ENTRY_OVERHEAD = 120
+
+
+class CachedMessage:
+    """
+    The parts of a Telegram message needed to follow reply chains
+    """
+    __slots__ = ('message_id', 'text', 'reply_to', 'sender_id', 'out')
+
+    def __init__(self, message_id, text, reply_to=None, sender_id=None, out=False):
+        self.message_id = message_id
+        self.text = text
+        self.reply_to = reply_to
+        self.sender_id = sender_id
+        self.out = out
+
+    @classmethod
+    def from_message(cls, message):
+        """
+        Build an entry from a Telethon message
+
+        Args:
+            message: Telethon Message
+
+        Returns:
+            CachedMessage: The entry
+        """
+        return cls(
+            message.id,
+            message.raw_text or '',
+            getattr(message, 'reply_to_msg_id', None),
+            getattr(message, 'sender_id', None),
+            bool(getattr(message, 'out', False))
+        )
+
+    @property
+    def size(self):
+        return len(self.text.encode('utf-8')) + ENTRY_OVERHEAD
+
+
+class MessageCache:
+    """
+    Recently seen messages of every chat, so reply chains resolve without MTProto calls
+
+    The cache is filled from the NewMessage and MessageEdited updates the bot
+    receives anyway. Each chat keeps its latest messages, and all chats share a
+    memory cap enforced by evicting the least recently active chat's oldest
+    messages. Messages that are not cached, e.g. ones sent before the bot
+    started, are fetched with get_messages(). Misses of concurrent lookups in
+    the same chat are collected into one batched call.
+    """
+    def __init__(self, per_chat=200, max_bytes=32 * 1024 * 1024):
+        """
+        Initialize the cache
+
+        Args:
+            per_chat (int): Messages kept per chat
+            max_bytes (int): Memory cap for all chats
+        """
+        self.per_chat = per_chat
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'fetches': 0, 'fetch_errors': 0, 'evictions': 0}
+        self._chats = OrderedDict()  # chat_id -> OrderedDict(message_id -> CachedMessage), least recently active first
+        self._size = 0
+        self._pending = {}  # (chat_id, message_id) -> future of a queued or running fetch
+        self._batches = {}  # chat_id -> message IDs waiting for the next fetch
+        self._tasks = set()
+
+    def remember(self, chat_id, message):
+        """
+        Add or update a message
+
+        Args:
+            chat_id (int): Chat ID
+            message: Telethon Message
+
+        Returns:
+            CachedMessage: The cached entry
+        """
+        return self._put(chat_id, CachedMessage.from_message(message))
+
+    def _put(self, chat_id, entry):
+        messages = self._chats.get(chat_id)
+        if messages is None:
+            messages = self._chats[chat_id] = OrderedDict()
+        else:
+            self._chats.move_to_end(chat_id)
+        old = messages.pop(entry.message_id, None)
+        if old is not None:
+            self._size -= old.size
+        messages[entry.message_id] = entry
+        self._size += entry.size
+        # Message IDs only grow, so insertion order is close enough to age
+        while len(messages) > self.per_chat:
+            self._size -= messages.popitem(last=False)[1].size
+            self.stats['evictions'] += 1
+        while self._size > self.max_bytes and self._chats:
+            oldest_chat = next(iter(self._chats))
+            oldest = self._chats[oldest_chat]
+            self._size -= oldest.popitem(last=False)[1].size
+            self.stats['evictions'] += 1
+            if not oldest:
+                del self._chats[oldest_chat]
+        return entry
+
+    def peek(self, chat_id, message_id):
+        """
+        Look up a cached message without fetching
+
+        Args:
+            chat_id (int): Chat ID
+            message_id (int): Message ID
+
+        Returns:
+            CachedMessage: The entry, or None if not cached
+        """
+        messages = self._chats.get(chat_id)
+        return messages.get(message_id) if messages is not None else None
+
+    async def get(self, client, chat_id, message_id):
+        """
+        Get a message, fetching it on a cache miss
+
+        Args:
+            client: Telethon client used for fetches
+            chat_id (int): Chat ID
+            message_id (int): Message ID
+
+        Returns:
+            CachedMessage: The entry, or None if the message does not exist or the fetch failed
+        """
+        entry = self.peek(chat_id, message_id)
+        if entry is not None:
+            self.stats['hits'] += 1
+            return entry
+        self.stats['misses'] += 1
+        key = (chat_id, message_id)
+        future = self._pending.get(key)
+        if future is None:
+            future = self._pending[key] = asyncio.get_running_loop().create_future()
+            batch = self._batches.setdefault(chat_id, [])
+            batch.append(message_id)
+            if len(batch) == 1:
+                # Runs on the next loop iteration, after concurrent lookups queued their misses
+                task = asyncio.create_task(self._fetch(client, chat_id))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        # Shielded so one cancelled lookup does not fail the others waiting on the fetch
+        return await asyncio.shield(future)
+
+    async def _fetch(self, client, chat_id):
+        message_ids = self._batches.pop(chat_id, [])
+        self.stats['fetches'] += 1
+        try:
+            messages = await client.get_messages(chat_id, ids=message_ids)
+        except Exception as e:
+            logger.warning(f"Could not fetch {len(message_ids)} message(s) of chat {chat_id}: {e}")
+            self.stats['fetch_errors'] += 1
+            messages = []
+        found = {message.id: message for message in messages if message is not None}
+        for message_id in message_ids:
+            future = self._pending.pop((chat_id, message_id), None)
+            entry = self.remember(chat_id, found[message_id]) if message_id in found else None
+            if future is not None and not future.done():
+                future.set_result(entry)
+
+    async def reply_chain(self, client, chat_id, reply_to, max_hops=5, max_tokens=2000):
+        """
+        Collect the messages a prompt replies to, following the chain upwards
+
+        Args:
+            client: Telethon client used for fetches
+            chat_id (int): Chat ID
+            reply_to (int): ID of the message the prompt replies to
+            max_hops (int): Most replies to follow upwards
+            max_tokens (int): Token budget of the collected texts
+
+        Returns:
+            list: CachedMessage entries with text, oldest first; the nearest
+                one is trimmed if it alone exceeds the budget
+        """
+        chain = []
+        tokens = 0
+        seen = set()
+        while reply_to is not None and len(seen) < max_hops and reply_to not in seen:
+            seen.add(reply_to)
+            entry = await self.get(client, chat_id, reply_to)
+            if entry is None:
+                break
+            reply_to = entry.reply_to
+            if not entry.text:
+                continue
+            entry_tokens = token_estimator.estimate(entry.text)
+            if tokens + entry_tokens > max_tokens:
+                if not chain:
+                    text = trim_middle(entry.text, int(len(entry.text) * max_tokens / entry_tokens))
+                    chain.append(CachedMessage(entry.message_id, text, entry.reply_to, entry.sender_id, entry.out))
+                break
+            chain.append(entry)
+            tokens += entry_tokens
+        chain.reverse()
+        return chain
+
+    def get_stats(self):
+        """
+        Get cache statistics
+
+        Returns:
+            dict: Hit, miss and fetch counters, chats, messages and bytes held
+        """
+        return dict(
+            self.stats,
+            chats=len(self._chats),
+            messages=sum(len(messages) for messages in self._chats.values()),
+            bytes=self._size
+        )
+
+
+def build_reply_prompt(prompt, chain):
+    """
+    Add the text of the replied-to messages to a prompt
+
+    Args:
+        prompt (str): The user's prompt
+        chain (list): CachedMessage entries from reply_chain(), oldest first
+
+    Returns:
+        str: The prompt followed by the quoted messages, unchanged if the chain is empty
+    """
+    if not chain:
+        return prompt
+    quoted = "\n\n".join(f"[Message {index}]\n{entry.text}" for index, entry in enumerate(chain, 1))
+    return f"{prompt}\n\nThe request refers to this conversation, oldest message first:\n\n{quoted}"